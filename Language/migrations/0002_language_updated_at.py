@@ -0,0 +1,18 @@
+# Generated by Django 5.1.5 on 2026-10-18 13:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("Language", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="language",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
@@ -2,6 +2,7 @@ from django.db import models
 
 class Language(models.Model):
     name = models.CharField(max_length=100, unique=True)  # نام زبان
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)  # تاریخ آخرین تغییر
 
     def __str__(self):
         return self.name
@@ -1,7 +1,8 @@
 from rest_framework import serializers
+from book_store.serializers import SparseFieldsetMixin
 from .models import Language
 
-class LanguageSerializer(serializers.ModelSerializer):
+class LanguageSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = Language
         fields = ['id', 'name']  # مشخص می‌کنیم که کدام فیلدها باید در API نمایش داده بشن
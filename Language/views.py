@@ -1,6 +1,7 @@
 from rest_framework import status, generics
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
+from book_store.conditional import conditional_catalog_get, list_view_state
 from .models import Language
 from .serializers import LanguageSerializer
 
@@ -21,6 +22,7 @@ class LanguageListCreateAPIView(generics.ListCreateAPIView):
             return Response({"پیام": "شما اجازه ایجاد زبان را ندارید"}, status=status.HTTP_403_FORBIDDEN)
         return super().create(request, *args, **kwargs)
 
+    @conditional_catalog_get(list_view_state)
     def list(self, request, *args, **kwargs):
         response = super().list(request, *args, **kwargs)
         return Response({"پیام": "لیست زبان‌ها دریافت شد", "داده‌ها": response.data}, status=response.status_code)
@@ -3,12 +3,15 @@ from .models import User
 from django.core.exceptions import ValidationError
 
 from rest_framework import serializers
+from book_store.images import ImageDerivativesField
 from .models import User
 
 class UserSerializer(serializers.ModelSerializer):
+    profile_picture_srcset = ImageDerivativesField(source='profile_picture')
+
     class Meta:
         model = User
-        fields = ['id', 'username', 'email', 'is_online', 'last_seen', 'profile_picture', 'bio']
+        fields = ['id', 'username', 'email', 'is_online', 'last_seen', 'profile_picture', 'profile_picture_srcset', 'bio']
 
     def validate_username(self, value):
         if User.objects.filter(username=value).exists():
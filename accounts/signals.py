@@ -0,0 +1,15 @@
+from django.db.models.signals import post_init, post_save
+from django.dispatch import receiver
+from book_store.images import image_changed, remember_image_name, schedule_derivatives
+from .models import User
+
+receiver(post_init, sender=User)(remember_image_name)
+
+
+@receiver(post_save, sender=User)
+def schedule_profile_picture_derivatives(sender, instance, update_fields=None, **kwargs):
+    """
+    Resizes a newly uploaded profile picture in the background (see book_store.images).
+    """
+    if image_changed(instance, 'profile_picture', update_fields):
+        schedule_derivatives(instance.profile_picture)
@@ -2,6 +2,7 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import AllowAny
+from django.contrib.auth import user_logged_in
 from django.utils import timezone
 from datetime import timedelta
 import random
@@ -84,6 +85,8 @@ class VerifyOTPView(APIView):
             user.otp = None
             user.otp_expiration = None
             user.save()
+            # JWT logins do not send the login signal themselves (it merges the visitor's cart, for one)
+            user_logged_in.send(sender=user.__class__, request=request, user=user)
 
             # Generate JWT tokens for the user
             refresh = RefreshToken.for_user(user)
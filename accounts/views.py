@@ -3,7 +3,7 @@ from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from django.contrib.auth import authenticate, login
+from django.contrib.auth import authenticate, login, user_logged_in
 from django.core.mail import send_mail
 from django.contrib.auth.tokens import default_token_generator
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
@@ -314,6 +314,8 @@ class OTPVerifyAPIView(APIView):
                 user.otp = None  # OTP را پاک می‌کنیم
                 user.otp_expiration = None  # انقضای OTP را پاک می‌کنیم
                 user.save()
+                # ورود با JWT سیگنال ورود را ارسال نمی‌کند (مثلاً برای ادغام سبد خرید مهمان)
+                user_logged_in.send(sender=user.__class__, request=request, user=user)
 
                 # بازگرداندن توکن‌ها و نام کاربری در پاسخ
                 return Response({
@@ -0,0 +1,62 @@
+# Generated by Django 5.1.5 on 2026-10-18 15:02
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.db import migrations, models
+from django.db.models.functions import Collate
+
+AUTOCOMPLETE_INDEX = django.contrib.postgres.indexes.GinIndex(
+    django.contrib.postgres.indexes.OpClass(
+        django.db.models.functions.text.Upper("first_name"), name="gin_trgm_ops"
+    ),
+    django.contrib.postgres.indexes.OpClass(
+        django.db.models.functions.text.Upper("last_name"), name="gin_trgm_ops"
+    ),
+    name="author_name_trgm",
+)
+
+# SQLite can serve case-insensitive prefix LIKEs from NOCASE b-tree indexes.
+SQLITE_INDEXES = [
+    models.Index(Collate("first_name", "NOCASE"), name="author_first_name_nocase"),
+    models.Index(Collate("last_name", "NOCASE"), name="author_last_name_nocase"),
+]
+
+
+def create_autocomplete_indexes(apps, schema_editor):
+    model = apps.get_model("authors", "Author")
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.add_index(model, AUTOCOMPLETE_INDEX)
+    elif schema_editor.connection.vendor == "sqlite":
+        for index in SQLITE_INDEXES:
+            schema_editor.add_index(model, index)
+
+
+def drop_autocomplete_indexes(apps, schema_editor):
+    model = apps.get_model("authors", "Author")
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.remove_index(model, AUTOCOMPLETE_INDEX)
+    elif schema_editor.connection.vendor == "sqlite":
+        for index in SQLITE_INDEXES:
+            schema_editor.remove_index(model, index)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("authors", "0001_initial"),
+        ("books", "0015_book_autocomplete_indexes"),
+    ]
+
+    # Both kinds of index exist on one backend only, so neither is part of the
+    # model state: table rebuilds on SQLite would otherwise try to create the
+    # GIN index. books.autocomplete restores the NOCASE ones after such rebuilds.
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[],
+            database_operations=[
+                migrations.RunPython(
+                    create_autocomplete_indexes, drop_autocomplete_indexes
+                ),
+            ],
+        ),
+    ]
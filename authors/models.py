@@ -19,6 +19,7 @@ class Author(models.Model):
     languages = models.ManyToManyField(Language, related_name='authors', blank=True)
     website = models.URLField(null=True, blank=True)
     genres = models.ManyToManyField(Genre, related_name='authors')
+    updated_at = models.DateTimeField(auto_now=True)  # تاریخ آخرین تغییر
 
     def __str__(self):
         return f'{self.first_name} {self.last_name}'
@@ -1,14 +1,17 @@
 # serializers.py
 from rest_framework import serializers
+from book_store.images import ImageDerivativesField
+from book_store.serializers import SparseFieldsetMixin
 from .models import Author
 from Language.serializers import LanguageSerializer
 from genres.serializers import GenreSerializer
 
 
-class AuthorSerializer(serializers.ModelSerializer):
+class AuthorSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     # استفاده از سریالایزر برای فیلدهای Many-to-Many
     languages = LanguageSerializer(many=True, read_only=True)
     genres = GenreSerializer(many=True, read_only=True)
+    profile_picture_srcset = ImageDerivativesField(source='profile_picture')  # نسخه‌های کوچک‌شده عکس پروفایل
 
     class Meta:
         model = Author
@@ -5,6 +5,7 @@ from .models import Author
 from .serializers import AuthorSerializer
 from genres.models import Genre
 from Language.models import Language
+from book_store.cache import cache_catalog_response
 
 # ویو برای لیست نویسندگان
 class AuthorListView(generics.ListAPIView):
@@ -12,12 +13,14 @@ class AuthorListView(generics.ListAPIView):
     serializer_class = AuthorSerializer
     permission_classes = []  # تمام کاربران می‌توانند به این ویو دسترسی داشته باشند
 
+    @cache_catalog_response('authors')
     def list(self, request, *args, **kwargs):
         queryset = self.get_queryset()  # دریافت تمام نویسندگان
-        if not queryset:
+        if not queryset.exists():
             return Response({"error": "هیچ نویسنده‌ای پیدا نشد."}, status=status.HTTP_404_NOT_FOUND)
-        serializer = self.get_serializer(queryset, many=True)  # سریالیز کردن نویسندگان
-        return Response({"success": "نویسندگان با موفقیت دریافت شدند.", "data": serializer.data})
+        page = self.paginate_queryset(queryset)  # فقط یک صفحه از نویسندگان
+        serializer = self.get_serializer(page, many=True)  # سریالیز کردن نویسندگان
+        return Response({"success": "نویسندگان با موفقیت دریافت شدند.", "data": serializer.data, **self.paginator.get_links()})
 
 # ویو برای دریافت یک نویسنده با استفاده از ID
 class AuthorRetrieveView(generics.RetrieveAPIView):
@@ -25,6 +28,7 @@ class AuthorRetrieveView(generics.RetrieveAPIView):
     serializer_class = AuthorSerializer
     permission_classes = []  # تمام کاربران می‌توانند به این ویو دسترسی داشته باشند
 
+    @cache_catalog_response('authors')
     def retrieve(self, request, *args, **kwargs):
         try:
             author = self.get_object()  # دریافت نویسنده بر اساس ID
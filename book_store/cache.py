@@ -0,0 +1,247 @@
+import hashlib
+import json
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.response import Response
+
+from .db_router import read_from_replica, replica_aliases
+
+# Cached catalog endpoints. `books` holds every book list (list, search,
+# discount, price-asc/desc), `book` the book detail pages, and `facets` and
+# `autocomplete` the facet counts and hot-prefix suggestions (which follow
+# the `books` version). `entities` holds the rendered authors, translators,
+# publishers, genres and languages of the fast book serializer, and
+# `discounts` the code lookups and applicability rules of discounts.
+CATALOG_NAMESPACES = (
+    'books', 'book', 'authors', 'genres', 'publishers', 'facets', 'autocomplete', 'entities', 'discounts',
+)
+
+# Seconds each namespace is kept; overridable through settings.CATALOG_CACHE_TIMEOUTS.
+DEFAULT_TIMEOUTS = {
+    'books': 60 * 5,
+    'book': 60 * 15,
+    'authors': 60 * 30,
+    'genres': 60 * 60,
+    'publishers': 60 * 60,
+    'facets': 60 * 5,
+    'autocomplete': 60 * 10,
+    'entities': 60 * 60,
+    'discounts': 60 * 60,
+}
+
+KEY_PREFIX = 'catalog'
+
+# Past this many books, one namespace-wide bump is cheaper than a bump per book.
+MAX_BOOK_BUMPS = 100
+
+
+def _version_key(namespace, object_id=None):
+    if object_id is None:
+        return f'{KEY_PREFIX}:version:{namespace}'
+    return f'{KEY_PREFIX}:version:{namespace}:{object_id}'
+
+
+def _bumped_key(namespace, object_id=None):
+    return _version_key(namespace, object_id).replace(':version:', ':bumped:', 1)
+
+
+def _counter_key(namespace, outcome):
+    return f'{KEY_PREFIX}:stats:{namespace}:{outcome}'
+
+
+def _increment(key, initial, delta=1):
+    """
+    Atomically increments a counter by `delta`, starting it at `initial` when it
+    does not exist (or was evicted).
+    """
+    if cache.add(key, initial, timeout=None):
+        return
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        cache.set(key, initial, timeout=None)
+
+
+def get_timeout(namespace):
+    return getattr(settings, 'CATALOG_CACHE_TIMEOUTS', {}).get(namespace, DEFAULT_TIMEOUTS[namespace])
+
+
+def _versions(namespace, object_id=None):
+    keys = [_version_key(namespace)]
+    if object_id is not None:
+        keys.append(_version_key(namespace, object_id))
+    stored = cache.get_many(keys)
+    missing = {key: time.time_ns() for key in keys if key not in stored}
+    for key, value in missing.items():
+        # A fresh (or evicted) version starts at the current time, so it never
+        # matches a key an older version was cached under.
+        if not cache.add(key, value, timeout=None):
+            missing[key] = cache.get(key, value)
+    stored.update(missing)
+    return [stored[key] for key in keys]
+
+
+def replica_max_lag():
+    return getattr(settings, 'REPLICA_MAX_LAG', 5)
+
+
+def _bump(namespaces, book_ids):
+    for namespace in namespaces:
+        _increment(_version_key(namespace), time.time_ns())
+    for book_id in book_ids:
+        _increment(_version_key('book', book_id), time.time_ns())
+    if replica_aliases():
+        # Replicas may not have the write yet; see _replica_may_be_stale().
+        now = time.time()
+        bumped = [_bumped_key(namespace) for namespace in namespaces]
+        bumped += [_bumped_key('book', book_id) for book_id in book_ids]
+        cache.set_many(dict.fromkeys(bumped, now), int(replica_max_lag()) + 1)
+
+
+def _replica_may_be_stale(namespace, object_id=None):
+    """
+    Whether the current request read from a replica within REPLICA_MAX_LAG
+    seconds of an invalidation of `namespace` (or of the object): what it
+    rendered may predate the write, and must not be cached under the new version.
+    """
+    if not read_from_replica():
+        return False
+    keys = [_bumped_key(namespace)]
+    if object_id is not None:
+        keys.append(_bumped_key(namespace, object_id))
+    bumped = cache.get_many(keys).values()
+    return any(time.time() - when < replica_max_lag() for when in bumped)
+
+
+def invalidate_catalog(*namespaces, book_ids=()):
+    """
+    Invalidates every cached response of `namespaces` and the detail pages of
+    `book_ids`, by moving their version forward.
+
+    Inside a transaction the versions are bumped again on commit, so a response
+    rendered from the not-yet-committed state by another request is not kept.
+    """
+    book_ids = [book_id for book_id in book_ids if book_id is not None]
+    if len(book_ids) > MAX_BOOK_BUMPS:
+        namespaces, book_ids = (*namespaces, 'book'), []
+    _bump(namespaces, book_ids)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: _bump(namespaces, book_ids))
+
+
+def response_cache_key(namespace, request, object_id=None):
+    """
+    Normalizes the request (host, path and the sorted query parameters) and
+    combines it with the current versions of the namespace and object.
+    """
+    params = sorted((name, sorted(values)) for name, values in request.query_params.lists())
+    raw = json.dumps(
+        [request.get_host(), request.path, params, _versions(namespace, object_id)],
+        separators=(',', ':'),
+    )
+    return f'{KEY_PREFIX}:response:{namespace}:{hashlib.md5(raw.encode("utf-8")).hexdigest()}'
+
+
+def cache_catalog_response(namespace, object_kwarg=None):
+    """
+    Caches successful anonymous GET responses of a catalog view handler.
+
+    `object_kwarg` names the URL kwarg of a detail view, whose cached response
+    is then also invalidated by changes to that single object.
+    """
+    def decorator(handler):
+        @wraps(handler)
+        def wrapper(view, request, *args, **kwargs):
+            if request.method != 'GET' or request.user.is_authenticated:
+                return handler(view, request, *args, **kwargs)
+
+            object_id = kwargs.get(object_kwarg) if object_kwarg else None
+            key = response_cache_key(namespace, request, object_id)
+            cached = cache.get(key)
+            if cached is not None:
+                _increment(_counter_key(namespace, 'hits'), 1)
+                return Response(cached['data'], status=cached['status'], headers={'X-Cache': 'HIT'})
+
+            _increment(_counter_key(namespace, 'misses'), 1)
+            response = handler(view, request, *args, **kwargs)
+            if response.status_code == 200 and not _replica_may_be_stale(namespace, object_id):
+                cache.set(key, {'data': response.data, 'status': response.status_code}, get_timeout(namespace))
+            response['X-Cache'] = 'MISS'
+            return response
+        return wrapper
+    return decorator
+
+
+def cached_catalog_data(namespace, signature, compute, version_namespace=None):
+    """
+    Returns `compute()` cached under the JSON-serializable `signature` and the
+    current version of `version_namespace` (defaults to `namespace`).
+    """
+    raw = json.dumps([signature, _versions(version_namespace or namespace)], separators=(',', ':'), sort_keys=True)
+    key = f'{KEY_PREFIX}:data:{namespace}:{hashlib.md5(raw.encode("utf-8")).hexdigest()}'
+    data = cache.get(key)
+    if data is not None:
+        _increment(_counter_key(namespace, 'hits'), 1)
+        return data
+
+    _increment(_counter_key(namespace, 'misses'), 1)
+    data = compute()
+    if not _replica_may_be_stale(version_namespace or namespace):
+        cache.set(key, data, get_timeout(namespace))
+    return data
+
+
+def cached_catalog_entities(kind, ids, compute, scope=''):
+    """
+    Returns `{id: data}` of the `kind` rows `ids` (e.g. rendered authors),
+    reading every cached entry in one get_many and passing only the missing
+    ids to `compute(ids) -> {id: data}`. Entries follow the `entities` version;
+    `scope` separates renderings that differ per request (e.g. the host of
+    absolute URLs).
+    """
+    ids = set(ids)
+    if not ids:
+        return {}
+    version = _versions('entities')[0]
+    digest = hashlib.md5(scope.encode('utf-8')).hexdigest()
+    keys = {f'{KEY_PREFIX}:entity:{kind}:{version}:{digest}:{pk}': pk for pk in ids}
+    found = {keys[key]: data for key, data in cache.get_many(keys).items()}
+
+    missing = ids - found.keys()
+    if found:
+        _increment(_counter_key('entities', 'hits'), len(found), delta=len(found))
+    if missing:
+        _increment(_counter_key('entities', 'misses'), len(missing), delta=len(missing))
+        computed = compute(missing)
+        by_id = {pk: key for key, pk in keys.items()}
+        if not _replica_may_be_stale('entities'):
+            cache.set_many({by_id[pk]: data for pk, data in computed.items()}, get_timeout('entities'))
+        found.update(computed)
+    return found
+
+
+def catalog_cache_stats():
+    """
+    Hit/miss counters and the hit ratio of every catalog namespace.
+    """
+    keys = [_counter_key(namespace, outcome) for namespace in CATALOG_NAMESPACES for outcome in ('hits', 'misses')]
+    counters = cache.get_many(keys)
+    stats = {}
+    for namespace in CATALOG_NAMESPACES:
+        hits = counters.get(_counter_key(namespace, 'hits'), 0)
+        misses = counters.get(_counter_key(namespace, 'misses'), 0)
+        total = hits + misses
+        stats[namespace] = {
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': round(hits / total, 4) if total else None,
+        }
+    return stats
+
+
+def reset_catalog_cache_stats():
+    cache.delete_many([_counter_key(namespace, outcome) for namespace in CATALOG_NAMESPACES for outcome in ('hits', 'misses')])
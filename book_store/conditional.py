@@ -0,0 +1,82 @@
+import hashlib
+import json
+from functools import wraps
+
+from django.db.models import Count, Max
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, quote_etag
+from django.utils.http import http_date
+
+
+def catalog_etag(request, last_modified, version=None):
+    """
+    Strong ETag of a catalog response: the state of the resource plus
+    everything else the body depends on (path, sorted query parameters such
+    as ?fields=/?cursor=, and the negotiated renderer).
+    """
+    params = sorted((name, sorted(values)) for name, values in request.query_params.lists())
+    renderer = getattr(request, 'accepted_media_type', None)
+    raw = json.dumps(
+        [request.path, params, renderer, last_modified.isoformat(), version],
+        separators=(',', ':'), default=str,
+    )
+    return quote_etag(hashlib.md5(raw.encode('utf-8')).hexdigest())
+
+
+def list_state(queryset):
+    """
+    `(last_modified, version)` of a list: the latest `updated_at` and the row
+    count (which catches deletes), from one aggregate. Models whose lists use
+    it keep `updated_at` indexed (genres, publishers, languages).
+    """
+    state = queryset.order_by().aggregate(last_modified=Max('updated_at'), count=Count('pk'))
+    if state['last_modified'] is None:
+        return None
+    return state['last_modified'], state['count']
+
+
+def list_view_state(view, request, *args, **kwargs):
+    """
+    `get_state` of conditional_catalog_get for list views over an `updated_at` model.
+    """
+    return list_state(view.get_queryset())
+
+
+def conditional_catalog_get(get_state):
+    """
+    Answers conditional GETs of a catalog view handler without running it.
+
+    `get_state(view, request, *args, **kwargs)` returns `(last_modified, version)`
+    of the resource from a cheap query, or None to let the handler answer
+    (e.g. with a 404). A matching If-None-Match (or If-Modified-Since) gets a
+    304; otherwise the handler's 200 response carries ETag/Last-Modified.
+    Put it above cache_catalog_response, so revalidations skip the cache too.
+    """
+    def decorator(handler):
+        @wraps(handler)
+        def wrapper(view, request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return handler(view, request, *args, **kwargs)
+            state = get_state(view, request, *args, **kwargs)
+            if state is None:
+                return handler(view, request, *args, **kwargs)
+
+            last_modified, version = state
+            headers = HttpResponse()
+            headers['ETag'] = catalog_etag(request, last_modified, version)
+            headers['Last-Modified'] = http_date(last_modified.timestamp())
+            # Clients may store the response but must revalidate it every time.
+            patch_cache_control(headers, no_cache=True)
+            conditional = get_conditional_response(
+                request, etag=headers['ETag'], last_modified=int(last_modified.timestamp()), response=headers,
+            )
+            if conditional is not headers:
+                return conditional
+
+            response = handler(view, request, *args, **kwargs)
+            if response.status_code == 200:
+                for name in ('ETag', 'Last-Modified', 'Cache-Control'):
+                    response[name] = headers[name]
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,161 @@
+import logging
+import random
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Set on responses to requests that wrote; while present the client reads from the primary.
+PIN_COOKIE = 'db_primary_pin'
+
+# Routing state of the current request: None outside requests (management
+# commands, background tasks), which always use the primary.
+_request_state = ContextVar('db_routing_state', default=None)
+
+_lag_checks = {}
+_lag_lock = threading.Lock()
+
+
+def replica_aliases():
+    return tuple(getattr(settings, 'REPLICA_DATABASES', ()))
+
+
+def replica_lag(alias):
+    """
+    Seconds the replica `alias` is behind the primary. Only PostgreSQL
+    streaming replicas report it; other backends (e.g. a local SQLite copy)
+    count as up to date.
+    """
+    connection = connections[alias]
+    if connection.vendor != 'postgresql':
+        return 0.0
+    with connection.cursor() as cursor:
+        # A replica that replayed everything it received is current, however old the last write.
+        cursor.execute(
+            'SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+            'ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END'
+        )
+        return float(cursor.fetchone()[0])
+
+
+def replica_is_fresh(alias):
+    """
+    Whether `alias` lags less than settings.REPLICA_MAX_LAG seconds; checked
+    at most every REPLICA_LAG_CHECK_INTERVAL seconds per process. A replica
+    that cannot be reached is skipped until the next check.
+    """
+    interval = getattr(settings, 'REPLICA_LAG_CHECK_INTERVAL', 10)
+    now = time.monotonic()
+    with _lag_lock:
+        checked = _lag_checks.get(alias)
+        if checked is not None and now - checked[0] < interval:
+            return checked[1]
+    try:
+        fresh = replica_lag(alias) <= getattr(settings, 'REPLICA_MAX_LAG', 5)
+    except DatabaseError:
+        logger.warning('Replica %s is unreachable; reading from the primary', alias, exc_info=True)
+        fresh = False
+    with _lag_lock:
+        _lag_checks[alias] = (now, fresh)
+    return fresh
+
+
+def read_from_replica():
+    """
+    Whether the current request has read from a replica, i.e. may have seen
+    data up to REPLICA_MAX_LAG seconds old.
+    """
+    state = _request_state.get()
+    return bool(state and state.get('replica'))
+
+
+def _view_name(view_func):
+    # as_view() copies the class' module and name onto the view function.
+    return f'{view_func.__module__}.{view_func.__name__}'
+
+
+def replica_scope(request, view_func):
+    """
+    What the view may read from a replica: 'all' for the read-only analytics
+    views in settings.REPLICA_READ_VIEWS, 'catalog' for safe requests to the
+    apps in settings.REPLICA_READ_APPS (their own models only), else None.
+    """
+    if request.method not in SAFE_METHODS:
+        return None
+    if _view_name(view_func) in getattr(settings, 'REPLICA_READ_VIEWS', ()):
+        return 'all'
+    if view_func.__module__.split('.')[0] in getattr(settings, 'REPLICA_READ_APPS', ()):
+        return 'catalog'
+    return None
+
+
+class ReplicaRouter:
+    """
+    Sends the reads of catalog and analytics requests (see
+    ReplicaRoutingMiddleware) to one of settings.REPLICA_DATABASES and
+    everything else to the primary. Once a request writes, the rest of it
+    reads from the primary too, as does the client for REPLICA_PIN_SECONDS
+    afterwards, so nobody reads a replica older than their own write.
+    """
+    def db_for_read(self, model, **hints):
+        state = _request_state.get()
+        if state is None or state['pinned'] or state['scope'] is None:
+            return None
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            # Related objects come from where the instance came from.
+            return instance._state.db
+        if state['scope'] == 'catalog' and model._meta.app_label not in settings.REPLICA_READ_APPS:
+            return None
+        if 'replica' not in state:
+            fresh = [alias for alias in replica_aliases() if replica_is_fresh(alias)]
+            state['replica'] = random.choice(fresh) if fresh else None
+        return state['replica']
+
+    def db_for_write(self, model, **hints):
+        state = _request_state.get()
+        if state is not None:
+            state['pinned'] = state['wrote'] = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary.
+        databases = {DEFAULT_DB_ALIAS, *replica_aliases()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Tracks, per request, whether ReplicaRouter may read from a replica; see
+    replica_scope(). Clients carrying the pin cookie of a recent write always
+    read from the primary.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        state = {'scope': None, 'pinned': PIN_COOKIE in request.COOKIES, 'wrote': False}
+        token = _request_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_state.reset(token)
+        if state['wrote'] and replica_aliases():
+            response.set_cookie(
+                PIN_COOKIE, '1', max_age=getattr(settings, 'REPLICA_PIN_SECONDS', 5),
+                httponly=True, samesite='Lax',
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        state = _request_state.get()
+        if state is not None and replica_aliases():
+            state['scope'] = replica_scope(request, view_func)
@@ -0,0 +1,192 @@
+import posixpath
+from io import BytesIO
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+from rest_framework import serializers
+
+from .cache import invalidate_catalog
+from .tasks import run_after_commit
+
+# Uploaded images that get derivatives, as (model label, field name).
+IMAGE_FIELDS = (
+    ('books.BookFormat', 'cover_image'),
+    ('authors.Author', 'profile_picture'),
+    ('translators.Translator', 'profile_picture'),
+    ('publishers.Publisher', 'logo'),
+    (settings.AUTH_USER_MODEL, 'profile_picture'),
+)
+
+# Widths (px) of the derivatives; overridable through settings.IMAGE_DERIVATIVE_WIDTHS.
+DEFAULT_DERIVATIVE_WIDTHS = (160, 320, 640)
+
+# Extension -> Pillow format, in srcset order (WebP first, JPEG as the fallback).
+DERIVATIVE_FORMATS = {
+    'webp': 'WEBP',
+    'jpeg': 'JPEG',
+}
+DERIVATIVE_QUALITY = 80
+DERIVATIVES_DIR = 'derivatives'
+
+# Seconds the widths an image has derivatives at are kept; names never change,
+# so this only bounds how long deleted files are still advertised.
+WIDTHS_TIMEOUT = 60 * 60 * 24
+
+
+def derivative_widths():
+    return tuple(sorted(getattr(settings, 'IMAGE_DERIVATIVE_WIDTHS', DEFAULT_DERIVATIVE_WIDTHS)))
+
+
+def derivative_name(name, width, extension):
+    """
+    `books/covers/a.png` -> `books/covers/derivatives/a-320w.webp`. Replaced
+    uploads get a new name from the storage, so derivatives never go stale.
+    """
+    directory, filename = posixpath.split(name)
+    stem = posixpath.splitext(filename)[0]
+    return posixpath.join(directory, DERIVATIVES_DIR, f'{stem}-{width}w.{extension}')
+
+
+def has_derivatives(storage, name):
+    # The smallest JPEG is written last.
+    return storage.exists(derivative_name(name, derivative_widths()[0], 'jpeg'))
+
+
+def _widths_key(name):
+    return f'images:derivative-widths:{name}'
+
+
+def available_widths(storage, name):
+    """
+    The widths `name` has derivatives at, as generate_derivatives recorded
+    them; looked up in the storage (and recorded) when the record is gone.
+    """
+    widths = cache.get(_widths_key(name))
+    if widths is None:
+        widths = tuple(width for width in derivative_widths() if storage.exists(derivative_name(name, width, 'jpeg')))
+        # Nothing is recorded before the derivatives exist, so their generation is never hidden.
+        if widths:
+            cache.set(_widths_key(name), widths, WIDTHS_TIMEOUT)
+    return widths
+
+
+def _encode(image, image_format):
+    buffer = BytesIO()
+    if image_format == 'JPEG':
+        if image.mode == 'RGBA':
+            # JPEG has no alpha channel; flatten onto white.
+            background = Image.new('RGBA', image.size, 'white')
+            image = Image.alpha_composite(background, image)
+        image.convert('RGB').save(buffer, 'JPEG', quality=DERIVATIVE_QUALITY, optimize=True, progressive=True)
+    else:
+        image.save(buffer, image_format, quality=DERIVATIVE_QUALITY, method=4)
+    return buffer.getvalue()
+
+
+def generate_derivatives(storage, name):
+    """
+    Writes a WebP and a JPEG of the image `name` at every derivative width up
+    to its own, largest first, each resized from the previous one. Images
+    narrower than the smallest width get that one only, not upscaled. Returns
+    the names written and records their widths (see available_widths).
+    """
+    widths = derivative_widths()
+    with storage.open(name, 'rb') as source:
+        image = Image.open(source)
+        # JPEGs are decoded at the smallest 1/2..1/8 scale still larger than the
+        # largest derivative (either side, as EXIF may rotate the image).
+        image.draft(None, (widths[-1], widths[-1]))
+        image = ImageOps.exif_transpose(image)
+    image = image.convert('RGBA' if image.has_transparency_data else 'RGB')
+
+    widths = tuple(width for width in widths if width <= image.width) or widths[:1]
+    names = []
+    for width in reversed(widths):
+        if image.width > width:
+            height = max(1, round(image.height * width / image.width))
+            image = image.resize((width, height), Image.Resampling.LANCZOS, reducing_gap=3.0)
+        for extension, image_format in DERIVATIVE_FORMATS.items():
+            path = derivative_name(name, width, extension)
+            if storage.exists(path):
+                storage.delete(path)
+            names.append(storage.save(path, ContentFile(_encode(image, image_format))))
+    cache.set(_widths_key(name), widths, WIDTHS_TIMEOUT)
+    return names
+
+
+def ensure_derivatives(storage, name, namespaces=(), book_ids=()):
+    # Missing files (e.g. a default picture that was never uploaded) are left to the backfill command.
+    if storage.exists(name) and not has_derivatives(storage, name):
+        generate_derivatives(storage, name)
+        if namespaces:
+            # Cached pages rendered before the derivatives existed list none.
+            invalidate_catalog(*namespaces, book_ids=book_ids)
+
+
+def _loaded_image_name(instance, field_name):
+    # None when the field is deferred; reading it would cost a query.
+    value = instance.__dict__.get(instance._meta.get_field(field_name).attname)
+    return getattr(value, 'name', value) or None
+
+
+def remember_image_name(sender, instance, **kwargs):
+    """
+    post_init receiver of the IMAGE_FIELDS models: keeps the name of the image
+    the instance was loaded (or created) with, for image_changed().
+    """
+    instance._image_name = _loaded_image_name(instance, dict(IMAGE_FIELDS)[sender._meta.label])
+
+
+def image_changed(instance, field_name, update_fields=None):
+    """
+    Whether a save of `instance` stored a new file in its image field: one
+    with another name than it was loaded with, other than the field default.
+    """
+    if update_fields is not None and field_name not in update_fields:
+        return False
+    name = _loaded_image_name(instance, field_name)
+    original, instance._image_name = getattr(instance, '_image_name', None), name
+    return bool(name) and name != original and name != instance._meta.get_field(field_name).get_default()
+
+
+def schedule_derivatives(field_file, *namespaces, book_ids=()):
+    """
+    Generates the missing derivatives of an image field in the background
+    after the commit, then invalidates the catalog `namespaces` (see
+    book_store.cache.invalidate_catalog) that render it; the
+    generate_image_derivatives command backfills the rest.
+    """
+    if field_file:
+        run_after_commit(ensure_derivatives, field_file.storage, field_file.name, namespaces, book_ids)
+
+
+class ImageDerivativesField(serializers.Field):
+    """
+    Read-only `{extension: srcset}` of an image field's derivatives, e.g.
+    `{"webp": ".../a-160w.webp 160w, .../a-320w.webp 320w, ...", "jpeg": "..."}`,
+    or None until they are generated. Only the widths generate_derivatives
+    wrote are listed; they come from the cache, not the storage, once known.
+    """
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        widths = available_widths(value.storage, value.name)
+        if not widths:
+            return None
+        request = self.context.get('request')
+        srcset = {}
+        for extension in DERIVATIVE_FORMATS:
+            candidates = []
+            for width in widths:
+                url = value.storage.url(derivative_name(value.name, width, extension))
+                if request is not None:
+                    url = request.build_absolute_uri(url)
+                candidates.append(f'{url} {width}w')
+            srcset[extension] = ', '.join(candidates)
+        return srcset
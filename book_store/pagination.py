@@ -0,0 +1,184 @@
+import json
+from base64 import b64decode, b64encode
+from binascii import Error as BinasciiError
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import F, FloatField, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Keyset (seek) pagination used by every list endpoint of the project.
+
+    Pages are fetched with `WHERE (sort_key, id) > (last_key, last_id)` instead
+    of an OFFSET, so page N costs the same as page 1, and no COUNT(*) is run.
+    The sort keys are taken from the queryset's explicit `order_by()` (e.g.
+    `price`, `-publication_date`, `-sold_count`, `-rank`) and the primary key is
+    always appended as a tie-breaker, which keeps cursors stable for
+    non-unique keys. Without an explicit ordering, results are newest first.
+    Float keys travel in the cursor as float.hex(), so ties compare exactly.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-id',)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.model = queryset.model
+        self.annotations = queryset.query.annotations
+        self.ordering = self.get_ordering(request, queryset, view)
+        values, self.reverse = self.decode_cursor(request)
+        if values is not None:
+            values = self._cursor_values(values)
+
+        if self.reverse:
+            queryset = queryset.order_by(*self._order_expressions(reverse=True))
+        else:
+            queryset = queryset.order_by(*self._order_expressions())
+        if values is not None:
+            queryset = queryset.filter(self._seek_condition(values, before=self.reverse))
+
+        # Fetch one extra row to learn whether another page follows.
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+
+        if self.reverse:
+            self.page.reverse()
+            self.has_previous, self.has_next = has_more, True
+        else:
+            self.has_previous, self.has_next = values is not None, has_more
+        return self.page
+
+    def get_ordering(self, request, queryset, view):
+        """
+        Uses the plain field names the view ordered its queryset by, followed by
+        the primary key. Expression or related-field orderings fall back to the
+        default ordering.
+        """
+        order_by = queryset.query.order_by
+        if not order_by or not all(isinstance(field, str) and field != '?' and '__' not in field for field in order_by):
+            return tuple(self.ordering)
+        keys = [field for field in order_by if field.lstrip('-') not in ('pk', 'id')]
+        direction = '-' if (keys or order_by)[-1].startswith('-') else ''
+        return (*keys, f'{direction}id')
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self._position(self.page[-1]), reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self._position(self.page[0]), reverse=True)
+
+    def get_links(self):
+        """
+        The next/previous links, for views that wrap results in their own envelope.
+        """
+        return {'next': self.get_next_link(), 'previous': self.get_previous_link()}
+
+    def encode_cursor(self, values, reverse=False):
+        payload = json.dumps({'v': values, 'r': int(reverse)}, separators=(',', ':'))
+        encoded = b64encode(payload.encode('utf-8')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None, False
+        try:
+            payload = json.loads(b64decode(encoded.encode('ascii')).decode('utf-8'))
+            values, reverse = payload['v'], bool(payload.get('r'))
+        except (TypeError, ValueError, KeyError, UnicodeError, BinasciiError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return values, reverse
+
+    def _position(self, instance):
+        position = []
+        for field in self.ordering:
+            name = field.lstrip('-')
+            value = instance[name] if isinstance(instance, dict) else getattr(instance, name)
+            if value is None:
+                position.append(None)
+            else:
+                position.append(value.hex() if isinstance(value, float) else str(value))
+        return position
+
+    def _cursor_values(self, values):
+        # Float keys come back from float.hex(); the other keys are compared as strings.
+        decoded = []
+        for field, value in zip(self.ordering, values):
+            if value is not None and isinstance(self._key_field(field.lstrip('-')), FloatField):
+                try:
+                    value = float.fromhex(value)
+                except (TypeError, ValueError):
+                    raise NotFound(self.invalid_cursor_message)
+            decoded.append(value)
+        return decoded
+
+    def _order_expressions(self, reverse=False):
+        """
+        NULL sort keys are ordered as the largest values on every backend
+        (PostgreSQL's default), so nullable keys can still use a plain b-tree index.
+        """
+        expressions = []
+        for field in self.ordering:
+            name = field.lstrip('-')
+            descending = field.startswith('-') != reverse
+            expression = F(name)
+            if not self._is_nullable(name):
+                expressions.append(expression.desc() if descending else expression.asc())
+            elif descending:
+                expressions.append(expression.desc(nulls_first=True))
+            else:
+                expressions.append(expression.asc(nulls_last=True))
+        return expressions
+
+    def _seek_condition(self, values, before=False):
+        """
+        Builds the row-value comparison `(k1, k2, ...) > (v1, v2, ...)` (or `<`
+        when paging backwards) as an OR of prefix-equal terms, which works on
+        nullable keys and mixed sort directions.
+        """
+        condition = Q(pk__in=[])
+        equal_prefix = Q()
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip('-')
+            towards_larger = field.startswith('-') == before
+            if value is None:
+                # NULL is the largest value: nothing lies beyond it, every non-null value below it.
+                strictly = Q(pk__in=[]) if towards_larger else Q(**{f'{name}__isnull': False})
+                equal = Q(**{f'{name}__isnull': True})
+            else:
+                strictly = Q(**{f'{name}__{"gt" if towards_larger else "lt"}': value})
+                if towards_larger and self._is_nullable(name):
+                    strictly |= Q(**{f'{name}__isnull': True})
+                equal = Q(**{name: value})
+            condition |= equal_prefix & strictly
+            equal_prefix &= equal
+        return condition
+
+    def _key_field(self, name):
+        if name in self.annotations:
+            return self.annotations[name].output_field
+        try:
+            return self.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return None
+
+    def _is_nullable(self, name):
+        if name in self.annotations:
+            # Annotations such as the search rank are never NULL.
+            return False
+        field = self._key_field(name)
+        return field is not None and field.null
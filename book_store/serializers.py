@@ -0,0 +1,132 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework import serializers
+
+SAFE_METHODS = ('GET', 'HEAD')
+
+
+def parse_field_tree(value):
+    """
+    Parses `id,title,formats.price,authors.first_name` into
+    `{'id': {}, 'title': {}, 'formats': {'price': {}}, 'authors': {'first_name': {}}}`.
+    An empty subtree means the whole field.
+    """
+    tree = {}
+    for path in value.split(','):
+        names = [name.strip() for name in path.split('.') if name.strip()]
+        node = tree
+        for index, name in enumerate(names):
+            if name in node and not node[name] and index < len(names) - 1:
+                break  # The whole field was already requested.
+            child = node.setdefault(name, {})
+            if index == len(names) - 1:
+                child.clear()
+            node = child
+    return tree
+
+
+class SparseFieldsetMixin:
+    """
+    Lets the client pick what a (nested) serializer renders through the query
+    parameters of the request:
+
+    - `?fields=id,title,formats.price` keeps only the listed fields; dotted
+      names select fields of nested serializers. Without it, every field is
+      rendered.
+    - `?expand=authors,authors.genres` renders only the listed relations as
+      nested objects; other relations still in `fields` render as primary keys.
+      Without it, every relation is expanded.
+
+    Only applies to read requests whose root serializer uses this mixin, so the
+    same nested serializers elsewhere are unaffected.
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        spec = self._sparse_spec()
+        if spec is None:
+            return fields
+        only, expand = spec
+
+        if only is not None:
+            for name in list(fields):
+                if name not in only:
+                    del fields[name]
+        if expand is not None:
+            for name, field in list(fields.items()):
+                if isinstance(field, serializers.BaseSerializer) and name not in expand:
+                    many = isinstance(field, serializers.ListSerializer)
+                    kwargs = {'source': field.source} if field.source and field.source != name else {}
+                    fields[name] = serializers.PrimaryKeyRelatedField(read_only=True, many=many, **kwargs)
+        return fields
+
+    def _sparse_spec(self):
+        """
+        Returns the `(fields, expand)` subtrees that apply to this serializer, or
+        None when sparse fieldsets are not in effect.
+        """
+        root = self.root
+        root_serializer = getattr(root, 'child', root)
+        request = self.context.get('request')
+        if not isinstance(root_serializer, SparseFieldsetMixin) or request is None or request.method not in SAFE_METHODS:
+            return None
+
+        params = getattr(request, 'query_params', request.GET)
+        only = parse_field_tree(params['fields']) if params.get('fields') else None
+        expand = parse_field_tree(params['expand']) if 'expand' in params else None
+        if only is None and expand is None:
+            return None
+
+        path = []
+        node = self
+        while node is not root:
+            if node.field_name:
+                path.append(node.field_name)
+            node = node.parent
+        for name in reversed(path):
+            if only is not None:
+                only = only.get(name) or None
+            if expand is not None:
+                expand = expand.get(name, {})
+        return only, expand
+
+
+def optimize_queryset(queryset, serializer):
+    """
+    Adds the select_related()/prefetch_related() calls needed by the relations
+    `serializer` actually renders, so relations left out by a sparse fieldset
+    are not loaded at all.
+    """
+    select, prefetch = [], []
+    _collect_relations(serializer, queryset.model, '', True, select, prefetch)
+    if select:
+        queryset = queryset.select_related(*select)
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+    return queryset
+
+
+def _collect_relations(serializer, model, prefix, joinable, select, prefetch):
+    for field in serializer.fields.values():
+        source = field.source
+        if source == '*' or '.' in source:
+            continue
+        try:
+            model_field = model._meta.get_field(source)
+        except FieldDoesNotExist:
+            continue
+        if not model_field.is_relation:
+            continue
+
+        path = prefix + source
+        single = model_field.many_to_one or model_field.one_to_one
+        if isinstance(field, serializers.ListSerializer):
+            prefetch.append(path)
+            _collect_relations(field.child, model_field.related_model, path + '__', False, select, prefetch)
+        elif isinstance(field, serializers.BaseSerializer):
+            (select if joinable and single else prefetch).append(path)
+            _collect_relations(field, model_field.related_model, path + '__', joinable and single, select, prefetch)
+        elif isinstance(field, serializers.ManyRelatedField):
+            # Only the primary keys are rendered (plus the foreign key a reverse relation is matched on).
+            columns = ['pk', model_field.field.attname] if model_field.one_to_many else ['pk']
+            prefetch.append(Prefetch(path, queryset=model_field.related_model._base_manager.only(*columns)))
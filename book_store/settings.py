@@ -45,6 +45,7 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'django.middleware.common.CommonMiddleware',
+    'book_store.db_router.ReplicaRoutingMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -65,6 +66,73 @@ DATABASES = {
     }
 }
 
+# Read replicas (see book_store.db_router): comma-separated database names
+# (for SQLite, file paths) with the primary's other settings, e.g. a copy of
+# db.sqlite3 for local testing. In tests they mirror the test primary.
+REPLICA_DATABASES = []
+for index, name in enumerate(filter(None, os.getenv('DJANGO_DB_REPLICAS', '').split(',')), start=1):
+    alias = f'replica_{index}'
+    DATABASES[alias] = {**DATABASES['default'], 'NAME': name.strip(), 'TEST': {'MIRROR': 'default'}}
+    REPLICA_DATABASES.append(alias)
+
+DATABASE_ROUTERS = ['book_store.db_router.ReplicaRouter']
+# Safe requests to these apps read their models from a replica
+REPLICA_READ_APPS = ('books', 'authors', 'genres', 'publishers', 'translators', 'Language', 'reviews')
+# Read-only views that read everything from a replica
+REPLICA_READ_VIEWS = ('dashboard.views.dashboard_view',)
+# Seconds a client reads from the primary after a write (read-your-writes)
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', 5))
+# Replicas lagging more than this many seconds are skipped; checked every REPLICA_LAG_CHECK_INTERVAL seconds
+REPLICA_MAX_LAG = float(os.getenv('REPLICA_MAX_LAG', 5))
+REPLICA_LAG_CHECK_INTERVAL = float(os.getenv('REPLICA_LAG_CHECK_INTERVAL', 10))
+
+# Cache
+# LocMemCache is per process; point these at Redis or Memcached in production so
+# that catalog invalidation reaches every worker.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('DJANGO_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('DJANGO_CACHE_LOCATION', 'book-store'),
+    }
+}
+if CACHES['default']['BACKEND'].endswith('LocMemCache'):
+    # The default 300 entries cannot hold one page of cached catalog entities.
+    CACHES['default']['OPTIONS'] = {'MAX_ENTRIES': int(os.getenv('DJANGO_CACHE_MAX_ENTRIES', 10000))}
+
+# Seconds the anonymous catalog responses are cached (see book_store.cache)
+CATALOG_CACHE_TIMEOUTS = {
+    'books': int(os.getenv('CATALOG_CACHE_BOOKS_TIMEOUT', 60 * 5)),
+    'book': int(os.getenv('CATALOG_CACHE_BOOK_TIMEOUT', 60 * 15)),
+    'authors': 60 * 30,
+    'genres': 60 * 60,
+    'publishers': 60 * 60,
+    'facets': 60 * 5,
+    'autocomplete': 60 * 10,
+    'entities': 60 * 60,
+    'discounts': 60 * 60,
+}
+
+# Render book lists from values() rows instead of BookSerializer (see books.fast_serializers)
+CATALOG_FAST_SERIALIZATION = os.getenv('CATALOG_FAST_SERIALIZATION', 'false') == 'true'
+
+# Widths (px) of the resized WebP/JPEG copies of uploaded images (see book_store.images)
+IMAGE_DERIVATIVE_WIDTHS = (160, 320, 640)
+
+# In-process background tasks (see book_store.tasks); eager mode runs them inline
+BACKGROUND_TASK_WORKERS = int(os.getenv('BACKGROUND_TASK_WORKERS', 2))
+BACKGROUND_TASKS_EAGER = os.getenv('BACKGROUND_TASKS_EAGER', 'false') == 'true'
+
+# Restock emails sent per transaction over one SMTP connection (see books.notifications)
+STOCK_NOTIFICATION_BATCH_SIZE = int(os.getenv('STOCK_NOTIFICATION_BATCH_SIZE', 200))
+
+# Anonymous carts live in the cache until login or checkout (see customers.cart_store);
+# CART_CACHE_AUTHENTICATED keeps the carts of signed-in users there too
+CART_CACHE_TIMEOUT = int(os.getenv('CART_CACHE_TIMEOUT', 60 * 60 * 24 * 7))
+CART_CACHE_AUTHENTICATED = os.getenv('CART_CACHE_AUTHENTICATED', 'false') == 'true'
+
+# Seconds a cart entering checkout holds its copies (see customers.checkout.reserve_cart)
+STOCK_RESERVATION_SECONDS = int(os.getenv('STOCK_RESERVATION_SECONDS', 600))
+
 # Authentication and Password validation
 AUTH_USER_MODEL = 'accounts.User'
 
@@ -140,7 +208,10 @@ REST_FRAMEWORK = {
     'DEFAULT_THROTTLE_RATES': {
         'user': '300/day',
         'anon': '30/minute',
+        'autocomplete': '120/minute',
     },
+    'DEFAULT_PAGINATION_CLASS': 'book_store.pagination.KeysetPagination',
+    'PAGE_SIZE': 20,
 }
 
 # Security settings (for production)
@@ -0,0 +1,50 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection, transaction
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'BACKGROUND_TASK_WORKERS', 2),
+                thread_name_prefix='background-task',
+            )
+        return _executor
+
+
+def _run(func, args, kwargs):
+    try:
+        func(*args, **kwargs)
+    except Exception:
+        logger.exception('Background task %s failed', func.__qualname__)
+    finally:
+        # The worker thread's own connection; a new one is opened for the next task.
+        connection.close()
+
+
+def run_after_commit(func, *args, **kwargs):
+    """
+    Runs `func(*args, **kwargs)` in a background thread once the current
+    transaction commits (right away outside of one), keeping slow side
+    effects off the request path.
+
+    The work lives in process memory, so tasks must be safe to lose on a
+    restart (e.g. recoverable by a management command). With
+    settings.BACKGROUND_TASKS_EAGER the task runs inline instead.
+    """
+    def submit():
+        if getattr(settings, 'BACKGROUND_TASKS_EAGER', False):
+            func(*args, **kwargs)
+        else:
+            _get_executor().submit(_run, func, args, kwargs)
+    transaction.on_commit(submit)
@@ -11,7 +11,7 @@ class BookFormatInline(admin.TabularInline):
     extra = 1  # Number of extra forms to display
 
 class BookAdmin(admin.ModelAdmin):
-    list_display = ('title', 'get_authors', 'get_translators', 'publisher', 'publication_date', 'sold_count')
+    list_display = ('title', 'get_authors', 'get_translators', 'publisher', 'publication_date', 'sold_count', 'average_rating', 'reviews_count')
     list_filter = ('authors', 'translators', 'publisher', 'genres', 'language', 'publication_date')
     search_fields = ('title', 'authors__name', 'translators__name', 'publisher__name')
     ordering = ('-publication_date',)
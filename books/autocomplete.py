@@ -0,0 +1,126 @@
+from django.db import connection, connections, models
+from django.db.migrations.recorder import MigrationRecorder
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.db.models.functions import Collate
+
+from authors.models import Author
+from publishers.models import Publisher
+from translators.models import Translator
+from book_store.cache import cached_catalog_data
+from .models import Book
+
+MIN_PREFIX_LENGTH = 2
+DEFAULT_LIMIT = 5
+MAX_LIMIT = 10
+
+# SQLite NOCASE indexes of the *_autocomplete_indexes migrations, as
+# (model, applying migration, column, index name). They are not part of the
+# model state, so a table rebuild on SQLite drops them.
+SQLITE_AUTOCOMPLETE_INDEXES = (
+    (Book, ('books', '0015_book_autocomplete_indexes'), 'title', 'book_title_nocase'),
+    (Author, ('authors', '0002_author_autocomplete_indexes'), 'first_name', 'author_first_name_nocase'),
+    (Author, ('authors', '0002_author_autocomplete_indexes'), 'last_name', 'author_last_name_nocase'),
+    (Translator, ('translators', '0002_translator_autocomplete_indexes'), 'first_name', 'translator_first_name_nocase'),
+    (Translator, ('translators', '0002_translator_autocomplete_indexes'), 'last_name', 'translator_last_name_nocase'),
+    (Publisher, ('publishers', '0002_publisher_autocomplete_indexes'), 'name', 'publisher_name_nocase'),
+)
+
+# Short prefixes match the most rows and repeat the most across users, so only
+# they are cached; longer ones are selective enough to query directly.
+HOT_PREFIX_MAX_LENGTH = 5
+
+
+def normalize_prefix(prefix):
+    return ' '.join(prefix.split())
+
+
+def _word_prefix(prefix, field):
+    """
+    Matches `prefix` at the start of the value. On PostgreSQL, where the
+    trigram index also serves infix LIKEs, it matches the start of any word too.
+    Both forms are served by the indexes of the *_autocomplete_indexes migrations.
+    """
+    condition = Q(**{f'{field}__istartswith': prefix})
+    if connection.vendor == 'postgresql':
+        condition |= Q(**{f'{field}__icontains': f' {prefix}'})
+    return condition
+
+
+def _person_prefix(prefix):
+    condition = Q(first_name__istartswith=prefix) | Q(last_name__istartswith=prefix)
+    first_name, _, last_name = prefix.partition(' ')
+    if last_name:
+        # The full name typed as "first last".
+        condition |= Q(first_name__iexact=first_name, last_name__istartswith=last_name)
+    return condition
+
+
+def _starts_first(field, prefix):
+    return Case(When(**{f'{field}__istartswith': prefix}, then=Value(0)), default=Value(1), output_field=IntegerField())
+
+
+def _suggest(prefix, limit):
+    titles = (
+        Book.objects.filter(_word_prefix(prefix, 'title'))
+        .annotate(starts=_starts_first('title', prefix))
+        .order_by('starts', '-sold_count', 'title')
+        .values('id', 'title')[:limit]
+    )
+    authors = (
+        Author.objects.filter(_person_prefix(prefix))
+        .order_by('-number_of_books', 'last_name', 'first_name')
+        .values('id', 'first_name', 'last_name')[:limit]
+    )
+    translators = (
+        Translator.objects.filter(_person_prefix(prefix))
+        .order_by('last_name', 'first_name')
+        .values('id', 'first_name', 'last_name')[:limit]
+    )
+    publishers = (
+        Publisher.objects.filter(_word_prefix(prefix, 'name'))
+        .annotate(starts=_starts_first('name', prefix))
+        .order_by('starts', 'name')
+        .values('id', 'name')[:limit]
+    )
+    return {
+        'titles': list(titles),
+        'authors': [{'id': row['id'], 'name': f"{row['first_name']} {row['last_name']}"} for row in authors],
+        'translators': [{'id': row['id'], 'name': f"{row['first_name']} {row['last_name']}"} for row in translators],
+        'publishers': list(publishers),
+    }
+
+
+def restore_sqlite_autocomplete_indexes(using):
+    """
+    Recreates the SQLite NOCASE autocomplete indexes a table rebuild dropped,
+    on tables whose index migration is applied. Returns the names created.
+    """
+    database = connections[using]
+    if database.vendor != 'sqlite':
+        return []
+    applied = MigrationRecorder(database).applied_migrations()
+    created = []
+    with database.cursor() as cursor:
+        existing = {
+            table: database.introspection.get_constraints(cursor, table)
+            for table in database.introspection.table_names(cursor)
+        }
+    with database.schema_editor() as schema_editor:
+        for model, migration, column, name in SQLITE_AUTOCOMPLETE_INDEXES:
+            table = model._meta.db_table
+            if migration in applied and table in existing and name not in existing[table]:
+                schema_editor.add_index(model, models.Index(Collate(column, 'NOCASE'), name=name))
+                created.append(name)
+    return created
+
+
+def suggestions(prefix, limit=DEFAULT_LIMIT):
+    """
+    Top `limit` title, author, translator and publisher suggestions for a
+    normalized prefix: one LIMITed, index-backed query per kind.
+    """
+    if len(prefix) > HOT_PREFIX_MAX_LENGTH:
+        return _suggest(prefix, limit)
+    return cached_catalog_data(
+        'autocomplete', [prefix.casefold(), limit], lambda: _suggest(prefix, limit), version_namespace='books'
+    )
@@ -0,0 +1,127 @@
+import csv
+import io
+import json
+import zlib
+
+from django.db.models import Prefetch
+
+from authors.models import Author
+from genres.models import Genre
+from translators.models import Translator
+from .importer import COLUMNS
+from .models import Book, BookFormat
+
+# The import_catalog columns (one row per format), so an export can be imported again.
+EXPORT_COLUMNS = ('book_id', *COLUMNS)
+FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv', 'csv'),
+}
+# Bytes collected before a chunk is handed to the response/file.
+CHUNK_BYTES = 64 * 1024
+
+
+def catalog_queryset(books=None):
+    """
+    Books with only the columns the export writes; related rows are loaded by
+    prefetching per iterator chunk.
+    """
+    books = Book.objects.all() if books is None else books
+    return (
+        books.order_by('pk')
+        .select_related('publisher', 'language')
+        .only('id', 'title', 'summary', 'publication_date', 'publisher__name', 'language__name')
+        .prefetch_related(
+            Prefetch('authors', queryset=Author.objects.only('first_name', 'last_name')),
+            Prefetch('translators', queryset=Translator.objects.only('first_name', 'last_name')),
+            Prefetch('genres', queryset=Genre.objects.only('name')),
+            Prefetch('formats', queryset=BookFormat.objects.order_by('pk')),
+        )
+    )
+
+
+def _person(person):
+    # import_catalog reads "First Last", or "Last, First" when the first name has several words.
+    if ' ' in person.first_name:
+        return f'{person.last_name}, {person.first_name}'
+    return f'{person.first_name} {person.last_name}'
+
+
+def export_rows(books, chunk_size=1000):
+    """
+    Yields one flat dict per format (or per book without formats). The query
+    runs through a server-side cursor on PostgreSQL and the relations are
+    prefetched per `chunk_size` books, so memory stays flat.
+    """
+    for book in books.iterator(chunk_size=chunk_size):
+        row = {
+            'book_id': book.pk,
+            'title': book.title,
+            'summary': book.summary,
+            'publication_date': book.publication_date.isoformat() if book.publication_date else None,
+            'language': book.language.name if book.language else None,
+            'publisher': book.publisher.name if book.publisher else None,
+            'authors': [_person(author) for author in book.authors.all()],
+            'translators': [_person(translator) for translator in book.translators.all()],
+            'genres': [genre.name for genre in book.genres.all()],
+        }
+        formats = book.formats.all()
+        if not formats:
+            yield {column: row.get(column) for column in EXPORT_COLUMNS}
+        for book_format in formats:
+            yield {
+                **row,
+                'format_name': book_format.format_name,
+                'price': book_format.price,
+                'isbn': book_format.isbn,
+                'page_count': book_format.page_count,
+                'weight': book_format.weight,
+                'stock': book_format.stock,
+                'discount': book_format.discount,
+                'status': book_format.status,
+            }
+
+
+def _ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False, default=str) + '\n'
+
+
+def _csv_lines(rows, separator):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for row in rows:
+        writer.writerow([
+            separator.join(value) if isinstance(value, list) else ('' if value is None else value)
+            for value in (row[column] for column in EXPORT_COLUMNS)
+        ])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def export_chunks(rows, file_format='ndjson', compress=False, separator='|'):
+    """
+    Encodes `rows` as NDJSON or CSV and yields ~64KB byte chunks, gzipped on the fly when `compress` is set.
+    """
+    lines = _csv_lines(rows, separator) if file_format == 'csv' else _ndjson_lines(rows)
+    compressor = zlib.compressobj(wbits=31) if compress else None  # wbits=31 writes a gzip container
+
+    pending, size = [], 0
+    for line in lines:
+        data = line.encode('utf-8')
+        pending.append(data)
+        size += len(data)
+        if size >= CHUNK_BYTES:
+            chunk = b''.join(pending)
+            pending, size = [], 0
+            if compressor:
+                chunk = compressor.compress(chunk)
+            if chunk:
+                yield chunk
+    chunk = b''.join(pending)
+    if compressor:
+        chunk = compressor.compress(chunk) + compressor.flush()
+    if chunk:
+        yield chunk
@@ -0,0 +1,70 @@
+from django.db.models import Count, Q
+
+from .models import Book, BookFormat
+
+# Upper bounds (Toman) of the price buckets, applied to the lowest price after discount.
+PRICE_BUCKET_EDGES = (100_000, 200_000, 300_000, 500_000)
+
+
+def price_buckets(edges=PRICE_BUCKET_EDGES):
+    """
+    `[(None, 100000), (100000, 200000), ..., (500000, None)]`, lower bound inclusive.
+    """
+    bounds = (None, *edges, None)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _bucket_condition(low, high):
+    condition = Q(min_effective_price__isnull=False)
+    if low is not None:
+        condition &= Q(min_effective_price__gte=low)
+    if high is not None:
+        condition &= Q(min_effective_price__lt=high)
+    return condition
+
+
+def catalog_facets(queryset):
+    """
+    Counts the books of `queryset` per genre, language, publisher, format and
+    price bucket.
+
+    The (possibly joined and duplicated) filtered queryset is only used as an
+    id subquery, so each facet is a single grouped query over distinct books.
+    """
+    book_ids = queryset.order_by().values('pk')
+    books = Book.objects.filter(pk__in=book_ids).order_by()
+
+    buckets = price_buckets()
+    totals = books.aggregate(
+        total=Count('pk'),
+        **{f'price_{index}': Count('pk', filter=_bucket_condition(*bounds)) for index, bounds in enumerate(buckets)},
+    )
+
+    genres = (
+        Book.genres.through.objects.filter(book_id__in=book_ids).order_by()
+        .values('genre_id', 'genre__name').annotate(count=Count('book_id')).order_by('-count', 'genre__name')
+    )
+    languages = (
+        books.filter(language__isnull=False)
+        .values('language_id', 'language__name').annotate(count=Count('pk')).order_by('-count', 'language__name')
+    )
+    publishers = (
+        books.filter(publisher__isnull=False)
+        .values('publisher_id', 'publisher__name').annotate(count=Count('pk')).order_by('-count', 'publisher__name')
+    )
+    formats = (
+        BookFormat.objects.filter(book_id__in=book_ids).order_by()
+        .values('format_name').annotate(count=Count('book_id', distinct=True)).order_by('-count', 'format_name')
+    )
+
+    return {
+        'total': totals['total'],
+        'genres': [{'id': row['genre_id'], 'name': row['genre__name'], 'count': row['count']} for row in genres],
+        'languages': [{'id': row['language_id'], 'name': row['language__name'], 'count': row['count']} for row in languages],
+        'publishers': [{'id': row['publisher_id'], 'name': row['publisher__name'], 'count': row['count']} for row in publishers],
+        'formats': [{'name': row['format_name'], 'count': row['count']} for row in formats],
+        'price': [
+            {'min': low, 'max': high, 'count': totals[f'price_{index}']}
+            for index, (low, high) in enumerate(buckets)
+        ],
+    }
@@ -0,0 +1,178 @@
+from collections import defaultdict
+
+from django.db import models
+from django.db.models.fields.files import FieldFile
+from rest_framework import serializers
+
+from authors.models import Author
+from authors.serializers import AuthorSerializer
+from genres.models import Genre
+from genres.serializers import GenreSerializer
+from Language.models import Language
+from Language.serializers import LanguageSerializer
+from publishers.models import Publisher
+from publishers.serializers import PublisherSerializer
+from translators.models import Translator
+from translators.serializers import TranslatorSerializer
+from book_store.cache import cached_catalog_entities
+from .models import Book, BookFormat
+from .serializers import BookFormatSerializer, BookSerializer, share_links
+
+# Book columns BookSerializer renders, plus the foreign keys of its nested relations.
+BOOK_COLUMNS = (
+    'id', 'title', 'publisher_id', 'publication_date', 'summary', 'language_id', 'sold_count',
+    'average_rating', 'reviews_count', *Book.RATING_COUNT_FIELDS.values(),
+    'min_price', 'min_effective_price', 'max_discount', 'any_in_stock',
+)
+FORMAT_COLUMNS = ('book_id', *(name for name in BookFormatSerializer.Meta.fields if not name.endswith('_srcset')))
+# Fields whose database values are converted by the serializer field itself.
+CONVERTED_FIELDS = (serializers.DecimalField, serializers.DateField, serializers.DateTimeField, serializers.FloatField)
+
+# Nested entities: model, serializer and the relations it renders, per kind.
+ENTITIES = {
+    'authors': (Author, AuthorSerializer, ('languages', 'genres')),
+    'translators': (Translator, TranslatorSerializer, ('languages',)),
+    'publishers': (Publisher, PublisherSerializer, ()),
+    'genres': (Genre, GenreSerializer, ()),
+    'languages': (Language, LanguageSerializer, ()),
+}
+# Book relation -> (through model, column of the related id).
+LINKS = {
+    'authors': (Book.authors.through, 'author_id'),
+    'translators': (Book.translators.through, 'translator_id'),
+    'genres': (Book.genres.through, 'genre_id'),
+}
+
+
+def book_rows(books):
+    """
+    `books` as a values() queryset of the columns the fast serializer needs,
+    plus its annotations (e.g. the search rank) and sort keys, which the
+    keyset pagination reads from the rows.
+    """
+    columns = list(BOOK_COLUMNS)
+    for name in (*books.query.annotations, *books.query.order_by):
+        name = name.lstrip('-') if isinstance(name, str) else None
+        if name and '__' not in name and name not in ('?', 'pk') and name not in columns:
+            columns.append(name)
+    return books.select_related(None).prefetch_related(None).values(*columns)
+
+
+def _converters(serializer):
+    """
+    The serializer's own to_representation() of the fields whose database
+    values need converting (decimals, dates, floats); other values pass as is.
+    """
+    return {
+        name: field.to_representation
+        for name, field in serializer.fields.items()
+        if isinstance(field, CONVERTED_FIELDS)
+    }
+
+
+class FastBookSerializer:
+    """
+    Read-only twin of BookSerializer (without sparse fieldsets) for book list
+    pages, rendering `book_rows()` dicts instead of model instances.
+
+    Per page it runs one values() query per relation for the related ids and
+    one for the formats; authors, translators, publishers, genres and
+    languages are rendered once by their own serializers and cached across
+    requests (see cached_catalog_entities), so no Book or BookFormat is ever
+    instantiated and the JSON is identical to BookSerializer's.
+    """
+    def __init__(self, context):
+        self.context = context
+        self.request = context.get('request')
+        self.book_converters = _converters(BookSerializer(context=context))
+        format_fields = BookFormatSerializer(context=context).fields
+        # (name, column, converter, file field) per rendered format field, in serializer order.
+        self.format_plan = []
+        for name, field in format_fields.items():
+            model_field = BookFormat._meta.get_field(field.source)
+            if isinstance(model_field, models.FileField):
+                self.format_plan.append((name, field.source, field.to_representation, model_field))
+            else:
+                convert = field.to_representation if isinstance(field, CONVERTED_FIELDS) else None
+                self.format_plan.append((name, field.source, convert, None))
+
+    def to_representation(self, rows):
+        rows = list(rows)
+        book_ids = [row['id'] for row in rows]
+        links = {relation: self._links(relation, book_ids) for relation in LINKS}
+        formats = self._formats(book_ids)
+
+        entities = {
+            'authors': self._entities('authors', {pk for ids in links['authors'].values() for pk in ids}),
+            'translators': self._entities('translators', {pk for ids in links['translators'].values() for pk in ids}),
+            'genres': self._entities('genres', {pk for ids in links['genres'].values() for pk in ids}),
+            'publishers': self._entities('publishers', {row['publisher_id'] for row in rows} - {None}),
+            'languages': self._entities('languages', {row['language_id'] for row in rows} - {None}),
+        }
+        return [self._book(row, links, formats, entities) for row in rows]
+
+    def _book(self, row, links, formats, entities):
+        convert = self.book_converters
+        book_id = row['id']
+
+        def column(name):
+            value = row[name]
+            return value if value is None or name not in convert else convert[name](value)
+
+        data = {
+            'id': book_id,
+            'title': row['title'],
+            'authors': [entities['authors'][pk] for pk in links['authors'].get(book_id, ())],
+            'translators': [entities['translators'][pk] for pk in links['translators'].get(book_id, ())],
+            'publisher': entities['publishers'].get(row['publisher_id']),
+            'publication_date': column('publication_date'),
+            'summary': row['summary'],
+            'genres': [entities['genres'][pk] for pk in links['genres'].get(book_id, ())],
+            'language': entities['languages'].get(row['language_id']),
+            'sold_count': row['sold_count'],
+            'average_rating': column('average_rating'),
+            'reviews_count': row['reviews_count'],
+            'rating_histogram': {str(rating): row[field] for rating, field in Book.RATING_COUNT_FIELDS.items()},
+            'min_price': column('min_price'),
+            'min_effective_price': column('min_effective_price'),
+            'max_discount': column('max_discount'),
+            'any_in_stock': row['any_in_stock'],
+            'formats': formats.get(book_id, []),
+            'share_links': share_links(book_id, row['title']),
+        }
+        if 'rank' in row:
+            data['rank'] = round(row['rank'], 4)
+        return data
+
+    def _links(self, relation, book_ids):
+        through, column = LINKS[relation]
+        links = defaultdict(list)
+        # Related rows in id order, as the (unordered) prefetch returns them through the unique index.
+        rows = through.objects.filter(book_id__in=book_ids).order_by(column).values_list('book_id', column)
+        for book_id, related_id in rows:
+            links[book_id].append(related_id)
+        return links
+
+    def _formats(self, book_ids):
+        formats = defaultdict(list)
+        rows = BookFormat.objects.filter(book_id__in=book_ids).order_by('pk').values(*FORMAT_COLUMNS)
+        for row in rows:
+            data = {}
+            for name, column, convert, file_field in self.format_plan:
+                value = row[column]
+                if file_field is not None:
+                    # A FieldFile is only a name plus the storage; nothing is read.
+                    value = FieldFile(None, file_field, value) if value else None
+                data[name] = value if value is None or convert is None else convert(value)
+            formats[row['book_id']].append(data)
+        return formats
+
+    def _entities(self, kind, ids):
+        model, serializer_class, relations = ENTITIES[kind]
+
+        def render(missing):
+            instances = model.objects.filter(pk__in=missing).prefetch_related(*relations)
+            return {item['id']: item for item in serializer_class(instances, many=True, context=self.context).data}
+
+        scope = self.request.build_absolute_uri('/') if self.request is not None else ''
+        return cached_catalog_entities(kind, ids, render, scope=scope)
@@ -23,19 +23,19 @@ class BookFilter(django_filters.FilterSet):
     publisher = django_filters.CharFilter(field_name='publisher__name', lookup_expr='icontains', label='Publisher')
 
     # فیلتر برای قیمت
-    price_min = django_filters.NumberFilter(field_name='price', lookup_expr='gte', label='Min Price')
-    price_max = django_filters.NumberFilter(field_name='price', lookup_expr='lte', label='Max Price')
+    price_min = django_filters.NumberFilter(field_name='min_effective_price', lookup_expr='gte', label='Min Price')
+    price_max = django_filters.NumberFilter(field_name='min_effective_price', lookup_expr='lte', label='Max Price')
 
     # فیلتر برای تاریخ انتشار
     publication_date_min = django_filters.DateFilter(field_name='publication_date', lookup_expr='gte', label='Min Publication Date')
     publication_date_max = django_filters.DateFilter(field_name='publication_date', lookup_expr='lte', label='Max Publication Date')
 
     # فیلترهای اضافی
-    discount_min = django_filters.NumberFilter(field_name='discount', lookup_expr='gte', label='Min Discount')
-    discount_max = django_filters.NumberFilter(field_name='discount', lookup_expr='lte', label='Max Discount')
-    rating_min = django_filters.NumberFilter(field_name='rating', lookup_expr='gte', label='Min Rating')
-    rating_max = django_filters.NumberFilter(field_name='rating', lookup_expr='lte', label='Max Rating')
-    in_stock = django_filters.BooleanFilter(field_name='stock', lookup_expr='gt', method='filter_in_stock', label='In Stock')
+    discount_min = django_filters.NumberFilter(field_name='max_discount', lookup_expr='gte', label='Min Discount')
+    discount_max = django_filters.NumberFilter(field_name='max_discount', lookup_expr='lte', label='Max Discount')
+    rating_min = django_filters.NumberFilter(field_name='average_rating', lookup_expr='gte', label='Min Rating')
+    rating_max = django_filters.NumberFilter(field_name='average_rating', lookup_expr='lte', label='Max Rating')
+    in_stock = django_filters.BooleanFilter(field_name='any_in_stock', method='filter_in_stock', label='In Stock')
 
     class Meta:
         model = Book
@@ -48,7 +48,7 @@ class BookFilter(django_filters.FilterSet):
 
     def filter_in_stock(self, queryset, name, value):
         if value:
-            return queryset.filter(stock__gt=0)
+            return queryset.filter(any_in_stock=True)
         return queryset
 
     def filter_translator_by_full_name(self, queryset, name, value):
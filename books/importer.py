@@ -0,0 +1,345 @@
+import csv
+import io
+import json
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from authors.models import Author
+from genres.models import Genre
+from Language.models import Language
+from publishers.models import Publisher
+from translators.models import Translator
+from book_store.cache import invalidate_catalog
+from .models import Book, BookFormat
+from .search import update_search_vectors
+
+# Columns of a catalog feed (one row per purchasable format). Only title,
+# format_name and price are required; multi-valued columns (authors,
+# translators, genres) are separated by `separator` in CSV and may be lists in JSONL.
+COLUMNS = (
+    'title', 'summary', 'publication_date', 'language', 'publisher', 'authors', 'translators', 'genres',
+    'format_name', 'price', 'isbn', 'page_count', 'weight', 'stock', 'discount', 'status',
+)
+BOOK_UPDATE_FIELDS = ('summary', 'publication_date', 'language_id')
+FORMAT_UPDATE_FIELDS = ('price', 'isbn', 'page_count', 'weight', 'stock', 'discount', 'status')
+# Columns written by COPY; every NOT NULL column without a database default must be present.
+FORMAT_COPY_FIELDS = (
+    'book', 'format_name', 'price', 'isbn', 'page_count', 'weight', 'stock', 'discount', 'status', 'updated_at',
+)
+
+
+class RowError(ValueError):
+    pass
+
+
+def read_rows(path, file_format=None):
+    """
+    Lazily yields `(line_number, row)` from a CSV (with a header) or JSONL file,
+    so memory use does not depend on the file size.
+    """
+    file_format = file_format or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+    with open(path, newline='', encoding='utf-8-sig') as handle:
+        if file_format == 'csv':
+            for line_number, row in enumerate(csv.DictReader(handle), start=2):
+                yield line_number, row
+            return
+        for line_number, line in enumerate(handle, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as error:
+                yield line_number, RowError(f'invalid JSON: {error}')
+                continue
+            yield line_number, row if isinstance(row, dict) else RowError('expected a JSON object')
+
+
+def _text(row, name):
+    value = row.get(name)
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def _list(row, name, separator):
+    value = row.get(name)
+    if isinstance(value, list):
+        values = [str(item).strip() for item in value]
+    else:
+        values = (_text(row, name) or '').split(separator)
+    return list(dict.fromkeys(value.strip() for value in values if value and value.strip()))
+
+
+def _number(row, name, cast, required=False, minimum=None, maximum=None):
+    value = _text(row, name)
+    if value is None:
+        if required:
+            raise RowError(f'{name} is required')
+        return None
+    try:
+        number = cast(value)
+    except (InvalidOperation, ValueError):
+        raise RowError(f'{name} is not a valid number: {value!r}')
+    if (minimum is not None and number < minimum) or (maximum is not None and number > maximum):
+        raise RowError(f'{name} is out of range: {value!r}')
+    return number
+
+
+def split_person_name(name):
+    """
+    "Last, First" or "First Last Names" -> (first_name, last_name).
+    """
+    if ',' in name:
+        last_name, _, first_name = name.partition(',')
+    else:
+        first_name, _, last_name = name.partition(' ')
+    return first_name.strip()[:100], last_name.strip()[:100]
+
+
+def parse_row(row, separator='|'):
+    """
+    Validates and normalizes one feed row.
+    """
+    title = _text(row, 'title')
+    format_name = _text(row, 'format_name')
+    if not title or not format_name:
+        raise RowError('title and format_name are required')
+
+    publication_date = _text(row, 'publication_date')
+    if publication_date:
+        try:
+            publication_date = date.fromisoformat(publication_date)
+        except ValueError:
+            raise RowError(f'publication_date must be YYYY-MM-DD: {publication_date!r}')
+
+    isbn = _text(row, 'isbn')
+    if isbn:
+        isbn = isbn.replace('-', '').replace(' ', '')
+        if len(isbn) > 13:
+            raise RowError(f'isbn is too long: {isbn!r}')
+
+    status = _text(row, 'status') or BookFormat.Status.IN_STOCK
+    if status not in BookFormat.Status.values:
+        raise RowError(f'unknown status: {status!r}')
+
+    return {
+        'title': title[:255],
+        'summary': _text(row, 'summary'),
+        'publication_date': publication_date or None,
+        'language': _text(row, 'language'),
+        'publisher': _text(row, 'publisher'),
+        'authors': [split_person_name(name) for name in _list(row, 'authors', separator)],
+        'translators': [split_person_name(name) for name in _list(row, 'translators', separator)],
+        'genres': _list(row, 'genres', separator),
+        'format_name': format_name[:100],
+        'price': _number(row, 'price', Decimal, required=True, minimum=0).quantize(Decimal(1)),
+        'isbn': isbn,
+        'page_count': _number(row, 'page_count', int, minimum=0),
+        'weight': _number(row, 'weight', Decimal, minimum=0),
+        'stock': _number(row, 'stock', int) or 0,
+        'discount': _number(row, 'discount', Decimal, minimum=0, maximum=100),
+        'status': status,
+    }
+
+
+class LookupMap:
+    """
+    In-memory `natural key -> id` map of a small related table. Unknown keys are
+    looked up in one query per batch and the still-missing ones are bulk created.
+    """
+
+    def __init__(self, model, key_fields, defaults=None):
+        self.model = model
+        self.key_fields = key_fields
+        self.defaults = defaults or {}
+        self.ids = {}
+        self.created = 0
+
+    def resolve(self, keys):
+        missing = {key for key in keys if key not in self.ids}
+        if missing:
+            self._fetch(missing)
+            new = missing - self.ids.keys()
+            if new:
+                self.model.objects.bulk_create(
+                    [self.model(**dict(zip(self.key_fields, key)), **self.defaults) for key in new]
+                )
+                self.created += len(new)
+                self._fetch(new)
+        return self.ids
+
+    def _fetch(self, keys):
+        lookups = {f'{field}__in': {key[index] for key in keys} for index, field in enumerate(self.key_fields)}
+        rows = self.model.objects.filter(**lookups).order_by('pk').values_list('pk', *self.key_fields)
+        for pk, *key in rows:
+            # Names are not unique everywhere (e.g. publishers); the oldest row wins.
+            self.ids.setdefault(tuple(key), pk)
+
+
+class CatalogImporter:
+    """
+    Imports normalized feed rows batch by batch. Each batch is one transaction
+    of a constant number of bulk queries, whatever its size:
+
+    - related entities are resolved through LookupMaps;
+    - books are matched on (title, publisher) and formats on ISBN, then on
+      (book, format_name); new rows are bulk created (formats through COPY on
+      PostgreSQL), changed ones bulk updated;
+    - signal-maintained data (format summaries, search vectors, catalog
+      cache) is refreshed once per batch instead of once per row.
+    """
+
+    def __init__(self, use_copy=None):
+        self.languages = LookupMap(Language, ('name',))
+        self.genres = LookupMap(Genre, ('name',))
+        self.publishers = LookupMap(Publisher, ('name',))
+        self.authors = LookupMap(Author, ('first_name', 'last_name'), defaults={'biography': ''})
+        self.translators = LookupMap(Translator, ('first_name', 'last_name'))
+        if use_copy is None:
+            use_copy = connection.vendor == 'postgresql'
+        self.use_copy = use_copy
+        self.stats = dict.fromkeys(('books_created', 'books_updated', 'formats_created', 'formats_updated'), 0)
+
+    def import_batch(self, rows):
+        with transaction.atomic():
+            book_ids = self._import_books(rows)
+            self._link_relations(rows, book_ids)
+            self._import_formats(rows, book_ids)
+            update_search_vectors(set(book_ids.values()))
+        invalidate_catalog('books', 'book', 'authors', 'genres', 'publishers')
+
+    def _import_books(self, rows):
+        languages = self.languages.resolve({(row['language'],) for row in rows if row['language']})
+        publishers = self.publishers.resolve({(row['publisher'],) for row in rows if row['publisher']})
+        for row in rows:
+            row['language_id'] = languages.get((row['language'],))
+            row['publisher_id'] = publishers.get((row['publisher'],))
+
+        def existing():
+            books = {}
+            titles = {row['title'] for row in rows}
+            fields = ('id', 'title', 'publisher_id', *BOOK_UPDATE_FIELDS)
+            for book in Book.objects.filter(title__in=titles).order_by('pk').only(*fields):
+                books.setdefault((book.title, book.publisher_id), book)
+            return books
+
+        books = existing()
+        new_books = {}
+        changed = {}
+        for row in rows:
+            key = (row['title'], row['publisher_id'])
+            book = books.get(key)
+            if book is None:
+                book = new_books.setdefault(key, Book(title=row['title'], publisher_id=row['publisher_id']))
+            for field in BOOK_UPDATE_FIELDS:
+                value = row[field]
+                if value is not None and getattr(book, field) != value:
+                    setattr(book, field, value)
+                    if book.pk:
+                        changed[book.pk] = book
+
+        if new_books:
+            Book.objects.bulk_create(new_books.values())
+            books = existing()
+        if changed:
+            # bulk_update() skips auto_now, so updated_at is set explicitly.
+            now = timezone.now()
+            for book in changed.values():
+                book.updated_at = now
+            Book.objects.bulk_update(changed.values(), (*BOOK_UPDATE_FIELDS, 'updated_at'))
+        self.stats['books_created'] += len(new_books)
+        self.stats['books_updated'] += len(changed)
+        return {key: book.pk for key, book in books.items()}
+
+    def _link_relations(self, rows, book_ids):
+        relations = (
+            ('authors', self.authors, Book.authors.through, 'author_id', lambda name: name),
+            ('translators', self.translators, Book.translators.through, 'translator_id', lambda name: name),
+            ('genres', self.genres, Book.genres.through, 'genre_id', lambda name: (name,)),
+        )
+        for column, lookup, through, target, key in relations:
+            ids = lookup.resolve({key(name) for row in rows for name in row[column]})
+            links = {
+                (book_ids[(row['title'], row['publisher_id'])], ids[key(name)])
+                for row in rows for name in row[column]
+            }
+            links -= set(
+                through.objects.filter(book_id__in=set(book_ids.values())).values_list('book_id', target)
+            )
+            if links:
+                # New links change the book pages without touching the book rows.
+                Book.touch({book_id for book_id, _ in links})
+                through.objects.bulk_create(
+                    [through(book_id=book_id, **{target: related_id}) for book_id, related_id in links],
+                    ignore_conflicts=True,
+                )
+
+    def _import_formats(self, rows, book_ids):
+        ids = set(book_ids.values())
+        isbns = {row['isbn'] for row in rows if row['isbn']}
+        fields = ('id', 'book_id', 'format_name', *FORMAT_UPDATE_FIELDS)
+        existing = BookFormat.objects.filter(book_id__in=ids).only(*fields)
+        if isbns:
+            existing = existing | BookFormat.objects.filter(isbn__in=isbns).only(*fields)
+        by_isbn, by_name = {}, {}
+        for book_format in existing:
+            by_name[(book_format.book_id, book_format.format_name)] = book_format
+            if book_format.isbn:
+                by_isbn[book_format.isbn] = book_format
+
+        new_formats = {}
+        changed = {}
+        for row in rows:
+            book_id = book_ids[(row['title'], row['publisher_id'])]
+            key = (book_id, row['format_name'])
+            book_format = by_isbn.get(row['isbn']) or by_name.get(key) or new_formats.get(key)
+            if book_format is None:
+                book_format = new_formats[key] = BookFormat(book_id=book_id, format_name=row['format_name'])
+                if row['isbn']:
+                    by_isbn[row['isbn']] = book_format
+            for field in FORMAT_UPDATE_FIELDS:
+                if row[field] is not None and getattr(book_format, field) != row[field]:
+                    setattr(book_format, field, row[field])
+                    if book_format.pk:
+                        changed[book_format.pk] = book_format
+
+        if new_formats:
+            if self.use_copy:
+                self._copy_formats(new_formats.values())
+            else:
+                # BookFormatQuerySet.bulk_create() refreshes the book summaries.
+                BookFormat.objects.bulk_create(new_formats.values())
+        if changed:
+            # bulk_update() goes through BookFormatQuerySet.update(), which refreshes the summaries.
+            BookFormat.objects.bulk_update(changed.values(), FORMAT_UPDATE_FIELDS)
+        self.stats['formats_created'] += len(new_formats)
+        self.stats['formats_updated'] += len(changed)
+
+    def _copy_formats(self, formats):
+        """
+        Streams new formats into the table with PostgreSQL's COPY, the fastest bulk insert path.
+        """
+        fields = [BookFormat._meta.get_field(name) for name in FORMAT_COPY_FIELDS]
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        book_ids = set()
+        # COPY skips pre_save(), so auto_now is set here.
+        now = timezone.now()
+        for book_format in formats:
+            book_ids.add(book_format.book_id)
+            book_format.updated_at = now
+            # An unquoted empty value is NULL in COPY's CSV format.
+            writer.writerow(['' if value is None else value for value in (getattr(book_format, f.attname) for f in fields)])
+        buffer.seek(0)
+
+        quote = connection.ops.quote_name
+        columns = ', '.join(quote(field.column) for field in fields)
+        with connection.cursor() as cursor:
+            cursor.cursor.copy_expert(
+                f'COPY {quote(BookFormat._meta.db_table)} ({columns}) FROM STDIN WITH (FORMAT csv)', buffer
+            )
+        Book.refresh_format_summaries(book_ids)
@@ -0,0 +1,59 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from book_store.cache import invalidate_catalog
+from book_store.serializers import optimize_queryset
+from books.fast_serializers import FastBookSerializer, book_rows
+from books.models import Book
+from books.serializers import BookSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        'Times one book list page rendered by BookSerializer and by FastBookSerializer '
+        '(see settings.CATALOG_FAST_SERIALIZATION), queries included, and checks both produce the same JSON.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-size', type=int, default=20, help='Books per page.')
+        parser.add_argument('--repeat', type=int, default=50, help='Number of timed renders per serializer.')
+
+    def handle(self, *args, **options):
+        request = Request(RequestFactory().get('/books/', HTTP_HOST=settings.ALLOWED_HOSTS[0]))
+        context = {'request': request}
+        books = Book.objects.defer('search_vector').order_by('-id')
+        page_size = options['page_size']
+        if not books.exists():
+            raise CommandError('There are no books to render.')
+
+        def serializer_page():
+            page = optimize_queryset(books, BookSerializer(context=context))[:page_size]
+            return BookSerializer(page, many=True, context=context).data
+
+        def fast_page():
+            return FastBookSerializer(context).to_representation(book_rows(books)[:page_size])
+
+        if JSONRenderer().render(serializer_page()) != JSONRenderer().render(fast_page()):
+            raise CommandError('FastBookSerializer output differs from BookSerializer.')
+
+        invalidate_catalog('entities')
+        started = time.perf_counter()
+        fast_page()
+        cold = time.perf_counter() - started
+
+        timings = {}
+        for name, render in (('BookSerializer', serializer_page), ('FastBookSerializer', fast_page)):
+            started = time.perf_counter()
+            for _ in range(options['repeat']):
+                render()
+            timings[name] = (time.perf_counter() - started) / options['repeat']
+            self.stdout.write(f'{name}: {timings[name] * 1000:.2f} ms per page of {page_size}.')
+
+        self.stdout.write(f'FastBookSerializer with a cold entity cache: {cold * 1000:.2f} ms.')
+        self.stdout.write(self.style.SUCCESS(
+            f'Speedup: {timings["BookSerializer"] / timings["FastBookSerializer"]:.1f}x; identical JSON.'
+        ))
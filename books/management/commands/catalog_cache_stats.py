@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from book_store.cache import catalog_cache_stats, reset_catalog_cache_stats
+
+
+class Command(BaseCommand):
+    help = 'Shows the hit/miss counters and hit ratio of the anonymous catalog response cache.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Reset the counters after printing them.')
+
+    def handle(self, *args, **options):
+        for namespace, stats in catalog_cache_stats().items():
+            ratio = '-' if stats['hit_ratio'] is None else f"{stats['hit_ratio']:.2%}"
+            self.stdout.write(f"{namespace:<12} hits={stats['hits']:<10} misses={stats['misses']:<10} ratio={ratio}")
+
+        if options['reset']:
+            reset_catalog_cache_stats()
+            self.stdout.write(self.style.SUCCESS('Catalog cache counters reset.'))
@@ -0,0 +1,32 @@
+import sys
+
+from django.core.management.base import BaseCommand
+from books.exporter import FORMATS, catalog_queryset, export_chunks, export_rows
+
+
+class Command(BaseCommand):
+    help = 'Streams the whole catalog as NDJSON or CSV (one row per book format) with flat memory use.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-', help='Output file; "-" (default) writes to stdout.')
+        parser.add_argument('--format', choices=list(FORMATS), default='ndjson', help='Output format.')
+        parser.add_argument('--gzip', action='store_true', help='Gzip the output on the fly.')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Books fetched (and prefetched) per round trip.')
+        parser.add_argument('--separator', default='|', help='Separator of multi-valued CSV columns.')
+
+    def handle(self, *args, **options):
+        rows = export_rows(catalog_queryset(), chunk_size=options['chunk_size'])
+        chunks = export_chunks(rows, options['format'], compress=options['gzip'], separator=options['separator'])
+
+        if options['path'] == '-':
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
+            return
+
+        written = 0
+        with open(options['path'], 'wb') as handle:
+            for chunk in chunks:
+                handle.write(chunk)
+                written += len(chunk)
+        self.stdout.write(self.style.SUCCESS(f'Exported the catalog to {options["path"]} ({written} bytes).'))
@@ -0,0 +1,49 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from PIL import Image
+from book_store.cache import invalidate_catalog
+from book_store.images import IMAGE_FIELDS, generate_derivatives, has_derivatives
+
+
+class Command(BaseCommand):
+    help = (
+        'Generates the resized WebP/JPEG derivatives (see book_store.images) of uploaded covers, '
+        'pictures and logos that do not have them yet.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Regenerate existing derivatives too.')
+        parser.add_argument('--model', action='append', help='Only this model label (e.g. books.BookFormat); repeatable.')
+
+    def handle(self, *args, **options):
+        generated = skipped = failed = 0
+        for label, field_name in IMAGE_FIELDS:
+            if options['model'] and label not in options['model']:
+                continue
+            model = apps.get_model(label)
+            storage = model._meta.get_field(field_name).storage
+            # Only the distinct file names are read, never whole rows.
+            names = (
+                model.objects.exclude(**{f'{field_name}__isnull': True}).exclude(**{field_name: ''})
+                .order_by().values_list(field_name, flat=True).distinct()
+            )
+            for name in names.iterator():
+                if not options['force'] and has_derivatives(storage, name):
+                    skipped += 1
+                    continue
+                try:
+                    generate_derivatives(storage, name)
+                except (OSError, Image.DecompressionBombError) as error:
+                    failed += 1
+                    self.stderr.write(f'{label} {name}: {error}')
+                    continue
+                generated += 1
+            self.stdout.write(f'{label}.{field_name} done.')
+
+        if generated:
+            # Cached pages rendered before the backfill list no derivatives for these images.
+            invalidate_catalog('books', 'book', 'authors', 'publishers', 'entities')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated derivatives for {generated} images; {skipped} already had them, {failed} failed.'
+        ))
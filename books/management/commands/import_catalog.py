@@ -0,0 +1,90 @@
+import json
+import os
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from books.importer import COLUMNS, CatalogImporter, RowError, parse_row, read_rows
+
+
+class Command(BaseCommand):
+    help = (
+        'Streams a CSV or JSONL supplier catalog (one row per book format) into the database in '
+        'bulk, batch by batch. Columns: ' + ', '.join(COLUMNS) + '.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV (with header) or JSONL file.')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='File format; guessed from the extension by default.')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Number of rows imported per transaction.')
+        parser.add_argument('--separator', default='|', help='Separator of multi-valued CSV columns (authors, translators, genres).')
+        parser.add_argument('--max-errors', type=int, default=100, help='Abort after this many invalid rows.')
+        parser.add_argument('--checkpoint', help='File recording the committed position, used to resume an interrupted import.')
+        parser.add_argument('--no-copy', action='store_true', help='Use bulk INSERTs instead of COPY on PostgreSQL.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.exists(path):
+            raise CommandError(f'File not found: {path}')
+        batch_size = options['batch_size']
+        checkpoint = options['checkpoint']
+
+        skip = self._read_checkpoint(checkpoint, path)
+        if skip:
+            self.stdout.write(f'Resuming after row {skip}.')
+
+        importer = CatalogImporter(use_copy=False if options['no_copy'] else None)
+        rows = islice(read_rows(path, options['format']), skip, None)
+        position, imported, errors = skip, 0, 0
+        started = time.monotonic()
+
+        while True:
+            chunk = list(islice(rows, batch_size))
+            if not chunk:
+                break
+            batch = []
+            for line_number, row in chunk:
+                try:
+                    if isinstance(row, RowError):
+                        raise row
+                    batch.append(parse_row(row, options['separator']))
+                except RowError as error:
+                    errors += 1
+                    self.stderr.write(f'Line {line_number}: {error}')
+                    if errors > options['max_errors']:
+                        raise CommandError(f'Too many invalid rows; resume from row {position} with --checkpoint.')
+            if batch:
+                importer.import_batch(batch)
+
+            # The batch is committed, so an interrupted run can restart from here.
+            position += len(chunk)
+            imported += len(batch)
+            self._write_checkpoint(checkpoint, path, position)
+            elapsed = max(time.monotonic() - started, 1e-9)
+            self.stdout.write(f'{imported} rows imported ({imported / elapsed:.0f} rows/s).')
+
+        if checkpoint and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        elapsed = max(time.monotonic() - started, 1e-9)
+        stats = ', '.join(f'{name.replace("_", " ")}: {count}' for name, count in importer.stats.items())
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {imported} rows in {elapsed:.1f}s ({imported / elapsed:.0f} rows/s); '
+            f'{stats}; invalid rows: {errors}.'
+        ))
+
+    def _read_checkpoint(self, checkpoint, path):
+        if not checkpoint or not os.path.exists(checkpoint):
+            return 0
+        with open(checkpoint, encoding='utf-8') as handle:
+            state = json.load(handle)
+        if state.get('path') != os.path.abspath(path):
+            raise CommandError(f'Checkpoint {checkpoint} belongs to {state.get("path")}.')
+        return state['rows']
+
+    def _write_checkpoint(self, checkpoint, path, rows):
+        if not checkpoint:
+            return
+        temporary = f'{checkpoint}.tmp'
+        with open(temporary, 'w', encoding='utf-8') as handle:
+            json.dump({'path': os.path.abspath(path), 'rows': rows}, handle)
+        os.replace(temporary, checkpoint)
@@ -0,0 +1,48 @@
+from collections import defaultdict
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+from book_store.cache import invalidate_catalog
+from books.models import Book
+from reviews.models import Review
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the stored rating aggregates (average, count, histogram) of every book from its reviews.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of books updated per query.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        # A single grouped query over all reviews instead of one aggregate per book.
+        histograms = defaultdict(dict)
+        rows = Review.objects.order_by().values_list('book_id', 'rating').annotate(count=Count('id'))
+        for book_id, rating, count in rows.iterator():
+            histograms[book_id][rating] = count
+
+        fields = ['average_rating', 'reviews_count', *Book.RATING_COUNT_FIELDS.values()]
+        updated = 0
+        batch = []
+        now = timezone.now()
+        with transaction.atomic():
+            for book in Book.objects.only('id', 'updated_at', *fields).iterator(chunk_size=batch_size):
+                stored = [getattr(book, field) for field in fields]
+                book.set_rating_stats(histograms.get(book.id, {}))
+                if [getattr(book, field) for field in fields] != stored:
+                    # Only the books whose stats drifted get a new ETag.
+                    book.updated_at = now
+                batch.append(book)
+                if len(batch) >= batch_size:
+                    Book.objects.bulk_update(batch, [*fields, 'updated_at'])
+                    updated += len(batch)
+                    batch = []
+            if batch:
+                Book.objects.bulk_update(batch, [*fields, 'updated_at'])
+                updated += len(batch)
+            # bulk_update() sends no signals, so drop the cached book pages explicitly.
+            invalidate_catalog('books', 'book')
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt rating stats for {updated} books.'))
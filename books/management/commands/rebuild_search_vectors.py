@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from books.models import Book
+from books.search import update_search_vectors
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the stored full-text search document of every book in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000, help='Number of books updated per transaction.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('The book search document requires PostgreSQL.')
+
+        batch_size = options['batch_size']
+        last_id = 0
+        updated = 0
+        while True:
+            # Walk the primary key in ranges so each batch is a short, index-driven UPDATE.
+            ids = list(
+                Book.objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            with transaction.atomic():
+                updated += update_search_vectors(ids)
+            last_id = ids[-1]
+            self.stdout.write(f'Indexed {updated} books...')
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt search vectors for {updated} books.'))
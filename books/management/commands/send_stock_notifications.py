@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from books.models import BookFormat
+from books.notifications import notify_restock
+
+
+class Command(BaseCommand):
+    help = (
+        'Sends the pending restock emails of every in-stock book format, e.g. those '
+        'queued by BookFormat saves that were lost on a restart.'
+    )
+
+    def handle(self, *args, **options):
+        format_ids = (
+            BookFormat.objects.filter(stock__gt=0, stock_notifications__notified=False)
+            .order_by('pk').values_list('pk', flat=True).distinct()
+        )
+        sent = 0
+        for format_id in format_ids:
+            sent += notify_restock(format_id)
+        self.stdout.write(self.style.SUCCESS(f'Sent {sent} stock notification emails.'))
@@ -0,0 +1,77 @@
+# Generated by Django 5.1.5 on 2026-10-18 13:15
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_rating_stats(apps, schema_editor):
+    """
+    Computes the new rating aggregates for books that already have reviews.
+    """
+    Book = apps.get_model("books", "Book")
+    Review = apps.get_model("reviews", "Review")
+
+    histograms = {}
+    rows = Review.objects.order_by().values_list("book_id", "rating").annotate(count=Count("id"))
+    for book_id, rating, count in rows:
+        histograms.setdefault(book_id, {})[rating] = count
+
+    for book_id, histogram in histograms.items():
+        total = sum(histogram.values())
+        rating_sum = sum(rating * count for rating, count in histogram.items())
+        Book.objects.filter(pk=book_id).update(
+            reviews_count=total,
+            average_rating=round(Decimal(rating_sum) / total, 2),
+            **{f"rating_{rating}_count": histogram.get(rating, 0) for rating in range(1, 6)},
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("books", "0011_bookformat_preorder_end_date_bookformat_status"),
+        ("reviews", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="book",
+            name="average_rating",
+            field=models.DecimalField(
+                blank=True, db_index=True, decimal_places=2, max_digits=3, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="book",
+            name="rating_1_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="book",
+            name="rating_2_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="book",
+            name="rating_3_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="book",
+            name="rating_4_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="book",
+            name="rating_5_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="book",
+            name="reviews_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_rating_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.1.5 on 2026-10-18 13:17
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+SEARCH_INDEX = django.contrib.postgres.indexes.GinIndex(
+    fields=["search_vector"], name="book_search_vector_gin"
+)
+
+
+def create_search_index(apps, schema_editor):
+    # GIN indexes only exist on PostgreSQL; other backends keep the plain column.
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.add_index(apps.get_model("books", "Book"), SEARCH_INDEX)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.remove_index(apps.get_model("books", "Book"), SEARCH_INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("Language", "0001_initial"),
+        ("authors", "0001_initial"),
+        ("books", "0012_book_rating_stats"),
+        ("genres", "0001_initial"),
+        ("publishers", "0001_initial"),
+        ("translators", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="book",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True
+            ),
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(model_name="book", index=SEARCH_INDEX),
+            ],
+            database_operations=[
+                migrations.RunPython(create_search_index, drop_search_index),
+            ],
+        ),
+    ]
@@ -0,0 +1,107 @@
+# Generated by Django 5.1.5 on 2026-10-18 13:22
+
+from decimal import Decimal
+
+from django.db import migrations, models
+
+
+def backfill_format_summary(apps, schema_editor):
+    """
+    Computes the new summary columns for existing books from their formats.
+    """
+    Book = apps.get_model("books", "Book")
+    BookFormat = apps.get_model("books", "BookFormat")
+
+    summaries = {}
+    for book_id, price, discount, stock in BookFormat.objects.values_list(
+        "book_id", "price", "discount", "stock"
+    ):
+        effective_price = (price * (100 - (discount or 0)) / Decimal(100)).quantize(Decimal(1))
+        summary = summaries.setdefault(
+            book_id, {"prices": [], "effective": [], "discounts": [], "stock": 0, "in_stock": False}
+        )
+        summary["prices"].append(price)
+        summary["effective"].append(effective_price)
+        if discount is not None:
+            summary["discounts"].append(discount)
+        summary["stock"] += stock
+        summary["in_stock"] = summary["in_stock"] or stock > 0
+
+    for book_id, summary in summaries.items():
+        Book.objects.filter(pk=book_id).update(
+            min_price=min(summary["prices"]),
+            min_effective_price=min(summary["effective"]),
+            max_discount=max(summary["discounts"], default=None),
+            total_stock=summary["stock"],
+            any_in_stock=summary["in_stock"],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("Language", "0001_initial"),
+        ("authors", "0001_initial"),
+        ("books", "0013_book_search_vector"),
+        ("genres", "0001_initial"),
+        ("publishers", "0001_initial"),
+        ("translators", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="book",
+            name="any_in_stock",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="book",
+            name="max_discount",
+            field=models.DecimalField(
+                blank=True, decimal_places=0, max_digits=5, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="book",
+            name="min_effective_price",
+            field=models.DecimalField(
+                blank=True, decimal_places=0, max_digits=15, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="book",
+            name="min_price",
+            field=models.DecimalField(
+                blank=True, decimal_places=0, max_digits=15, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="book",
+            name="total_stock",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name="book",
+            index=models.Index(fields=["min_price", "id"], name="book_min_price_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="book",
+            index=models.Index(
+                fields=["min_effective_price", "id"], name="book_effective_price_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="book",
+            index=models.Index(
+                fields=["any_in_stock", "min_effective_price"],
+                name="book_stock_price_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="book",
+            index=models.Index(
+                fields=["max_discount", "id"], name="book_max_discount_idx"
+            ),
+        ),
+        migrations.RunPython(backfill_format_summary, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.1.5 on 2026-10-18 15:02
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.db import migrations, models
+from django.db.models.functions import Collate
+
+AUTOCOMPLETE_INDEX = django.contrib.postgres.indexes.GinIndex(
+    django.contrib.postgres.indexes.OpClass(
+        django.db.models.functions.text.Upper("title"), name="gin_trgm_ops"
+    ),
+    name="book_title_trgm",
+)
+
+# SQLite can serve case-insensitive prefix LIKEs from NOCASE b-tree indexes.
+SQLITE_INDEXES = [
+    models.Index(Collate("title", "NOCASE"), name="book_title_nocase"),
+]
+
+
+def create_autocomplete_indexes(apps, schema_editor):
+    model = apps.get_model("books", "Book")
+    if schema_editor.connection.vendor == "postgresql":
+        # pg_trgm provides the gin_trgm_ops operator class; it is kept on reverse.
+        schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        schema_editor.add_index(model, AUTOCOMPLETE_INDEX)
+    elif schema_editor.connection.vendor == "sqlite":
+        for index in SQLITE_INDEXES:
+            schema_editor.add_index(model, index)
+
+
+def drop_autocomplete_indexes(apps, schema_editor):
+    model = apps.get_model("books", "Book")
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.remove_index(model, AUTOCOMPLETE_INDEX)
+    elif schema_editor.connection.vendor == "sqlite":
+        for index in SQLITE_INDEXES:
+            schema_editor.remove_index(model, index)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("books", "0014_book_format_summary"),
+    ]
+
+    # Both kinds of index exist on one backend only, so neither is part of the
+    # model state: table rebuilds on SQLite would otherwise try to create the
+    # GIN index. books.autocomplete restores the NOCASE ones after such rebuilds.
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[],
+            database_operations=[
+                migrations.RunPython(
+                    create_autocomplete_indexes, drop_autocomplete_indexes
+                ),
+            ],
+        ),
+    ]
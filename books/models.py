@@ -1,10 +1,17 @@
+from decimal import Decimal
 from django.db import models
+from django.db.models import Case, Count, Exists, ExpressionWrapper, F, FloatField, Max, Min, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce, Round
 from django.conf import settings
+from django.utils import timezone
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from authors.models import Author
 from publishers.models import Publisher
 from translators.models import Translator
 from genres.models import Genre
 from Language.models import Language
+from book_store.cache import invalidate_catalog
 
 class Book(models.Model):
     # Core, conceptual fields remain
@@ -20,9 +27,144 @@ class Book(models.Model):
     # This field is not format-specific
     sold_count = models.IntegerField(default=0)  # تعداد فروخته‌شد
 
+    # Denormalized review aggregates, kept in sync by reviews.signals
+    average_rating = models.DecimalField(max_digits=3, decimal_places=2, null=True, blank=True, db_index=True)  # میانگین امتیاز
+    reviews_count = models.PositiveIntegerField(default=0)  # تعداد نظرات
+    rating_1_count = models.PositiveIntegerField(default=0)
+    rating_2_count = models.PositiveIntegerField(default=0)
+    rating_3_count = models.PositiveIntegerField(default=0)
+    rating_4_count = models.PositiveIntegerField(default=0)
+    rating_5_count = models.PositiveIntegerField(default=0)
+
+    # Summary of the book's formats, maintained by books.signals and BookFormatQuerySet
+    min_price = models.DecimalField(max_digits=15, decimal_places=0, null=True, blank=True)  # کمترین قیمت
+    min_effective_price = models.DecimalField(max_digits=15, decimal_places=0, null=True, blank=True)  # کمترین قیمت پس از تخفیف
+    max_discount = models.DecimalField(max_digits=5, decimal_places=0, null=True, blank=True)  # بیشترین درصد تخفیف
+    total_stock = models.IntegerField(default=0)  # مجموع موجودی
+    any_in_stock = models.BooleanField(default=False)  # حداقل یک فرمت موجود است
+
+    # Weighted full-text document, maintained by books.signals (see books.search)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    # Moves forward with any change to what the book pages render (formats,
+    # relations, reviews); the ETag/Last-Modified of the detail view.
+    updated_at = models.DateTimeField(auto_now=True)  # تاریخ آخرین تغییر
+
+    RATING_COUNT_FIELDS = {
+        1: 'rating_1_count',
+        2: 'rating_2_count',
+        3: 'rating_3_count',
+        4: 'rating_4_count',
+        5: 'rating_5_count',
+    }
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector'], name='book_search_vector_gin'),
+            models.Index(fields=['min_price', 'id'], name='book_min_price_idx'),
+            models.Index(fields=['min_effective_price', 'id'], name='book_effective_price_idx'),
+            models.Index(fields=['any_in_stock', 'min_effective_price'], name='book_stock_price_idx'),
+            models.Index(fields=['max_discount', 'id'], name='book_max_discount_idx'),
+        ]
+
     def __str__(self):
         return self.title
 
+    @property
+    def rating_histogram(self):
+        return {rating: getattr(self, field) for rating, field in self.RATING_COUNT_FIELDS.items()}
+
+    def set_rating_stats(self, histogram):
+        """
+        Sets the stored aggregates from a {rating: count} mapping without saving.
+        """
+        total = 0
+        rating_sum = 0
+        for rating, field in self.RATING_COUNT_FIELDS.items():
+            count = histogram.get(rating, 0)
+            setattr(self, field, count)
+            total += count
+            rating_sum += rating * count
+        self.reviews_count = total
+        self.average_rating = round(Decimal(rating_sum) / total, 2) if total else None
+
+    @classmethod
+    def touch(cls, book_ids):
+        """
+        Moves `updated_at` of the given books (ids or an id subquery) forward,
+        for changes stored outside the book row.
+        """
+        return cls.objects.filter(pk__in=book_ids).update(updated_at=timezone.now())
+
+    @classmethod
+    def refresh_format_summaries(cls, book_ids):
+        """
+        Recomputes the price/stock summary columns of the given books from their
+        formats in a single UPDATE with correlated subqueries.
+        """
+        book_ids = [book_id for book_id in book_ids if book_id is not None]
+        if not book_ids:
+            return 0
+        formats = BookFormat.objects.filter(book=OuterRef('pk')).order_by().values('book')
+
+        def aggregate(expression):
+            return Subquery(formats.annotate(value=expression).values('value')[:1])
+
+        return cls.objects.filter(pk__in=book_ids).update(
+            min_price=aggregate(Min('price')),
+            min_effective_price=aggregate(Min(BookFormat.effective_price_expression())),
+            max_discount=aggregate(Max('discount')),
+            total_stock=Coalesce(aggregate(Sum('stock')), 0),
+            any_in_stock=Exists(BookFormat.objects.filter(book=OuterRef('pk'), stock__gt=0)),
+            updated_at=timezone.now(),
+        )
+
+    def refresh_rating_stats(self):
+        """
+        Recomputes the stored aggregates from the book's reviews in one grouped query.
+        """
+        histogram = dict(self.reviews.order_by().values_list('rating').annotate(count=Count('id')))
+        self.set_rating_stats(histogram)
+        self.save(update_fields=['average_rating', 'reviews_count', *self.RATING_COUNT_FIELDS.values(), 'updated_at'])
+
+    @classmethod
+    def apply_rating_change(cls, book_id, added=None, removed=None):
+        """
+        Incrementally adjusts the stored aggregates of a book when a review with
+        rating `added` appears and/or a review with rating `removed` disappears.
+        Runs as a single UPDATE built from F() expressions, so concurrent review
+        writes never overwrite each other's counts.
+        """
+        if added == removed:
+            return
+        deltas = {}
+        if added is not None:
+            deltas[added] = deltas.get(added, 0) + 1
+        if removed is not None:
+            deltas[removed] = deltas.get(removed, 0) - 1
+
+        count_delta = sum(deltas.values())
+        sum_delta = sum(rating * delta for rating, delta in deltas.items())
+
+        # SET expressions see the pre-update row, so the deltas are added explicitly.
+        rating_sum = sum(
+            (F(field) * rating for rating, field in cls.RATING_COUNT_FIELDS.items()),
+            Value(sum_delta),
+        )
+        new_count = F('reviews_count') + count_delta
+        updates = {
+            cls.RATING_COUNT_FIELDS[rating]: F(cls.RATING_COUNT_FIELDS[rating]) + delta
+            for rating, delta in deltas.items()
+        }
+        updates['reviews_count'] = new_count
+        updates['updated_at'] = timezone.now()
+        updates['average_rating'] = Case(
+            When(reviews_count__lte=-count_delta, then=Value(None)),
+            default=Round(Cast(rating_sum, FloatField()) / Cast(new_count, FloatField()), 2),
+            output_field=models.DecimalField(max_digits=3, decimal_places=2),
+        )
+        cls.objects.filter(pk=book_id).update(**updates)
+
     # --- Obsolete classmethods removed ---
     @classmethod
     def get_books_by_genre(cls, genre_name):
@@ -45,6 +187,49 @@ class Book(models.Model):
         return cls.objects.filter(publication_date__gte=start_date, publication_date__lte=end_date)
 
 
+class BookFormatQuerySet(models.QuerySet):
+    """
+    Bulk writes bypass model signals, so they refresh the Book summary columns
+    (or just touch the books) and invalidate the cached catalog responses here;
+    updates of columns no catalog response shows stay a single UPDATE.
+    """
+    SUMMARY_FIELDS = {'book', 'book_id', 'price', 'discount', 'stock'}
+    CATALOG_FIELDS = SUMMARY_FIELDS | {'format_name', 'isbn', 'page_count', 'weight', 'cover_image', 'status'}
+    _book_ids = None
+
+    def of_books(self, book_ids):
+        """
+        The same formats, with the ids of their books known, so update() does
+        not look them up first.
+        """
+        clone = self._chain()
+        clone._book_ids = set(book_ids)
+        return clone
+
+    def update(self, **kwargs):
+        kwargs.setdefault('updated_at', timezone.now())
+        if not self.CATALOG_FIELDS.intersection(kwargs):
+            return super().update(**kwargs)
+        book_ids = set(self.values_list('book_id', flat=True)) if self._book_ids is None else set(self._book_ids)
+        rows = super().update(**kwargs)
+        new_book = kwargs.get('book', kwargs.get('book_id'))
+        if new_book is not None:
+            book_ids.add(getattr(new_book, 'pk', new_book))
+        if self.SUMMARY_FIELDS.intersection(kwargs):
+            Book.refresh_format_summaries(book_ids)
+        else:
+            Book.touch(book_ids)
+        invalidate_catalog('books', book_ids=book_ids)
+        return rows
+
+    def bulk_create(self, objs, *args, **kwargs):
+        created = super().bulk_create(objs, *args, **kwargs)
+        book_ids = {obj.book_id for obj in created}
+        Book.refresh_format_summaries(book_ids)
+        invalidate_catalog('books', book_ids=book_ids)
+        return created
+
+
 class BookFormat(models.Model):
     class Status(models.TextChoices):
         IN_STOCK = 'in_stock', 'In Stock'
@@ -68,7 +253,9 @@ class BookFormat(models.Model):
         verbose_name="وضعیت"
     )
     preorder_end_date = models.DateTimeField(null=True, blank=True, verbose_name="تاریخ پایان پیش‌سفارش")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="تاریخ بروزرسانی")
 
+    objects = BookFormatQuerySet.as_manager()
 
     class Meta:
         verbose_name = "فرمت کتاب"
@@ -78,6 +265,18 @@ class BookFormat(models.Model):
     def __str__(self):
         return f"{self.book.title} ({self.format_name})"
 
+    @staticmethod
+    def effective_price_expression():
+        """
+        The price after the format's percentage discount, as a database expression.
+        """
+        decimal = models.DecimalField(max_digits=15, decimal_places=2)
+        discounted = ExpressionWrapper(
+            F('price') * (Value(Decimal(100)) - Coalesce('discount', Value(Decimal(0)))) * Value(Decimal('0.01')),
+            output_field=decimal,
+        )
+        return Round(discounted, output_field=models.DecimalField(max_digits=15, decimal_places=0))
+
 
 class Category(models.Model):
     name = models.CharField(max_length=255, unique=True)  # نام دسته‌بندی
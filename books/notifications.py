@@ -0,0 +1,93 @@
+import logging
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .models import BookFormat, StockNotification
+
+logger = logging.getLogger(__name__)
+
+# Subscribers claimed (marked notified) per transaction and then mailed;
+# overridable through settings.STOCK_NOTIFICATION_BATCH_SIZE.
+DEFAULT_BATCH_SIZE = 200
+
+
+def restock_message(notification, book_format, connection=None):
+    return EmailMessage(
+        f"کتاب مورد علاقه شما موجود شد: {book_format.book.title}",
+        (
+            f"سلام {notification.user.username},\n\n"
+            f"کتاب '{book_format.book.title}' (فرمت: {book_format.format_name}) که منتظرش بودید، دوباره موجود شده است.\n"
+            f"هم اکنون می‌توانید آن را از فروشگاه ما تهیه کنید.\n\n"
+            f"با تشکر,\n"
+            f"تیم فروشگاه کتاب"
+        ),
+        settings.EMAIL_HOST_USER,
+        [notification.user.email],
+        connection=connection,
+    )
+
+
+def _notify_batch(book_format, last_id, batch_size, connection):
+    """
+    Claims the next batch of pending subscribers after `last_id` by marking
+    them notified in one short transaction, then mails them over the open SMTP
+    `connection` with no locks held. Subscribers whose email fails are put back
+    to pending; a crash while sending loses those emails rather than sending
+    them twice. Returns `(last id, sent)`, or None once there is nobody left.
+    """
+    with transaction.atomic():
+        # skip_locked lets concurrent workers for the same format split the subscribers.
+        notifications = list(
+            StockNotification.objects
+            .filter(book_format=book_format, notified=False, pk__gt=last_id)
+            .select_related('user')
+            .select_for_update(skip_locked=True, of=('self',))
+            .order_by('pk')[:batch_size]
+        )
+        if not notifications:
+            return None
+
+        # A user has one notified row per format (unique together); the latest restock replaces it.
+        StockNotification.objects.filter(
+            book_format=book_format, notified=True, user_id__in=[n.user_id for n in notifications],
+        ).delete()
+        StockNotification.objects.filter(pk__in=[n.pk for n in notifications]).update(
+            notified=True, notified_at=timezone.now(),
+        )
+
+    failed = []
+    for notification in notifications:
+        try:
+            connection.send_messages([restock_message(notification, book_format, connection)])
+        except Exception:
+            logger.exception('Failed to send stock notification email to %s', notification.user.email)
+            failed.append(notification.pk)
+    if failed:
+        # Pending again for the next restock or the send_stock_notifications command.
+        StockNotification.objects.filter(pk__in=failed).update(notified=False, notified_at=None)
+    return notifications[-1].pk, len(notifications) - len(failed)
+
+
+def notify_restock(book_format_id):
+    """
+    Mails every pending subscriber of a format that is in stock, in batches of
+    settings.STOCK_NOTIFICATION_BATCH_SIZE over a single SMTP connection.
+    Returns the number of emails sent.
+    """
+    book_format = BookFormat.objects.select_related('book').filter(pk=book_format_id, stock__gt=0).first()
+    if book_format is None:
+        return 0
+
+    batch_size = getattr(settings, 'STOCK_NOTIFICATION_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+    last_id = total = 0
+    with get_connection() as connection:
+        while True:
+            batch = _notify_batch(book_format, last_id, batch_size, connection)
+            if batch is None:
+                break
+            last_id, sent = batch
+            total += sent
+    return total
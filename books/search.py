@@ -0,0 +1,55 @@
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import SearchVector
+from django.db import connection
+from django.db.models import OuterRef, Subquery, TextField, Value
+from django.db.models.functions import Coalesce, Concat
+
+from .models import Book
+
+
+def _names_subquery(through, related_name, *name_fields):
+    """
+    Builds a correlated subquery returning the space-joined names of a book's
+    related rows, so authors/genres contribute one value per book instead of
+    one joined row each.
+    """
+    parts = []
+    for field in name_fields:
+        if parts:
+            parts.append(Value(' '))
+        parts.append(f'{related_name}__{field}')
+    name = Concat(*parts) if len(parts) > 1 else parts[0]
+    names = (
+        through.objects.filter(book_id=OuterRef('pk'))
+        .order_by()
+        .values('book_id')
+        .annotate(names=StringAgg(name, delimiter=' '))
+        .values('names')[:1]
+    )
+    return Coalesce(Subquery(names), Value(''), output_field=TextField())
+
+
+def book_search_vector():
+    """
+    The weighted document stored in Book.search_vector:
+    title (A), summary (B), authors (C) and genres (D).
+    """
+    return (
+        SearchVector('title', weight='A') +
+        SearchVector(Coalesce('summary', Value(''), output_field=TextField()), weight='B') +
+        SearchVector(_names_subquery(Book.authors.through, 'author', 'first_name', 'last_name'), weight='C') +
+        SearchVector(_names_subquery(Book.genres.through, 'genre', 'name'), weight='D')
+    )
+
+
+def update_search_vectors(book_ids=None):
+    """
+    Recomputes the stored search document for the given books (or all books).
+    The document is a PostgreSQL tsvector, so this is a no-op on other backends.
+    """
+    if connection.vendor != 'postgresql':
+        return 0
+    books = Book.objects.all()
+    if book_ids is not None:
+        books = books.filter(pk__in=book_ids)
+    return books.update(search_vector=book_search_vector())
@@ -1,6 +1,7 @@
 import urllib.parse
 from rest_framework import serializers
-from django.db.models import Avg
+from book_store.images import ImageDerivativesField
+from book_store.serializers import SparseFieldsetMixin
 from .models import Book, BookFormat, StockNotification
 from authors.serializers import AuthorSerializer
 from publishers.serializers import PublisherSerializer
@@ -8,11 +9,32 @@ from translators.serializers import TranslatorSerializer
 from genres.serializers import GenreSerializer
 from Language.serializers import LanguageSerializer
 
-class BookFormatSerializer(serializers.ModelSerializer):
+def share_links(book_id, title):
+    """
+    Social media sharing links of a book.
+    """
+    # NOTE: The base URL is a placeholder. The frontend should replace
+    # 'https://example.com' with its actual domain.
+    book_url = f"https://example.com/books/{book_id}"
+    encoded_url = urllib.parse.quote(book_url)
+
+    text = f"Check out this book: {title}"
+    encoded_text = urllib.parse.quote(text)
+
+    return {
+        'twitter': f"https://twitter.com/intent/tweet?url={encoded_url}&text={encoded_text}",
+        'facebook': f"https://www.facebook.com/sharer/sharer.php?u={encoded_url}",
+        'whatsapp': f"https://api.whatsapp.com/send?text={encoded_text}%20{encoded_url}"
+    }
+
+
+class BookFormatSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """
     Serializer for the BookFormat model. This represents a specific, purchasable
     version of a book.
     """
+    cover_image_srcset = ImageDerivativesField(source='cover_image')
+
     class Meta:
         model = BookFormat
         fields = [
@@ -23,22 +45,24 @@ class BookFormatSerializer(serializers.ModelSerializer):
             'page_count',
             'weight',
             'cover_image',
+            'cover_image_srcset',
             'stock',
             'discount',
         ]
 
-class BookSerializer(serializers.ModelSerializer):
+class BookSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """
     Serializer for the conceptual Book model. It now includes a nested list
     of all its available formats.
+    Supports `?fields=` / `?expand=` sparse fieldsets (see SparseFieldsetMixin).
     """
     authors = AuthorSerializer(many=True, read_only=True)
     translators = TranslatorSerializer(many=True, read_only=True)
     publisher = PublisherSerializer(read_only=True)
     genres = GenreSerializer(many=True, read_only=True)
     language = LanguageSerializer(read_only=True)
-    average_rating = serializers.SerializerMethodField()
-    reviews_count = serializers.SerializerMethodField()
+    average_rating = serializers.FloatField(read_only=True)
+    rating_histogram = serializers.DictField(child=serializers.IntegerField(), read_only=True)
     formats = BookFormatSerializer(many=True, read_only=True)  # Nested serializer
     share_links = serializers.SerializerMethodField()
 
@@ -59,11 +83,19 @@ class BookSerializer(serializers.ModelSerializer):
             'sold_count',
             'average_rating',
             'reviews_count',
+            'rating_histogram',
+            'min_price',
+            'min_effective_price',
+            'max_discount',
+            'any_in_stock',
             'formats',  # Replaced old fields with this nested list
             'share_links',
             'rank',
         ]
-        read_only_fields = ['id', 'sold_count', 'average_rating', 'reviews_count', 'share_links', 'rank']
+        read_only_fields = [
+            'id', 'sold_count', 'average_rating', 'reviews_count', 'rating_histogram',
+            'min_price', 'min_effective_price', 'max_discount', 'any_in_stock', 'share_links', 'rank',
+        ]
 
     def to_representation(self, instance):
         """
@@ -72,7 +104,7 @@ class BookSerializer(serializers.ModelSerializer):
         ret = super().to_representation(instance)
 
         # Check if the instance has the 'rank' attribute (from annotation)
-        if hasattr(instance, 'rank'):
+        if hasattr(instance, 'rank') and 'rank' in self.fields:
             ret['rank'] = round(instance.rank, 4)
         else:
             # If rank is not present, we can either remove it or set to None
@@ -86,34 +118,7 @@ class BookSerializer(serializers.ModelSerializer):
         """
         Generates social media sharing links for the book.
         """
-        # NOTE: The base URL is a placeholder. The frontend should replace
-        # 'https://example.com' with its actual domain.
-        book_url = f"https://example.com/books/{obj.id}"
-        encoded_url = urllib.parse.quote(book_url)
-
-        text = f"Check out this book: {obj.title}"
-        encoded_text = urllib.parse.quote(text)
-
-        return {
-            'twitter': f"https://twitter.com/intent/tweet?url={encoded_url}&text={encoded_text}",
-            'facebook': f"https://www.facebook.com/sharer/sharer.php?u={encoded_url}",
-            'whatsapp': f"https://api.whatsapp.com/send?text={encoded_text}%20{encoded_url}"
-        }
-
-    def get_average_rating(self, obj):
-        """
-        Calculates the average rating from all associated reviews.
-        """
-        reviews = obj.reviews.all()
-        if reviews.exists():
-            return round(reviews.aggregate(Avg('rating'))['rating__avg'], 2)
-        return None
-
-    def get_reviews_count(self, obj):
-        """
-        Counts the total number of reviews for the book.
-        """
-        return obj.reviews.count()
+        return share_links(obj.id, obj.title)
 
 
 class StockNotificationSerializer(serializers.ModelSerializer):
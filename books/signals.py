@@ -1,49 +1,265 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_init, post_migrate, post_save, post_delete, pre_delete, m2m_changed
 from django.dispatch import receiver
-from django.core.mail import send_mail
-from django.conf import settings
-from django.utils import timezone
-from .models import BookFormat, StockNotification
+from django.db.models import Q
+from authors.models import Author
+from genres.models import Genre
+from publishers.models import Publisher
+from translators.models import Translator
+from Language.models import Language
+from book_store.cache import invalidate_catalog
+from book_store.images import IMAGE_FIELDS, image_changed, remember_image_name, schedule_derivatives
+from book_store.tasks import run_after_commit
+from .autocomplete import restore_sqlite_autocomplete_indexes
+from .models import Book, BookFormat, StockNotification
+from .notifications import notify_restock
+from .search import update_search_vectors
+
+# Book fields that are part of the stored search document.
+SEARCH_DOCUMENT_FIELDS = {'title', 'summary'}
 
 @receiver(post_save, sender=BookFormat)
 def send_stock_notifications(sender, instance, created, **kwargs):
     """
-    Signal receiver to send notifications when a BookFormat comes back in stock.
+    Queues the restock emails of a BookFormat that is in stock and has pending
+    subscribers; books.notifications.notify_restock sends them in the
+    background once the save commits.
     """
     if not created and instance.stock > 0:
-        # To avoid sending notifications every time an in-stock item is saved,
-        # we check for pending notifications. This implies the item was out of stock.
-
-        pending_notifications = StockNotification.objects.filter(
-            book_format=instance,
-            notified=False
-        )
-
-        if pending_notifications.exists():
-            subject = f"کتاب مورد علاقه شما موجود شد: {instance.book.title}"
-            from_email = settings.EMAIL_HOST_USER
-
-            for notification in pending_notifications:
-                message = (
-                    f"سلام {notification.user.username},\n\n"
-                    f"کتاب '{instance.book.title}' (فرمت: {instance.format_name}) که منتظرش بودید، دوباره موجود شده است.\n"
-                    f"هم اکنون می‌توانید آن را از فروشگاه ما تهیه کنید.\n\n"
-                    f"با تشکر,\n"
-                    f"تیم فروشگاه کتاب"
-                )
-
-                try:
-                    # In a real app, this should be an async task (e.g., Celery)
-                    send_mail(
-                        subject,
-                        message,
-                        from_email,
-                        [notification.user.email],
-                        fail_silently=False,
-                    )
-                    notification.notified = True
-                    notification.notified_at = timezone.now()
-                    notification.save(update_fields=['notified', 'notified_at'])
-                except Exception as e:
-                    # Proper logging should be implemented here
-                    print(f"Failed to send stock notification email to {notification.user.email}: {e}")
+        # Pending subscriptions imply the item was out of stock until now.
+        if StockNotification.objects.filter(book_format=instance, notified=False).exists():
+            run_after_commit(notify_restock, instance.pk)
+
+
+@receiver(post_save, sender=BookFormat)
+@receiver(post_delete, sender=BookFormat)
+def refresh_book_format_summary(sender, instance, **kwargs):
+    """
+    Keeps the price/stock summary columns of the parent book in sync with its formats.
+    """
+    Book.refresh_format_summaries([instance.book_id])
+
+
+@receiver(post_save, sender=Book)
+def refresh_book_search_vector(sender, instance, update_fields=None, **kwargs):
+    """
+    Recomputes the stored search document when a book's title or summary may have changed.
+    """
+    if update_fields is not None and not SEARCH_DOCUMENT_FIELDS.intersection(update_fields):
+        return
+    update_search_vectors([instance.pk])
+
+
+@receiver(m2m_changed, sender=Book.authors.through)
+@receiver(m2m_changed, sender=Book.genres.through)
+def refresh_search_vector_on_relation_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Keeps the search document in sync when authors or genres are attached to or detached from books.
+    """
+    if reverse and action == 'pre_clear':
+        # The affected books are unknown after the clear, so remember them now.
+        instance._search_book_ids = list(instance.book_set.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        update_search_vectors([instance.pk])
+    elif action == 'post_clear':
+        update_search_vectors(getattr(instance, '_search_book_ids', []))
+    else:
+        update_search_vectors(pk_set)
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=Genre)
+def refresh_search_vector_on_name_change(sender, instance, created, **kwargs):
+    """
+    Author and genre names are part of the search document of every linked book.
+    """
+    if not created:
+        update_search_vectors(instance.book_set.values('pk'))
+
+
+@receiver(pre_delete, sender=Author)
+@receiver(pre_delete, sender=Genre)
+def remember_books_before_delete(sender, instance, **kwargs):
+    instance._search_book_ids = list(instance.book_set.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=Genre)
+def refresh_search_vector_on_delete(sender, instance, **kwargs):
+    update_search_vectors(getattr(instance, '_search_book_ids', []))
+
+
+# Cached catalog namespaces (see book_store.cache) that embed each related model.
+CATALOG_NAMESPACES_BY_MODEL = {
+    Author: ('authors', 'books', 'book', 'entities'),
+    Genre: ('genres', 'authors', 'books', 'book', 'entities'),
+    Publisher: ('publishers', 'books', 'book', 'entities'),
+    Translator: ('books', 'book', 'entities'),
+    Language: ('authors', 'books', 'book', 'entities'),
+}
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def invalidate_book_cache(sender, instance, **kwargs):
+    invalidate_catalog('books', book_ids=[instance.pk])
+
+
+@receiver(post_save, sender=BookFormat)
+@receiver(post_delete, sender=BookFormat)
+def invalidate_book_format_cache(sender, instance, **kwargs):
+    invalidate_catalog('books', book_ids=[instance.book_id])
+
+
+@receiver(m2m_changed, sender=Book.authors.through)
+@receiver(m2m_changed, sender=Book.translators.through)
+@receiver(m2m_changed, sender=Book.genres.through)
+def invalidate_book_relations_cache(sender, instance, action, reverse, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        invalidate_catalog('books', 'book')
+    else:
+        invalidate_catalog('books', book_ids=[instance.pk])
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=Genre)
+@receiver(post_save, sender=Publisher)
+@receiver(post_save, sender=Translator)
+@receiver(post_save, sender=Language)
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=Genre)
+@receiver(post_delete, sender=Publisher)
+@receiver(post_delete, sender=Translator)
+@receiver(post_delete, sender=Language)
+def invalidate_catalog_entity_cache(sender, instance, **kwargs):
+    """
+    A change to an author, genre, publisher, translator or language only drops
+    the cached endpoints that render it.
+    """
+    invalidate_catalog(*CATALOG_NAMESPACES_BY_MODEL[sender])
+
+
+@receiver(m2m_changed, sender=Author.genres.through)
+@receiver(m2m_changed, sender=Author.languages.through)
+@receiver(m2m_changed, sender=Translator.languages.through)
+def invalidate_nested_relations_cache(sender, instance, action, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    model = Translator if sender is Translator.languages.through else Author
+    invalidate_catalog(*CATALOG_NAMESPACES_BY_MODEL[model])
+
+
+# Book lookups of each related model, including the nested author/translator
+# relations the book pages render.
+BOOK_LOOKUPS_BY_MODEL = {
+    Author: ('authors',),
+    Genre: ('genres', 'authors__genres'),
+    Publisher: ('publisher',),
+    Translator: ('translators',),
+    Language: ('language', 'authors__languages', 'translators__languages'),
+}
+
+
+def embedding_books(model, pks):
+    """
+    Id subquery of the books whose pages render any of the `model` rows `pks`.
+    """
+    condition = Q()
+    for lookup in BOOK_LOOKUPS_BY_MODEL[model]:
+        condition |= Q(**{f'{lookup}__in': pks})
+    return Book.objects.filter(condition).order_by().values('pk')
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=Genre)
+@receiver(post_save, sender=Publisher)
+@receiver(post_save, sender=Translator)
+@receiver(post_save, sender=Language)
+def touch_books_on_entity_change(sender, instance, created, **kwargs):
+    """
+    Moves `updated_at` of the books that render a changed author, genre,
+    publisher, translator or language forward, so their ETags change too.
+    """
+    if not created:
+        Book.touch(embedding_books(sender, [instance.pk]))
+
+
+@receiver(pre_delete, sender=Author)
+@receiver(pre_delete, sender=Genre)
+@receiver(pre_delete, sender=Publisher)
+@receiver(pre_delete, sender=Translator)
+@receiver(pre_delete, sender=Language)
+def remember_books_to_touch(sender, instance, **kwargs):
+    # The links are gone (or set to NULL) after the delete.
+    instance._touched_book_ids = list(embedding_books(sender, [instance.pk]).values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=Genre)
+@receiver(post_delete, sender=Publisher)
+@receiver(post_delete, sender=Translator)
+@receiver(post_delete, sender=Language)
+def touch_books_on_entity_delete(sender, instance, **kwargs):
+    Book.touch(getattr(instance, '_touched_book_ids', []))
+
+
+@receiver(m2m_changed, sender=Book.authors.through)
+@receiver(m2m_changed, sender=Book.translators.through)
+@receiver(m2m_changed, sender=Book.genres.through)
+@receiver(m2m_changed, sender=Author.genres.through)
+@receiver(m2m_changed, sender=Author.languages.through)
+@receiver(m2m_changed, sender=Translator.languages.through)
+def touch_books_on_relation_change(sender, instance, action, reverse, model, pk_set, **kwargs):
+    """
+    Relation changes are not saved on the book row, so they touch the affected
+    books explicitly: the book itself, or the books of the changed author or translator.
+    """
+    if reverse and action == 'pre_clear':
+        # The affected books are unknown after the clear, so remember them now.
+        instance._touched_book_ids = list(embedding_books(type(instance), [instance.pk]).values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    owner, pks = (model, pk_set) if reverse else (type(instance), [instance.pk])
+    if action == 'post_clear' and reverse:
+        Book.touch(getattr(instance, '_touched_book_ids', []))
+    elif owner is Book:
+        Book.touch(pks)
+    else:
+        Book.touch(embedding_books(owner, pks))
+
+
+for model in (BookFormat, Author, Translator, Publisher):
+    receiver(post_init, sender=model)(remember_image_name)
+
+
+@receiver(post_save, sender=BookFormat)
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=Translator)
+@receiver(post_save, sender=Publisher)
+def schedule_image_derivatives(sender, instance, update_fields=None, **kwargs):
+    """
+    Resizes a newly uploaded cover, picture or logo in the background (see book_store.images).
+    """
+    field_name = dict(IMAGE_FIELDS)[sender._meta.label]
+    if image_changed(instance, field_name, update_fields):
+        if sender is BookFormat:
+            schedule_derivatives(instance.cover_image, 'books', book_ids=[instance.book_id])
+        else:
+            schedule_derivatives(getattr(instance, field_name), *CATALOG_NAMESPACES_BY_MODEL[sender])
+
+
+@receiver(post_migrate)
+def restore_autocomplete_indexes(sender, using, **kwargs):
+    """
+    Puts back the SQLite autocomplete indexes that migrations rebuilding a
+    table dropped (see books.autocomplete); sent once per app, run once.
+    """
+    if sender.name == 'books':
+        restore_sqlite_autocomplete_indexes(using)
@@ -1,9 +1,45 @@
+import datetime
+import json
+import os
+import tempfile
+import gzip
+from unittest import skipUnless
+from django.conf import settings
+from django.http import HttpResponse
+from io import StringIO
+from django.core import mail
+from django.core.mail import get_connection
+from django.core.management import call_command
+from django.db import connections
+from django.db.models import Case, F, FloatField, Value, When
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from unittest.mock import patch
+from django.utils import timezone
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import RequestFactory, TestCase, override_settings
+from PIL import Image
 from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APITestCase, APITransactionTestCase, APIRequestFactory
+from django.core.cache import cache
+from book_store import db_router
+from book_store.cache import catalog_cache_stats
+from book_store.images import ImageDerivativesField, derivative_name
+from book_store.pagination import KeysetPagination
 from django.contrib.auth import get_user_model
+from authors.models import Author
+from translators.models import Translator
+from genres.models import Genre
+from Language.models import Language
+from publishers.models import Publisher
+from .fast_serializers import FastBookSerializer, book_rows
+from .autocomplete import restore_sqlite_autocomplete_indexes
+from .importer import CatalogImporter, parse_row, read_rows
 from .models import Book, BookFormat, StockNotification
+from .notifications import notify_restock
+from .serializers import BookSerializer
 
 User = get_user_model()
 
@@ -60,42 +96,938 @@ class StockNotificationTests(APITestCase):
 
         response = self.client.get(self.subscribe_url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['user'], self.user.username)
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['user'], self.user.username)
 
-    @patch('books.signals.send_mail')
-    def test_notification_email_sent_on_restock(self, mock_send_mail):
+    @override_settings(BACKGROUND_TASKS_EAGER=True)
+    def test_notification_email_sent_on_restock(self):
         """Test that an email is sent when a product is restocked."""
         # User subscribes to notification
         StockNotification.objects.create(user=self.user, book_format=self.out_of_stock_format)
 
-        # Update the stock
-        self.out_of_stock_format.stock = 5
-        self.out_of_stock_format.save()
-
-        # Check that send_mail was called
-        mock_send_mail.assert_called_once()
+        # Update the stock; the email only goes out once the save commits
+        with self.captureOnCommitCallbacks(execute=True):
+            self.out_of_stock_format.stock = 5
+            self.out_of_stock_format.save()
+            self.assertEqual(len(mail.outbox), 0)
 
         # Check email content
-        args, kwargs = mock_send_mail.call_args
-        self.assertIn("کتاب مورد علاقه شما موجود شد", args[0])
-        self.assertIn(self.user.username, args[1])
-        self.assertEqual(args[3], [self.user.email])
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn("کتاب مورد علاقه شما موجود شد", mail.outbox[0].subject)
+        self.assertIn(self.user.username, mail.outbox[0].body)
+        self.assertEqual(mail.outbox[0].to, [self.user.email])
 
         # Check that the notification is marked as notified
         notification = StockNotification.objects.get(user=self.user, book_format=self.out_of_stock_format)
         self.assertTrue(notification.notified)
         self.assertIsNotNone(notification.notified_at)
 
-    @patch('books.signals.send_mail')
-    def test_no_email_sent_if_stock_does_not_change_from_zero(self, mock_send_mail):
+    @override_settings(BACKGROUND_TASKS_EAGER=True)
+    def test_no_email_sent_if_stock_does_not_change_from_zero(self):
         """Test that no email is sent if stock is updated but remains zero or was already positive."""
-        # Scenario 1: Stock was already positive
-        self.in_stock_format.stock = 15
-        self.in_stock_format.save()
-        mock_send_mail.assert_not_called()
-
-        # Scenario 2: Stock is updated but remains zero
-        self.out_of_stock_format.stock = 0
-        self.out_of_stock_format.save()
-        mock_send_mail.assert_not_called()
+        StockNotification.objects.create(user=self.user, book_format=self.out_of_stock_format)
+        with self.captureOnCommitCallbacks(execute=True):
+            # Scenario 1: Stock was already positive
+            self.in_stock_format.stock = 15
+            self.in_stock_format.save()
+
+            # Scenario 2: Stock is updated but remains zero
+            self.out_of_stock_format.stock = 0
+            self.out_of_stock_format.save()
+        self.assertEqual(len(mail.outbox), 0)
+
+    @override_settings(BACKGROUND_TASKS_EAGER=True, STOCK_NOTIFICATION_BATCH_SIZE=10)
+    def test_restock_fans_out_in_batches_over_one_connection(self):
+        users = User.objects.bulk_create(
+            User(username=f'reader{index}', email=f'reader{index}@example.com') for index in range(25)
+        )
+        StockNotification.objects.bulk_create(
+            StockNotification(user=user, book_format=self.out_of_stock_format) for user in users
+        )
+        # An earlier restock's row of the same user is replaced, not a unique violation.
+        StockNotification.objects.create(user=users[0], book_format=self.out_of_stock_format, notified=True)
+
+        with patch('books.notifications.get_connection', wraps=get_connection) as connections:
+            with self.captureOnCommitCallbacks() as callbacks:
+                self.out_of_stock_format.stock = 5
+                self.out_of_stock_format.save()
+            # The format, then per batch of 10 a savepoint around select, delete and update,
+            # and a last, empty select.
+            with self.assertNumQueries(1 + 3 * 5 + 3):
+                callbacks[0]()
+        connections.assert_called_once()
+        self.assertEqual(len(mail.outbox), 25)
+        self.assertEqual(StockNotification.objects.filter(notified=True).count(), 25)
+        self.assertFalse(StockNotification.objects.filter(notified=True, notified_at__isnull=True).exists())
+
+    def test_failed_emails_stay_pending_for_the_command(self):
+        StockNotification.objects.create(user=self.user, book_format=self.out_of_stock_format)
+        BookFormat.objects.filter(pk=self.out_of_stock_format.pk).update(stock=3)
+        with patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError), \
+                self.assertLogs('books.notifications', 'ERROR'):
+            self.assertEqual(notify_restock(self.out_of_stock_format.pk), 0)
+        self.assertTrue(StockNotification.objects.filter(notified=False).exists())
+
+        out = StringIO()
+        call_command('send_stock_notifications', stdout=out)
+        self.assertIn('Sent 1 stock notification emails.', out.getvalue())
+        self.assertFalse(StockNotification.objects.filter(notified=False).exists())
+
+
+class SearchVectorSignalTests(APITestCase):
+    def setUp(self):
+        self.book = Book.objects.create(title='Searchable Book')
+        self.author = Author.objects.create(first_name='Sadegh', last_name='Hedayat', biography='')
+        self.genre = Genre.objects.create(name='Novel')
+
+    @patch('books.signals.update_search_vectors')
+    def test_book_save_refreshes_document(self, mock_update):
+        self.book.title = 'Renamed Book'
+        self.book.save()
+        mock_update.assert_called_once_with([self.book.pk])
+
+    @patch('books.signals.update_search_vectors')
+    def test_unrelated_update_fields_are_ignored(self, mock_update):
+        self.book.save(update_fields=['sold_count'])
+        mock_update.assert_not_called()
+
+    @patch('books.signals.update_search_vectors')
+    def test_relation_changes_refresh_document(self, mock_update):
+        self.book.authors.add(self.author)
+        mock_update.assert_called_with([self.book.pk])
+
+        self.genre.book_set.add(self.book)
+        mock_update.assert_called_with({self.book.pk})
+
+        self.genre.book_set.clear()
+        mock_update.assert_called_with([self.book.pk])
+
+    @patch('books.signals.update_search_vectors')
+    def test_author_rename_refreshes_linked_books(self, mock_update):
+        self.book.authors.add(self.author)
+        mock_update.reset_mock()
+
+        self.author.last_name = 'H.'
+        self.author.save()
+        book_ids = mock_update.call_args.args[0]
+        self.assertEqual(list(book_ids.values_list('pk', flat=True)), [self.book.pk])
+
+
+class KeysetPaginationTests(APITestCase):
+    def setUp(self):
+        dates = [None, datetime.date(2020, 1, 1), datetime.date(2021, 1, 1), None,
+                 datetime.date(2020, 1, 1), datetime.date(2022, 1, 1), datetime.date(2020, 1, 1)]
+        self.books = [Book.objects.create(title=f'Book {i}', publication_date=d) for i, d in enumerate(dates)]
+        self.factory = APIRequestFactory()
+
+    def _walk(self, queryset, page_size=2):
+        """Follows `next` links to the end, then `previous` links back to the start."""
+        forward, pages = [], []
+        url = f'/books/?page_size={page_size}'
+        while url:
+            paginator = KeysetPagination()
+            page = paginator.paginate_queryset(queryset, Request(self.factory.get(url)))
+            pages.append([book.pk for book in page])
+            forward.extend(book.pk for book in page)
+            previous_url, url = paginator.get_previous_link(), paginator.get_next_link()
+
+        backward = pages.pop()
+        url = previous_url
+        while url:
+            paginator = KeysetPagination()
+            page = paginator.paginate_queryset(queryset, Request(self.factory.get(url)))
+            self.assertEqual([book.pk for book in page], pages.pop())
+            backward = [book.pk for book in page] + backward
+            url = paginator.get_previous_link()
+        self.assertEqual(pages, [])
+        return forward, backward
+
+    def test_default_ordering_is_newest_first(self):
+        forward, backward = self._walk(Book.objects.all())
+        expected = [book.pk for book in reversed(self.books)]
+        self.assertEqual(forward, expected)
+        self.assertEqual(backward, expected)
+
+    def test_nullable_sort_key_with_ties_is_stable(self):
+        for ordering in ('publication_date', '-publication_date'):
+            forward, backward = self._walk(Book.objects.order_by(ordering))
+            expected = list(Book.objects.order_by(
+                F('publication_date').desc(nulls_first=True) if ordering.startswith('-')
+                else F('publication_date').asc(nulls_last=True),
+                '-id' if ordering.startswith('-') else 'id',
+            ).values_list('pk', flat=True))
+            self.assertEqual(forward, expected)
+            self.assertEqual(backward, expected)
+
+    def test_float_sort_key_with_near_ties_is_stable(self):
+        # Thirds and their neighbours one ulp away, in cursor rows on both sides of page boundaries.
+        ranks = [1 / 3, 1 / 3, 0.1 + 0.2, 1 / 3 + 2 ** -54, 0.3, 1 / 3, 0.3]
+        cases = Case(*(When(pk=book.pk, then=Value(rank)) for book, rank in zip(self.books, ranks)), output_field=FloatField())
+        queryset = Book.objects.annotate(rank=cases).order_by('-rank')
+        forward, backward = self._walk(queryset)
+        expected = [book.pk for _, book in sorted(zip(ranks, self.books), key=lambda pair: (-pair[0], -pair[1].pk))]
+        self.assertEqual(forward, expected)
+        self.assertEqual(backward, expected)
+
+        paginator = KeysetPagination()
+        paginator.paginate_queryset(queryset, Request(self.factory.get('/books/?page_size=2')))
+        self.assertEqual(paginator._position(paginator.page[-1])[0], (1 / 3).hex())
+
+    def test_page_size_is_bounded_and_no_count_query(self):
+        paginator = KeysetPagination()
+        request = Request(self.factory.get('/books/?page_size=1000'))
+        with self.assertNumQueries(1):
+            paginator.paginate_queryset(Book.objects.all(), request)
+        self.assertEqual(paginator.get_page_size(request), KeysetPagination.max_page_size)
+
+    def test_invalid_cursor_returns_404(self):
+        response = self.client.get('/books/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_book_list_links(self):
+        response = self.client.get('/books/', {'page_size': 5})
+        self.assertEqual(len(response.data['results']), 5)
+        self.assertIsNone(response.data['previous'])
+
+        response = self.client.get(response.data['next'])
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertIsNone(response.data['next'])
+        self.assertIsNotNone(response.data['previous'])
+
+
+class BookFormatSummaryTests(APITestCase):
+    def setUp(self):
+        self.cheap = Book.objects.create(title='Cheap Book')
+        self.pricey = Book.objects.create(title='Pricey Book')
+        self.cheap_paperback = BookFormat.objects.create(book=self.cheap, format_name='Paperback', price=100, stock=0)
+        BookFormat.objects.create(book=self.cheap, format_name='Hardcover', price=300, stock=2, discount=50)
+        BookFormat.objects.create(book=self.pricey, format_name='Hardcover', price=500, stock=0, discount=10)
+
+    def test_summary_follows_format_save_and_delete(self):
+        self.cheap.refresh_from_db()
+        self.assertEqual(self.cheap.min_price, 100)
+        self.assertEqual(self.cheap.min_effective_price, 100)
+        self.assertEqual(self.cheap.max_discount, 50)
+        self.assertEqual(self.cheap.total_stock, 2)
+        self.assertTrue(self.cheap.any_in_stock)
+
+        self.cheap_paperback.delete()
+        self.cheap.refresh_from_db()
+        self.assertEqual(self.cheap.min_price, 300)
+        self.assertEqual(self.cheap.min_effective_price, 150)
+
+    def test_summary_follows_bulk_writes(self):
+        BookFormat.objects.filter(book=self.pricey).update(stock=7)
+        self.pricey.refresh_from_db()
+        self.assertEqual(self.pricey.total_stock, 7)
+        self.assertTrue(self.pricey.any_in_stock)
+
+        formats = list(BookFormat.objects.filter(book=self.pricey))
+        for book_format in formats:
+            book_format.price = 50
+        BookFormat.objects.bulk_update(formats, ['price'])
+        self.pricey.refresh_from_db()
+        self.assertEqual(self.pricey.min_effective_price, 45)
+
+        BookFormat.objects.bulk_create([BookFormat(book=self.pricey, format_name='Ebook', price=10)])
+        self.pricey.refresh_from_db()
+        self.assertEqual(self.pricey.min_price, 10)
+
+    def test_price_sorting_and_filters_use_summary(self):
+        response = self.client.get('/books/price-desc/')
+        self.assertEqual([b['title'] for b in response.data['results']], ['Pricey Book', 'Cheap Book'])
+
+        response = self.client.get('/books/', {'in_stock': 'true'})
+        self.assertEqual([b['title'] for b in response.data['results']], ['Cheap Book'])
+
+        response = self.client.get('/books/', {'price_min': 200})
+        self.assertEqual([b['title'] for b in response.data['results']], ['Pricey Book'])
+
+        response = self.client.get('/books/discount/')
+        self.assertEqual([b['title'] for b in response.data['results']], ['Cheap Book', 'Pricey Book'])
+
+
+class CatalogCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='reader', password='password123', email='reader@example.com')
+        self.book = Book.objects.create(title='Cached Book')
+        self.other = Book.objects.create(title='Other Book')
+        self.book_format = BookFormat.objects.create(book=self.book, format_name='Paperback', price=100, stock=1)
+        self.genre = Genre.objects.create(name='Drama')
+        Publisher.objects.create(name='Cached Press')
+
+    def test_anonymous_list_is_served_from_cache(self):
+        first = self.client.get('/books/', {'page_size': 5, 'in_stock': 'true'})
+        self.assertEqual(first['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            second = self.client.get('/books/', {'in_stock': 'true', 'page_size': 5})
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(second.data, first.data)
+
+        stats = catalog_cache_stats()['books']
+        self.assertEqual((stats['hits'], stats['misses'], stats['hit_ratio']), (1, 1, 0.5))
+
+    def test_authenticated_requests_bypass_cache(self):
+        self.client.force_authenticate(user=self.user)
+        self.client.get('/books/')
+        response = self.client.get('/books/')
+        self.assertNotIn('X-Cache', response)
+
+    def test_format_change_invalidates_only_its_book(self):
+        self.client.get(f'/books/{self.book.pk}/')
+        self.client.get(f'/books/{self.other.pk}/')
+        self.client.get('/books/')
+
+        self.book_format.price = 80
+        self.book_format.save()
+
+        response = self.client.get(f'/books/{self.book.pk}/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['data']['formats'][0]['price'], '80')
+        self.assertEqual(self.client.get(f'/books/{self.other.pk}/')['X-Cache'], 'HIT')
+        self.assertEqual(self.client.get('/books/')['X-Cache'], 'MISS')
+
+    def test_bulk_format_update_invalidates_book(self):
+        self.client.get(f'/books/{self.book.pk}/')
+        BookFormat.objects.filter(book=self.book).update(isbn='9780000000001')
+        response = self.client.get(f'/books/{self.book.pk}/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['data']['formats'][0]['isbn'], '9780000000001')
+
+    def test_format_updates_outside_the_catalog_stay_one_query(self):
+        self.client.get(f'/books/{self.book.pk}/')
+        with self.assertNumQueries(1):
+            BookFormat.objects.filter(book=self.book).update(preorder_end_date=timezone.now())
+        self.assertEqual(self.client.get(f'/books/{self.book.pk}/')['X-Cache'], 'HIT')
+        # Known books skip the book_id lookup: UPDATE and summary refresh
+        with self.assertNumQueries(2):
+            BookFormat.objects.filter(book=self.book).of_books([self.book.pk]).update(stock=4)
+        self.assertEqual(Book.objects.get(pk=self.book.pk).total_stock, 4)
+        self.assertEqual(self.client.get(f'/books/{self.book.pk}/')['X-Cache'], 'MISS')
+
+    def test_genre_change_keeps_unrelated_namespaces(self):
+        self.client.get('/genres/')
+        self.client.get('/publishers/')
+        self.client.get(f'/books/{self.other.pk}/')
+
+        self.genre.name = 'Tragedy'
+        self.genre.save()
+
+        self.assertEqual(self.client.get('/genres/')['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(f'/books/{self.other.pk}/')['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get('/publishers/')['X-Cache'], 'HIT')
+
+
+class SparseFieldsetTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        genre = Genre.objects.create(name='Poetry')
+        self.author = Author.objects.create(first_name='Forugh', last_name='Farrokhzad')
+        self.author.genres.add(genre)
+        self.publisher = Publisher.objects.create(name='Morvarid')
+        for number in range(3):
+            book = Book.objects.create(title=f'Sparse Book {number}', publisher=self.publisher)
+            book.authors.add(self.author)
+            book.genres.add(genre)
+            BookFormat.objects.create(book=book, format_name='Paperback', price=100 + number)
+
+    def test_fields_limit_payload_and_queries(self):
+        # One query for the page and one for the only requested relation.
+        with self.assertNumQueries(2):
+            response = self.client.get('/books/', {'fields': 'id,title,formats.price'})
+        book = response.data['results'][0]
+        self.assertEqual(set(book), {'id', 'title', 'formats'})
+        self.assertEqual(set(book['formats'][0]), {'price'})
+
+    def test_unexpanded_relations_render_as_primary_keys(self):
+        with self.assertNumQueries(2):
+            response = self.client.get('/books/', {'fields': 'id,authors,publisher', 'expand': ''})
+        book = response.data['results'][0]
+        self.assertEqual(book['authors'], [self.author.pk])
+        self.assertEqual(book['publisher'], self.publisher.pk)
+
+        response = self.client.get('/books/', {'fields': 'id,authors', 'expand': 'authors'})
+        author = response.data['results'][0]['authors'][0]
+        self.assertEqual(author['first_name'], 'Forugh')
+        self.assertEqual(author['genres'], [self.author.genres.get().pk])
+
+    def test_default_representation_is_unchanged(self):
+        response = self.client.get(f'/books/{Book.objects.first().pk}/')
+        data = response.data['data']
+        self.assertEqual(data['publisher']['name'], 'Morvarid')
+        self.assertEqual(data['authors'][0]['genres'][0]['name'], 'Poetry')
+        self.assertIn('share_links', data)
+
+
+class BookFacetTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.novel = Genre.objects.create(name='Novel')
+        self.poetry = Genre.objects.create(name='Poetry')
+        self.persian = Language.objects.create(name='Persian')
+        self.press = Publisher.objects.create(name='Cheshmeh')
+        for title, price, genres in [('One', 90_000, [self.novel]), ('Two', 250_000, [self.novel, self.poetry]), ('Three', 600_000, [self.poetry])]:
+            book = Book.objects.create(title=title, language=self.persian, publisher=self.press if title != 'Three' else None)
+            book.genres.set(genres)
+            BookFormat.objects.create(book=book, format_name='Paperback', price=price)
+            if title == 'Two':
+                BookFormat.objects.create(book=book, format_name='Ebook', price=price, stock=3)
+
+    def test_counts_follow_filter_selection(self):
+        with self.assertNumQueries(5):
+            response = self.client.get('/books/facets/', {'genre': 'novel'})
+        data = response.data['data']
+        self.assertEqual(data['total'], 2)
+        self.assertEqual(
+            [(row['name'], row['count']) for row in data['genres']], [('Novel', 2), ('Poetry', 1)]
+        )
+        self.assertEqual(data['languages'], [{'id': self.persian.pk, 'name': 'Persian', 'count': 2}])
+        self.assertEqual(data['publishers'], [{'id': self.press.pk, 'name': 'Cheshmeh', 'count': 2}])
+        self.assertEqual([(row['name'], row['count']) for row in data['formats']], [('Paperback', 2), ('Ebook', 1)])
+        self.assertEqual([row['count'] for row in data['price']], [1, 0, 1, 0, 0])
+
+    def test_results_are_cached_per_filter_signature(self):
+        self.client.get('/books/facets/', {'genre': 'poetry', 'page_size': 5})
+        with self.assertNumQueries(0):
+            response = self.client.get('/books/facets/', {'genre': 'poetry', 'cursor': 'ignored'})
+        self.assertEqual(response.data['data']['total'], 2)
+
+        Book.objects.create(title='Four').genres.add(self.poetry)
+        self.assertEqual(self.client.get('/books/facets/', {'genre': 'poetry'}).data['data']['total'], 3)
+
+    def test_invalid_filter_is_rejected(self):
+        response = self.client.get('/books/facets/', {'price_min': 'cheap'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class AutocompleteTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        Book.objects.create(title='Shazdeh Ehtejab', sold_count=5)
+        Book.objects.create(title='Shahnameh', sold_count=50)
+        Book.objects.create(title='Boof-e Koor')
+        Author.objects.create(first_name='Sadegh', last_name='Hedayat', biography='')
+        Author.objects.create(first_name='Houshang', last_name='Golshiri', biography='')
+        Translator.objects.create(first_name='Shahrokh', last_name='Meskoob')
+        Publisher.objects.create(name='Sherkat-e Sahami')
+
+    def test_suggestions_per_kind(self):
+        with self.assertNumQueries(4):
+            response = self.client.get('/books/autocomplete/', {'q': 'sh'})
+        data = response.data['data']
+        self.assertEqual([row['title'] for row in data['titles']], ['Shahnameh', 'Shazdeh Ehtejab'])
+        self.assertEqual(data['authors'], [])
+        self.assertEqual([row['name'] for row in data['translators']], ['Shahrokh Meskoob'])
+        self.assertEqual([row['name'] for row in data['publishers']], ['Sherkat-e Sahami'])
+
+        response = self.client.get('/books/autocomplete/', {'q': 'sadegh  hed', 'limit': 1})
+        self.assertEqual([row['name'] for row in response.data['data']['authors']], ['Sadegh Hedayat'])
+
+    def test_hot_prefixes_are_cached(self):
+        self.client.get('/books/autocomplete/', {'q': 'Sh'})
+        with self.assertNumQueries(0):
+            response = self.client.get('/books/autocomplete/', {'q': 'sh '})
+        self.assertEqual(len(response.data['data']['titles']), 2)
+
+        Book.objects.create(title='Shab-e Hol')
+        response = self.client.get('/books/autocomplete/', {'q': 'sh'})
+        self.assertEqual(len(response.data['data']['titles']), 3)
+
+    def test_short_prefix_is_rejected(self):
+        response = self.client.get('/books/autocomplete/', {'q': 's'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@skipUnless(connections['default'].vendor == 'sqlite', 'NOCASE indexes are SQLite only')
+class SqliteAutocompleteIndexTests(APITransactionTestCase):
+    def index_names(self):
+        connection = connections['default']
+        with connection.cursor() as cursor:
+            return set(connection.introspection.get_constraints(cursor, Book._meta.db_table))
+
+    def test_indexes_dropped_by_a_table_rebuild_are_restored(self):
+        connection = connections['default']
+        with connection.cursor() as cursor:
+            cursor.execute('DROP INDEX book_title_nocase')
+        self.assertNotIn('book_title_nocase', self.index_names())
+        self.assertEqual(restore_sqlite_autocomplete_indexes('default'), ['book_title_nocase'])
+        self.assertIn('book_title_nocase', self.index_names())
+        self.assertEqual(restore_sqlite_autocomplete_indexes('default'), [])
+
+
+class ImportCatalogTests(APITestCase):
+    CSV = (
+        'title,summary,publication_date,language,publisher,authors,translators,genres,format_name,price,isbn,stock,discount\n'
+        'Boof-e Koor,A novella,1937-01-01,Persian,Amirkabir,Sadegh Hedayat,,Novel|Surrealism,Paperback,120000,978-964-00-0001-1,4,10\n'
+        'Boof-e Koor,,,,Amirkabir,Sadegh Hedayat,,Novel,Hardcover,250000,,0,\n'
+        'The Little Prince,,,French,Amirkabir,"Saint-Exupery, Antoine",Ahmad Shamlou,Novel,Paperback,90000,,2,\n'
+        'Broken Row,,,,,,,,Paperback,not-a-price,,,\n'
+    )
+
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w', encoding='utf-8') as handle:
+            handle.write(content)
+        return path
+
+    def run_import(self, path, *args):
+        out, err = StringIO(), StringIO()
+        call_command('import_catalog', path, *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_csv_import_creates_catalog(self):
+        out, err = self.run_import(self.write('feed.csv', self.CSV), '--batch-size', '2')
+        self.assertIn('Line 5: price is not a valid number', err)
+        self.assertIn('Imported 3 rows', out)
+
+        book = Book.objects.get(title='Boof-e Koor')
+        self.assertEqual(book.publisher.name, 'Amirkabir')
+        self.assertEqual(book.language.name, 'Persian')
+        self.assertEqual(str(book.publication_date), '1937-01-01')
+        self.assertEqual([str(author) for author in book.authors.all()], ['Sadegh Hedayat'])
+        self.assertEqual(sorted(book.genres.values_list('name', flat=True)), ['Novel', 'Surrealism'])
+        self.assertEqual(book.formats.count(), 2)
+        self.assertEqual(book.formats.get(format_name='Paperback').isbn, '9789640000011')
+        self.assertEqual((book.min_price, book.total_stock, book.max_discount), (120000, 4, 10))
+
+        prince = Book.objects.get(title='The Little Prince')
+        self.assertEqual(str(prince.authors.get()), 'Antoine Saint-Exupery')
+        self.assertEqual(str(prince.translators.get()), 'Ahmad Shamlou')
+        self.assertEqual(Genre.objects.filter(name='Novel').count(), 1)
+
+    def test_reimport_updates_instead_of_duplicating(self):
+        self.run_import(self.write('feed.csv', self.CSV))
+        rows = [
+            {'title': 'Boof-e Koor', 'publisher': 'Amirkabir', 'format_name': 'Ebook', 'price': 50000,
+             'isbn': '9789640000011', 'stock': 9, 'authors': ['Sadegh Hedayat']},
+        ]
+        out, _ = self.run_import(self.write('feed.jsonl', '\n'.join(json.dumps(row) for row in rows)))
+        self.assertIn('formats updated: 1', out)
+
+        self.assertEqual(Book.objects.filter(title='Boof-e Koor').count(), 1)
+        paperback = BookFormat.objects.get(isbn='9789640000011')
+        self.assertEqual((paperback.format_name, paperback.price, paperback.stock), ('Paperback', 50000, 9))
+        self.assertEqual(Author.objects.count(), 2)
+
+    def test_checkpoint_resumes_after_committed_rows(self):
+        path = self.write('feed.csv', self.CSV)
+        checkpoint = os.path.join(self.directory.name, 'feed.checkpoint')
+        with open(checkpoint, 'w', encoding='utf-8') as handle:
+            json.dump({'path': os.path.abspath(path), 'rows': 2}, handle)
+
+        out, _ = self.run_import(path, '--checkpoint', checkpoint)
+        self.assertIn('Resuming after row 2', out)
+        self.assertEqual(list(Book.objects.values_list('title', flat=True)), ['The Little Prince'])
+        self.assertFalse(os.path.exists(checkpoint))
+
+    @skipUnless(connections['default'].vendor == 'postgresql', 'COPY is PostgreSQL only')
+    def test_copy_import_fills_every_required_column(self):
+        # Without the broken last row
+        feed = ''.join(self.CSV.splitlines(keepends=True)[:4])
+        importer = CatalogImporter(use_copy=True)
+        importer.import_batch([parse_row(row) for _, row in read_rows(self.write('feed.csv', feed))])
+
+        self.assertEqual(importer.stats['formats_created'], 3)
+        self.assertFalse(BookFormat.objects.filter(updated_at__isnull=True).exists())
+        book = Book.objects.get(title='Boof-e Koor')
+        self.assertEqual((book.min_price, book.total_stock, book.max_discount), (120000, 4, 10))
+
+
+class ExportCatalogTests(APITestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='admin', password='password123', email='admin@example.com')
+        self.book = Book.objects.create(title='Savushun', publisher=Publisher.objects.create(name='Kharazmi'))
+        self.book.authors.add(Author.objects.create(first_name='Simin', last_name='Daneshvar', biography=''))
+        BookFormat.objects.create(book=self.book, format_name='Paperback', price=180000, stock=3)
+        BookFormat.objects.create(book=self.book, format_name='Ebook', price=60000)
+        Book.objects.create(title='No Formats Yet')
+
+    def stream(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_export_requires_admin(self):
+        response = self.client.get('/books/export/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_ndjson_export_streams_one_row_per_format(self):
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.get('/books/export/')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in self.stream(response).decode('utf-8').splitlines()]
+        self.assertEqual([(row['title'], row['format_name']) for row in rows], [
+            ('Savushun', 'Paperback'), ('Savushun', 'Ebook'), ('No Formats Yet', None),
+        ])
+        self.assertEqual(rows[0]['authors'], ['Simin Daneshvar'])
+        self.assertEqual(rows[0]['price'], '180000')
+
+    def test_gzipped_csv_export_applies_filters(self):
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.get('/books/export/', {'export_format': 'csv', 'gzip': 'true', 'publisher': 'kharazmi'})
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="catalog.csv.gz"')
+        lines = gzip.decompress(self.stream(response)).decode('utf-8').splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[0].startswith('book_id,title,'))
+
+    def test_command_output_can_be_imported_again(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'catalog.csv')
+        call_command('export_catalog', path, '--format', 'csv', stdout=StringIO())
+
+        out = StringIO()
+        call_command('import_catalog', path, stdout=out, stderr=StringIO())
+        self.assertIn('books created: 0', out.getvalue())
+        self.assertEqual(BookFormat.objects.count(), 2)
+
+
+class ConditionalGetTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = Author.objects.create(first_name='Sadegh', last_name='Hedayat', biography='')
+        self.book = Book.objects.create(title='The Blind Owl')
+        self.book.authors.add(self.author)
+        self.book_format = BookFormat.objects.create(book=self.book, format_name='Paperback', price=100, stock=1)
+        self.genre = Genre.objects.create(name='Fiction')
+        self.url = f'/books/{self.book.pk}/'
+        # Start from an old timestamp, so every change below is visibly newer.
+        self.old = timezone.now() - datetime.timedelta(days=1)
+        Book.objects.update(updated_at=self.old)
+        Genre.objects.update(updated_at=self.old)
+
+    def etag(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response['ETag']
+
+    def test_unchanged_book_is_answered_with_304_from_one_query(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        self.assertTrue(response['Last-Modified'].endswith('GMT'))
+        with self.assertNumQueries(1):
+            not_modified = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(not_modified['ETag'], response['ETag'])
+        self.assertEqual(not_modified.content, b'')
+
+        since = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(since.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_etag_depends_on_the_requested_fields(self):
+        self.assertNotEqual(self.etag(self.url), self.etag(self.url, fields='id,title'))
+
+    def test_format_relation_and_entity_changes_bubble_up_to_the_book(self):
+        changes = [
+            lambda: BookFormat.objects.filter(pk=self.book_format.pk).update(isbn='9789640000001'),
+            lambda: setattr(self.book_format, 'stock', 0) or self.book_format.save(),
+            lambda: self.book.genres.add(self.genre),
+            lambda: self.author.genres.add(self.genre),
+            lambda: Genre.objects.get(pk=self.genre.pk).save(),
+            lambda: self.genre.book_set.clear(),
+            lambda: setattr(self.author, 'last_name', 'H.') or self.author.save(),
+            lambda: self.author.delete(),
+        ]
+        etag = self.etag(self.url)
+        for change in changes:
+            Book.objects.update(updated_at=self.old)
+            change()
+            self.assertGreater(Book.objects.get(pk=self.book.pk).updated_at, self.old)
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            etag = response['ETag']
+
+    def test_reference_lists_revalidate_until_a_row_changes(self):
+        Genre.objects.create(name='Poetry')
+        etag = self.etag('/genres/')
+        with self.assertNumQueries(1):
+            response = self.client.get('/genres/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.genre.delete()
+        response = self.client.get('/genres/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 1)
+
+
+class ImageDerivativeTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media.name, BACKGROUND_TASKS_EAGER=True)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.media_root = media.name
+        self.book = Book.objects.create(title='Illustrated Book')
+
+    def upload(self, name, size=(1000, 1500), mode='RGBA'):
+        buffer = tempfile.SpooledTemporaryFile()
+        Image.new(mode, size, (200, 30, 30, 128) if mode == 'RGBA' else (200, 30, 30)).save(buffer, 'PNG')
+        buffer.seek(0)
+        return SimpleUploadedFile(name, buffer.read(), content_type='image/png')
+
+    def open_derivative(self, name, width, extension):
+        return Image.open(os.path.join(self.media_root, derivative_name(name, width, extension)))
+
+    def test_upload_generates_derivatives_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            book_format = BookFormat.objects.create(
+                book=self.book, format_name='Hardcover', price=100, cover_image=self.upload('cover.png'),
+            )
+        name = book_format.cover_image.name
+        for width in (160, 320, 640):
+            with self.open_derivative(name, width, 'webp') as webp, self.open_derivative(name, width, 'jpeg') as jpeg:
+                self.assertEqual(webp.size, (width, width * 3 // 2))
+                self.assertEqual((jpeg.format, jpeg.size), ('JPEG', webp.size))
+
+        response = self.client.get(f'/books/{self.book.pk}/')
+        srcset = response.data['data']['formats'][0]['cover_image_srcset']
+        self.assertEqual(srcset['webp'].count('w.webp '), 3)
+        self.assertIn('http://testserver/media/books/covers/derivatives/cover-160w.webp 160w', srcset['webp'])
+        self.assertTrue(srcset['jpeg'].endswith('-640w.jpeg 640w'))
+
+    def test_only_new_uploads_are_scheduled(self):
+        with patch('book_store.images.run_after_commit') as scheduled:
+            user = User.objects.create_user(username='reader', password='password')
+            user.first_name = 'Reader'
+            user.save()
+            book_format = BookFormat.objects.create(book=self.book, format_name='Paperback', price=100, cover_image=self.upload('cover.png'))
+            self.assertEqual(scheduled.call_count, 1)
+
+            book_format.stock = 5
+            book_format.save()
+            BookFormat.objects.get(pk=book_format.pk).save()
+            BookFormat.objects.only('price').get(pk=book_format.pk).save()
+            self.assertEqual(scheduled.call_count, 1)
+
+            book_format.cover_image = self.upload('new.png')
+            book_format.save()
+            self.assertEqual(scheduled.call_count, 2)
+
+    def test_missing_files_are_skipped(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            BookFormat.objects.create(book=self.book, format_name='Audio', price=50, cover_image='books/covers/missing.png')
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, 'books/covers/derivatives')))
+
+    def test_small_images_are_not_upscaled(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            publisher = Publisher.objects.create(name='Tiny Press', logo=self.upload('logo.png', size=(200, 100), mode='RGB'))
+        with self.open_derivative(publisher.logo.name, 160, 'jpeg') as small:
+            self.assertEqual(small.size, (160, 80))
+        for width in (320, 640):
+            self.assertFalse(os.path.exists(os.path.join(self.media_root, derivative_name(publisher.logo.name, width, 'webp'))))
+
+        srcset = ImageDerivativesField().to_representation(publisher.logo)
+        self.assertEqual(srcset['webp'], f'/media/{derivative_name(publisher.logo.name, 160, "webp")} 160w')
+
+        # The widths are recorded; an icon narrower than every width still gets the smallest
+        with self.captureOnCommitCallbacks(execute=True):
+            icon = Publisher.objects.create(name='Icon Press', logo=self.upload('icon.png', size=(40, 40), mode='RGB'))
+        with self.assertNumQueries(0), patch.object(icon.logo.storage, 'exists', side_effect=AssertionError):
+            srcset = ImageDerivativesField().to_representation(icon.logo)
+        self.assertEqual(srcset['jpeg'], f'/media/{derivative_name(icon.logo.name, 160, "jpeg")} 160w')
+        with self.open_derivative(icon.logo.name, 160, 'jpeg') as small:
+            self.assertEqual(small.size, (40, 40))
+
+    def test_srcset_is_empty_until_derivatives_exist(self):
+        book_format = BookFormat.objects.create(book=self.book, format_name='Paperback', price=100, cover_image=self.upload('late.png'))
+        self.assertIsNone(ImageDerivativesField().to_representation(book_format.cover_image))
+        call_command('generate_image_derivatives', '--model', 'books.BookFormat', stdout=StringIO())
+        self.assertEqual(ImageDerivativesField().to_representation(book_format.cover_image)['webp'].count('w.webp '), 3)
+
+    def test_command_backfills_missing_derivatives(self):
+        # Not committed, so no derivatives are generated on upload.
+        book_format = BookFormat.objects.create(book=self.book, format_name='Paperback', price=100, cover_image=self.upload('old.png'))
+        BookFormat.objects.create(book=self.book, format_name='Ebook', price=50, cover_image=book_format.cover_image.name)
+        BookFormat.objects.create(book=self.book, format_name='Audio', price=50, cover_image='books/covers/missing.png')
+
+        out, err = StringIO(), StringIO()
+        call_command('generate_image_derivatives', '--model', 'books.BookFormat', stdout=out, stderr=err)
+        self.assertIn('Generated derivatives for 1 images; 0 already had them, 1 failed.', out.getvalue())
+        self.assertIn('missing.png', err.getvalue())
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, derivative_name(book_format.cover_image.name, 160, 'jpeg'))))
+
+        out = StringIO()
+        call_command('generate_image_derivatives', '--model', 'books.BookFormat', stdout=out, stderr=StringIO())
+        self.assertIn('Generated derivatives for 0 images; 1 already had them, 1 failed.', out.getvalue())
+
+
+class FastBookSerializerTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        persian, english = Language.objects.create(name='Persian'), Language.objects.create(name='English')
+        novel, drama = Genre.objects.create(name='Novel'), Genre.objects.create(name='Drama')
+        publisher = Publisher.objects.create(name='Niloofar', logo='publishers/logos/niloofar.png', website='https://niloofar.example')
+        first = Author.objects.create(first_name='Simin', last_name='Daneshvar', biography='', profile_picture='authors/simin.jpg')
+        first.languages.add(persian)
+        first.genres.add(novel, drama)
+        second = Author.objects.create(first_name='Jalal', last_name='Al-e Ahmad', biography='')
+        translator = Translator.objects.create(first_name='Najaf', last_name='Daryabandari', rating='8.50')
+        translator.languages.add(persian, english)
+
+        self.book = Book.objects.create(
+            title='Savushun', summary='A novel', publisher=publisher, language=persian,
+            publication_date=datetime.date(1969, 1, 1), sold_count=7,
+        )
+        self.book.authors.add(first, second)
+        self.book.translators.add(translator)
+        self.book.genres.add(novel)
+        BookFormat.objects.create(
+            book=self.book, format_name='Paperback', price=180000, discount=10, stock=3,
+            weight='0.45', isbn='9789640000011', page_count=380, cover_image='books/covers/savushun.jpg',
+        )
+        BookFormat.objects.create(book=self.book, format_name='Ebook', price=90000)
+        Book.apply_rating_change(self.book.pk, added=4)
+        Book.apply_rating_change(self.book.pk, added=5)
+        bare = Book.objects.create(title='Bare Book')
+        bare.authors.add(first)
+
+    def render(self, data):
+        return JSONRenderer().render(data)
+
+    def test_output_is_identical_to_book_serializer(self):
+        request = Request(APIRequestFactory().get('/books/'))
+        books = Book.objects.annotate(rank=Value(0.123456, output_field=FloatField())).order_by('id')
+        expected = BookSerializer(books.prefetch_related('authors', 'formats'), many=True, context={'request': request}).data
+        fast = FastBookSerializer({'request': request}).to_representation(book_rows(books))
+        self.assertEqual(self.render(fast), self.render(expected))
+        self.assertEqual(fast[0]['rank'], 0.1235)
+
+    def test_list_endpoints_match_and_skip_model_instantiation(self):
+        for url in ('/books/', '/books/price-asc/', '/books/discount/', '/books/?page_size=1'):
+            cache.clear()
+            expected = self.client.get(url)
+            cache.clear()
+            with self.settings(CATALOG_FAST_SERIALIZATION=True), \
+                    patch.object(Book, 'from_db', side_effect=AssertionError), \
+                    patch.object(BookFormat, 'from_db', side_effect=AssertionError):
+                fast = self.client.get(url)
+            self.assertEqual(fast.status_code, status.HTTP_200_OK)
+            self.assertEqual(fast.content, expected.content, url)
+
+    def test_entities_are_cached_across_requests(self):
+        with self.settings(CATALOG_FAST_SERIALIZATION=True):
+            self.client.get('/books/', {'page_size': 5})
+            # The page, the author/translator/genre ids and the formats.
+            with self.assertNumQueries(5):
+                self.client.get('/books/', {'page_size': 10})
+            self.assertEqual(catalog_cache_stats()['entities']['hits'], 6)
+
+            Author.objects.filter(last_name='Daneshvar').get().save()
+            response = self.client.get('/books/', {'page_size': 20})
+        self.assertEqual(catalog_cache_stats()['entities']['misses'], 12)
+        self.assertEqual(response.data['results'][0]['title'], 'Bare Book')
+
+    def test_sparse_fieldsets_use_book_serializer(self):
+        with self.settings(CATALOG_FAST_SERIALIZATION=True):
+            response = self.client.get('/books/', {'fields': 'id,title'})
+        self.assertEqual(response.data['results'][0], {'id': Book.objects.get(title='Bare Book').pk, 'title': 'Bare Book'})
+
+
+def _view(module, name='view'):
+    # A stand-in view reporting the database its Book and User reads go to.
+    def view(request):
+        response = HttpResponse()
+        response.databases = (Book.objects.all().db, get_user_model().objects.all().db)
+        return response
+    view.__module__, view.__name__ = module, name
+    return view
+
+
+@override_settings(REPLICA_DATABASES=['replica_1'])
+class ReplicaRoutingTests(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.fresh_patch = patch('book_store.db_router.replica_is_fresh', return_value=True)
+        self.replica_is_fresh = self.fresh_patch.start()
+        self.addCleanup(patch.stopall)
+
+    def request(self, request, view):
+        middleware = db_router.ReplicaRoutingMiddleware(lambda request: middleware.process_view(request, view, (), {}) or view(request))
+        return middleware(request)
+
+    def test_catalog_reads_go_to_a_replica(self):
+        response = self.request(self.factory.get('/books/'), _view('books.views'))
+        self.assertEqual(response.databases, ('replica_1', 'default'))
+        self.assertNotIn(db_router.PIN_COOKIE, response.cookies)
+
+    def test_analytics_view_reads_everything_from_a_replica(self):
+        response = self.request(self.factory.get('/dashboard/'), _view('dashboard.views', 'dashboard_view'))
+        self.assertEqual(response.databases, ('replica_1', 'replica_1'))
+
+    def test_other_and_unsafe_requests_use_the_primary(self):
+        for request, view in (
+            (self.factory.get('/cart/'), _view('customers.views')),
+            (self.factory.post('/books/'), _view('books.views')),
+        ):
+            self.assertEqual(self.request(request, view).databases, ('default', 'default'))
+        # Outside of requests (commands, background tasks) too.
+        self.assertEqual(Book.objects.all().db, 'default')
+
+    def test_writes_pin_the_request_and_the_client_to_the_primary(self):
+        def view(request):
+            before = Book.objects.all().db
+            Book.objects.create(title='Suvashun')
+            response = HttpResponse()
+            response.databases = (before, Book.objects.all().db)
+            return response
+        view.__module__ = 'books.views'
+
+        response = self.request(self.factory.get('/books/'), view)
+        self.assertEqual(response.databases, ('replica_1', 'default'))
+        self.assertEqual(response.cookies[db_router.PIN_COOKIE]['max-age'], settings.REPLICA_PIN_SECONDS)
+
+        request = self.factory.get('/books/')
+        request.COOKIES[db_router.PIN_COOKIE] = '1'
+        self.assertEqual(self.request(request, _view('books.views')).databases, ('default', 'default'))
+
+    def test_lagging_replicas_are_skipped(self):
+        self.replica_is_fresh.return_value = False
+        response = self.request(self.factory.get('/books/'), _view('books.views'))
+        self.assertEqual(response.databases, ('default', 'default'))
+
+    def test_replica_reads_right_after_an_invalidation_are_not_cached(self):
+        cache.clear()
+        Book.objects.create(title='Suvashun')
+        # A replica that may not have the write yet; the reads themselves go to the primary here.
+        self.replica_is_fresh.return_value = False
+        with patch('book_store.cache.read_from_replica', return_value=True):
+            self.assertEqual(self.client.get('/books/')['X-Cache'], 'MISS')
+            self.assertEqual(self.client.get('/books/')['X-Cache'], 'MISS')
+            with self.settings(REPLICA_MAX_LAG=0):
+                self.client.get('/books/')
+            self.assertEqual(self.client.get('/books/')['X-Cache'], 'HIT')
+        # Primary reads are cached right away.
+        Book.objects.create(title='Tangsir')
+        self.assertEqual(self.client.get('/books/')['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get('/books/')['X-Cache'], 'HIT')
+
+    def test_lag_is_checked_once_per_interval(self):
+        self.fresh_patch.stop()
+        db_router._lag_checks.clear()
+        self.addCleanup(db_router._lag_checks.clear)
+        with patch('book_store.db_router.replica_lag', side_effect=[1.0, 60.0]) as replica_lag:
+            self.assertTrue(db_router.replica_is_fresh('replica_1'))
+            self.assertTrue(db_router.replica_is_fresh('replica_1'))
+            with self.settings(REPLICA_LAG_CHECK_INTERVAL=0):
+                self.assertFalse(db_router.replica_is_fresh('replica_1'))
+        self.assertEqual(replica_lag.call_count, 2)
+
+
+@skipUnless(settings.REPLICA_DATABASES, 'set DJANGO_DB_REPLICAS to run against real replicas')
+class ReplicaDatabaseTests(APITransactionTestCase):
+    # Committed, so the replica connection sees the rows.
+    databases = '__all__'
+
+    def test_catalog_is_served_from_a_replica(self):
+        Book.objects.create(title='The Blind Owl')
+        replica = CaptureQueriesContext(connections[settings.REPLICA_DATABASES[0]])
+        with self.assertNumQueries(0, using='default'), replica:
+            response = self.client.get('/books/', {'q': 'Blind'})
+        self.assertEqual(response.data['results'][0]['title'], 'The Blind Owl')
+        self.assertTrue(replica.captured_queries)
@@ -2,37 +2,91 @@ from rest_framework import status, viewsets, mixins
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAdminUser, AllowAny, IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.throttling import UserRateThrottle
 from django_filters.rest_framework import DjangoFilterBackend
-from django.contrib.postgres.search import SearchVector, SearchQuery, SearchRank
-from django.db.models import F
-from django.db.models.functions import Coalesce
-from django.db.models import Value, CharField
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import F, FloatField
+from django.db.models.functions import Cast
+from django.conf import settings
+from django.http import StreamingHttpResponse
+
+from book_store.cache import cache_catalog_response, cached_catalog_data
+from book_store.conditional import conditional_catalog_get
+from book_store.serializers import optimize_queryset
 
 from .models import Book, StockNotification
 from .serializers import BookSerializer, StockNotificationSerializer
+from .fast_serializers import FastBookSerializer, book_rows
 from .filters import BookFilter
+from .facets import catalog_facets
+from .exporter import FORMATS, catalog_queryset, export_chunks, export_rows
+from .autocomplete import DEFAULT_LIMIT, MAX_LIMIT, MIN_PREFIX_LENGTH, normalize_prefix, suggestions
+
+
+class AutocompleteRateThrottle(UserRateThrottle):
+    """
+    Typeahead fires on every keystroke, so it gets its own, larger budget.
+    """
+    scope = 'autocomplete'
+
+
+def book_state(view, request, pk=None, **kwargs):
+    """
+    The detail page's `updated_at`, from a primary key lookup.
+    """
+    try:
+        updated_at = Book.objects.filter(pk=pk).values_list('updated_at', flat=True).first()
+    except (TypeError, ValueError):
+        return None
+    return None if updated_at is None else (updated_at, None)
+
 
 class BookViewSet(viewsets.ModelViewSet):
     """
     A unified ViewSet for all actions related to Books.
     """
-    queryset = Book.objects.all().prefetch_related('authors', 'translators', 'genres')
+    queryset = Book.objects.defer('search_vector')
     serializer_class = BookSerializer
     filter_backends = [DjangoFilterBackend]
     filterset_class = BookFilter
 
+    # List actions FastBookSerializer can render (see settings.CATALOG_FAST_SERIALIZATION).
+    FAST_SERIALIZATION_ACTIONS = ('list', 'search', 'discount_list', 'price_asc', 'price_desc')
+
     def get_permissions(self):
         """
         Instantiates and returns the list of permissions that this view requires.
         - Admin users are required for write actions (create, update, destroy).
         - Any user (including anonymous) can perform read actions.
         """
-        if self.action in ['create', 'update', 'partial_update', 'destroy']:
+        if self.action in ['create', 'update', 'partial_update', 'destroy', 'export']:
             self.permission_classes = [IsAdminUser]
         else:
             self.permission_classes = [AllowAny]
         return super().get_permissions()
 
+    def get_queryset(self):
+        """
+        Loads only the relations the (possibly sparse, see `?fields=`/`?expand=`)
+        serializer will render.
+        """
+        if self.uses_fast_serializer():
+            # book_rows() loads the related ids itself.
+            return super().get_queryset()
+        return optimize_queryset(super().get_queryset(), self.get_serializer())
+
+    def uses_fast_serializer(self):
+        """
+        Whether the request renders through FastBookSerializer: an opt-in for
+        the list actions, and never with `?fields=`/`?expand=`, which only
+        BookSerializer supports.
+        """
+        return (
+            getattr(settings, 'CATALOG_FAST_SERIALIZATION', False)
+            and self.action in self.FAST_SERIALIZATION_ACTIONS
+            and not {'fields', 'expand'}.intersection(self.request.query_params)
+        )
+
     # --- Overriding default actions to keep custom responses ---
 
     def create(self, request, *args, **kwargs):
@@ -59,6 +113,12 @@ class BookViewSet(viewsets.ModelViewSet):
         self.perform_destroy(instance)
         return Response({"message": "کتاب با موفقیت حذف شد."}, status=status.HTTP_204_NO_CONTENT)
 
+    @cache_catalog_response('books')
+    def list(self, request, *args, **kwargs):
+        return self._paginated(self.filter_queryset(self.get_queryset()))
+
+    @conditional_catalog_get(book_state)
+    @cache_catalog_response('book', object_kwarg='pk')
     def retrieve(self, request, *args, **kwargs):
         instance = self.get_object()
         serializer = self.get_serializer(instance)
@@ -67,75 +127,147 @@ class BookViewSet(viewsets.ModelViewSet):
     # --- Custom actions for specific queries ---
 
     @action(detail=False, methods=['get'], url_path='search')
+    @cache_catalog_response('books')
     def search(self, request):
         """
         Performs a professional, weighted full-text search for books.
-        It searches across title, summary, authors, and genres, and ranks
-        the results by relevance.
+        It matches against the stored search document (title, summary, authors
+        and genres; see books.search) through its GIN index and ranks the
+        results by relevance.
         Expects a 'query' query parameter.
         """
         query = request.query_params.get('query', None)
         if not query:
             return Response({"error": "پارامتر جستجو ضروری است."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Create a search vector with weighted fields
-        vector = (
-            SearchVector('title', weight='A') +
-            SearchVector('summary', weight='B') +
-            SearchVector(Coalesce('authors__first_name', Value('')), weight='C') +
-            SearchVector(Coalesce('authors__last_name', Value('')), weight='C') +
-            SearchVector(Coalesce('genres__name', Value('')), weight='D')
-        )
-
-        # Create a search query
-        search_query = SearchQuery(query, search_type='websearch')
-
-        # Perform the search, annotate with rank, and order by it
-        books = self.get_queryset().annotate(
-            rank=SearchRank(vector, search_query)
-        ).filter(rank__gte=0.1).order_by('-rank')
+        # Match against the indexed document, annotate with rank, and order by it
+        books = self._search(self.get_queryset(), query).order_by('-rank')
 
         if not books.exists():
             return Response({"error": "هیچ کتابی مطابق با جستجوی شما پیدا نشد."}, status=status.HTTP_404_NOT_FOUND)
 
-        page = self.paginate_queryset(books)
-        if page is not None:
-            # Pass the context to the serializer
-            serializer = self.get_serializer(page, many=True, context={'request': request})
-            return self.get_paginated_response(serializer.data)
-
-        serializer = self.get_serializer(books, many=True, context={'request': request})
-        return Response(serializer.data)
+        return self._paginated(books)
 
     @action(detail=False, methods=['get'], url_path='discount')
+    @cache_catalog_response('books')
     def discount_list(self, request):
         """
         Lists books that have a discount.
         """
-        books = self.get_queryset().filter(discount__isnull=False, discount__gt=0)
+        books = self.get_queryset().filter(max_discount__gt=0).order_by('-max_discount')
         if not books.exists():
             return Response({"error": "هیچ کتابی با تخفیف پیدا نشد."}, status=status.HTTP_404_NOT_FOUND)
 
-        serializer = self.get_serializer(books, many=True)
-        return Response(serializer.data)
+        return self._paginated(books)
 
     @action(detail=False, methods=['get'], url_path='price-asc')
+    @cache_catalog_response('books')
     def price_asc(self, request):
         """
-        Lists books ordered by price ascending.
+        Lists books ordered by their lowest price after discount, ascending.
         """
-        books = self.get_queryset().order_by('price')
-        serializer = self.get_serializer(books, many=True)
-        return Response(serializer.data)
+        books = self.get_queryset().order_by('min_effective_price')
+        return self._paginated(books)
 
     @action(detail=False, methods=['get'], url_path='price-desc')
+    @cache_catalog_response('books')
     def price_desc(self, request):
         """
-        Lists books ordered by price descending.
+        Lists books ordered by their lowest price after discount, descending.
+        """
+        books = self.get_queryset().order_by('-min_effective_price')
+        return self._paginated(books)
+
+    @action(detail=False, methods=['get'], url_path='facets')
+    def facets(self, request):
+        """
+        Counts the books matching the current BookFilter selection (and the
+        optional full-text 'query') per genre, language, publisher, format and
+        price bucket, in a handful of grouped queries. Results are cached per
+        normalized filter signature until the catalog changes.
+        """
+        filterset = BookFilter(request.query_params, queryset=Book.objects.all(), request=request)
+        if not filterset.is_valid():
+            return Response({"error": filterset.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        query = request.query_params.get('query', '').strip()
+        # Only the filter values count, so paging or field selection share one entry.
+        signature = {
+            name: str(value) for name, value in filterset.form.cleaned_data.items() if value not in (None, '')
+        }
+        if query:
+            signature['query'] = query
+
+        def compute():
+            books = filterset.qs
+            if query:
+                books = self._search(books, query)
+            return catalog_facets(books)
+
+        data = cached_catalog_data('facets', signature, compute, version_namespace='books')
+        return Response({"message": "شمارش دسته‌بندی‌ها با موفقیت انجام شد.", "data": data})
+
+    @action(detail=False, methods=['get'], url_path='autocomplete', throttle_classes=[AutocompleteRateThrottle])
+    def autocomplete(self, request):
+        """
+        Typeahead suggestions (titles, authors, translators, publishers) for the
+        prefix in the 'q' query parameter; 'limit' caps each list.
+        """
+        prefix = normalize_prefix(request.query_params.get('q', ''))
+        if len(prefix) < MIN_PREFIX_LENGTH:
+            return Response(
+                {"error": f"حداقل {MIN_PREFIX_LENGTH} حرف برای جستجو لازم است."}, status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            limit = min(max(int(request.query_params.get('limit', DEFAULT_LIMIT)), 1), MAX_LIMIT)
+        except ValueError:
+            limit = DEFAULT_LIMIT
+
+        return Response({"message": "پیشنهادها با موفقیت بازیابی شدند.", "data": suggestions(prefix, limit)})
+
+    @action(detail=False, methods=['get'], url_path='export')
+    def export(self, request):
+        """
+        Streams the (filtered) catalog as NDJSON or CSV, one row per format.
+        Query parameters: 'export_format' (ndjson|csv) and 'gzip' (true/false).
+        """
+        file_format = request.query_params.get('export_format', 'ndjson')
+        if file_format not in FORMATS:
+            return Response({"error": "فرمت خروجی باید ndjson یا csv باشد."}, status=status.HTTP_400_BAD_REQUEST)
+        compress = request.query_params.get('gzip', '').lower() in ('1', 'true')
+
+        books = catalog_queryset(self.filter_queryset(Book.objects.all()).distinct())
+        content_type, extension = FORMATS[file_format]
+        filename = f'catalog.{extension}'
+        if compress:
+            content_type, filename = 'application/gzip', f'{filename}.gz'
+        response = StreamingHttpResponse(
+            export_chunks(export_rows(books), file_format, compress=compress), content_type=content_type
+        )
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+    def _search(self, books, query):
+        """
+        Restricts `books` to the relevant matches of a websearch `query`, annotated with their rank.
+        """
+        search_query = SearchQuery(query, search_type='websearch')
+        # ts_rank() returns a float4, whose text form does not compare equal to the
+        # value itself; as a float8 the rank round-trips exactly through the cursor.
+        return books.filter(search_vector=search_query).annotate(
+            rank=Cast(SearchRank(F('search_vector'), search_query), FloatField())
+        ).filter(rank__gte=0.1)
+
+    def _paginated(self, books):
+        """
+        Serializes one keyset page of `books`, keeping the queryset's ordering as the sort key.
         """
-        books = self.get_queryset().order_by('-price')
-        serializer = self.get_serializer(books, many=True)
-        return Response(serializer.data)
+        if self.uses_fast_serializer():
+            page = self.paginate_queryset(book_rows(books))
+            return self.get_paginated_response(FastBookSerializer(self.get_serializer_context()).to_representation(page))
+        page = self.paginate_queryset(books)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
 
 
 class StockNotificationViewSet(mixins.CreateModelMixin,
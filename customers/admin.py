@@ -1,4 +1,5 @@
 from django.contrib import admin
+from django.db.models import Prefetch
 from .models import Invoice, InvoiceItem, Address, Customer, CustomerInterest, Cart, CartItem
 
 class InvoiceItemInline(admin.TabularInline):
@@ -34,6 +35,16 @@ class CartAdmin(admin.ModelAdmin):
     inlines = [CartItemInline]
     readonly_fields = ('total_price',)
 
+    def get_queryset(self, request):
+        # The items of the whole page in one query, for the pricing snapshots
+        return super().get_queryset(request).select_related('customer__user', 'discount').prefetch_related(
+            Prefetch('items', queryset=CartItem.objects.select_related('book_format').order_by('pk'))
+        )
+
+    @admin.display(description='Total price')
+    def total_price(self, obj):
+        return obj.get_pricing(obj.customer.user, items=obj.items.all()).total
+
 class CartItemAdmin(admin.ModelAdmin):
     list_display = ('cart', 'book_format', 'quantity')
     search_fields = ('cart__customer__user__username', 'book_format__book__title')
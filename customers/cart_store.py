@@ -0,0 +1,254 @@
+import re
+import secrets
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from books.models import BookFormat
+from discounts.engine import best_discount, price_cart
+from discounts.models import Discount
+from .models import Cart, CartItem, Customer
+
+# Clients send back the token of their anonymous cart in this header or cookie.
+CART_TOKEN_HEADER = 'HTTP_X_CART_TOKEN'
+CART_TOKEN_COOKIE = 'cart_token'
+CART_TOKEN_PATTERN = re.compile(r'^[A-Za-z0-9_-]{20,64}$')
+
+KEY_PREFIX = 'cart'
+
+
+def cart_timeout():
+    return getattr(settings, 'CART_CACHE_TIMEOUT', 60 * 60 * 24 * 7)
+
+
+def request_cart_token(request):
+    token = request.META.get(CART_TOKEN_HEADER) or request.COOKIES.get(CART_TOKEN_COOKIE)
+    return token if token and CART_TOKEN_PATTERN.match(token) else None
+
+
+class DatabaseCartStore:
+    """
+    The customer's Cart and CartItem rows.
+    """
+    persistent = True
+    token = None
+    issued = saved = False
+
+    def __init__(self, customer):
+        self.customer = customer
+        self._cart = None
+
+    @property
+    def cart(self):
+        if self._cart is None:
+            self._cart, _ = Cart.objects.select_related('discount').get_or_create(customer=self.customer)
+        return self._cart
+
+    def items(self):
+        return list(self.cart.items.select_related('book_format').order_by('pk'))
+
+    def quantity(self, book_format_id):
+        return self.cart.items.filter(book_format_id=book_format_id).values_list('quantity', flat=True).first() or 0
+
+    def set_quantity(self, book_format, quantity):
+        items = self.cart.items.filter(book_format=book_format)
+        if quantity <= 0:
+            items.delete()
+        elif not items.update(quantity=quantity):
+            CartItem.objects.create(cart=self.cart, book_format=book_format, quantity=quantity)
+
+    @property
+    def discount(self):
+        return self.cart.discount
+
+    def set_discount(self, discount):
+        self.cart.discount = discount
+        self.cart.save(update_fields=['discount', 'updated_at'])
+
+    def clear(self):
+        self.cart.clear()
+
+    def pricing(self, user=None, discount=None, items=None):
+        return price_cart(self.cart, user, discount=discount, items=items)
+
+    def best_discount(self, user=None):
+        return best_discount(self.cart, user)
+
+
+class CacheCartStore:
+    """
+    A cart kept only in the cache, as `{'i': [[book_format_id, quantity], ...],
+    'd': discount_id}`: anonymous carts under their token, and with
+    settings.CART_CACHE_AUTHENTICATED the carts of signed-in users too (which
+    start from their Cart rows). Nothing reaches the database until
+    persist(), at login or checkout.
+    """
+    persistent = False
+    # Whether the token is new to the client and whether the cart was stored.
+    issued = saved = False
+
+    def __init__(self, identity, token=None, initial=None):
+        self.key = f'{KEY_PREFIX}:{identity}'
+        self.token = token
+        data = cache.get(self.key)
+        if data is None:
+            data = initial() if initial is not None else {}
+        self.quantities = dict(data.get('i', ()))
+        self.discount_id = data.get('d')
+        self._discount = None
+
+    @classmethod
+    def for_token(cls, token=None):
+        # Without a (valid) token a new one is issued; see CartStoreMixin.
+        return cls(f'anonymous:{token}', token=token) if token else cls.new()
+
+    @classmethod
+    def new(cls):
+        store = cls.for_token(secrets.token_urlsafe(24))
+        store.issued = True
+        return store
+
+    @classmethod
+    def for_user(cls, user):
+        def initial():
+            cart = Cart.objects.filter(customer__user=user).values('pk', 'discount_id').first()
+            if cart is None:
+                return {}
+            items = CartItem.objects.filter(cart_id=cart['pk']).order_by('pk').values_list('book_format_id', 'quantity')
+            return {'i': [list(item) for item in items], 'd': cart['discount_id']}
+        return cls(f'user:{user.pk}', initial=initial)
+
+    def save(self):
+        data = {'i': [[pk, quantity] for pk, quantity in self.quantities.items()]}
+        if self.discount_id:
+            data['d'] = self.discount_id
+        cache.set(self.key, data, cart_timeout())
+        self.saved = True
+
+    def delete(self):
+        cache.delete(self.key)
+
+    def items(self):
+        """
+        Unsaved CartItems of the cart's formats, from one query; formats deleted
+        since they were added are dropped.
+        """
+        formats = BookFormat.objects.in_bulk(list(self.quantities))
+        return [
+            CartItem(book_format=formats[pk], quantity=quantity)
+            for pk, quantity in self.quantities.items() if pk in formats
+        ]
+
+    def quantity(self, book_format_id):
+        return self.quantities.get(int(book_format_id), 0)
+
+    def set_quantity(self, book_format, quantity):
+        if quantity <= 0:
+            self.quantities.pop(book_format.pk, None)
+        else:
+            self.quantities[book_format.pk] = quantity
+        self.save()
+
+    @property
+    def discount(self):
+        if self.discount_id and self._discount is None:
+            self._discount = Discount.objects.filter(pk=self.discount_id).first()
+        return self._discount
+
+    def set_discount(self, discount):
+        self.discount_id = discount.pk if discount else None
+        self._discount = discount
+        self.save()
+
+    def clear(self):
+        self.quantities, self.discount_id, self._discount = {}, None, None
+        self.delete()
+
+    def pricing(self, user=None, discount=None, items=None):
+        cart = Cart(discount=self.discount)
+        return price_cart(cart, user, discount=discount, items=self.items() if items is None else items)
+
+    def best_discount(self, user=None):
+        return best_discount(Cart(), user, items=self.items())
+
+    def persist(self, customer, replace=False):
+        """
+        Writes the cart to the customer's Cart rows in one transaction: in
+        place of their items with `replace`, otherwise merged into them
+        (quantities of the same format add up, an existing discount is kept).
+        """
+        return persist_cart(customer, self.quantities, self.discount_id, replace=replace)
+
+
+def persist_cart(customer, quantities, discount_id=None, replace=False):
+    with transaction.atomic():
+        cart, _ = Cart.objects.get_or_create(customer=customer)
+        # Serializes concurrent merges and checkouts of the same cart.
+        cart = Cart.objects.select_for_update().get(pk=cart.pk)
+        existing = {item.book_format_id: item for item in cart.items.all()}
+        live = set(BookFormat.objects.filter(pk__in=quantities).values_list('pk', flat=True))
+
+        updated, created = [], []
+        for pk, quantity in quantities.items():
+            if pk not in live:
+                continue
+            if pk in existing:
+                item = existing[pk]
+                item.quantity = quantity if replace else item.quantity + quantity
+                updated.append(item)
+            else:
+                created.append(CartItem(cart=cart, book_format_id=pk, quantity=quantity))
+        if replace:
+            cart.items.exclude(book_format_id__in=live & quantities.keys()).delete()
+        CartItem.objects.bulk_update(updated, ['quantity'])
+        CartItem.objects.bulk_create(created)
+
+        discount_id = discount_id if replace else cart.discount_id or discount_id
+        if discount_id != cart.discount_id:
+            cart.discount_id = discount_id
+            cart.save(update_fields=['discount', 'updated_at'])
+    return cart
+
+
+def get_cart_store(request):
+    """
+    Where the cart of `request` lives: the database for signed-in users (the
+    cache with settings.CART_CACHE_AUTHENTICATED), the cache for visitors.
+    """
+    user = request.user
+    if user.is_authenticated:
+        if getattr(settings, 'CART_CACHE_AUTHENTICATED', False):
+            return CacheCartStore.for_user(user)
+        customer, _ = Customer.objects.get_or_create(user=user)
+        return DatabaseCartStore(customer)
+    return CacheCartStore.for_token(request_cart_token(request))
+
+
+def merge_cart_on_login(request, user):
+    """
+    Moves the visitor's anonymous cart into the cart of `user`, who just signed
+    in, in one transaction. A short cache lock keeps two concurrent logins
+    with the same token from merging it twice.
+    """
+    token = request_cart_token(request) if request is not None else None
+    if not token:
+        return None
+    anonymous = CacheCartStore.for_token(token)
+    if not anonymous.quantities:
+        return None
+    lock = f'{anonymous.key}:merging'
+    if not cache.add(lock, 1, timeout=30):
+        return None
+    try:
+        customer, _ = Customer.objects.get_or_create(user=user)
+        if getattr(settings, 'CART_CACHE_AUTHENTICATED', False):
+            # The user's own cached cart is written out first, then reloaded from the merged rows.
+            own = CacheCartStore.for_user(user)
+            own.persist(customer, replace=True)
+            own.delete()
+        cart = anonymous.persist(customer)
+        anonymous.delete()
+    finally:
+        cache.delete(lock)
+    return cart
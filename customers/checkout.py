@@ -0,0 +1,221 @@
+from collections import Counter
+from datetime import timedelta
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, Q, Sum, Value, When
+from django.utils import timezone
+
+from book_store.cache import invalidate_catalog
+from books.models import Book, BookFormat
+from .models import Cart, Invoice, InvoiceItem, StockReservation
+
+# Reservations deleted per statement by release_expired_reservations().
+RELEASE_BATCH_SIZE = 1000
+
+
+class EmptyCart(Exception):
+    pass
+
+
+class InsufficientStock(Exception):
+    """
+    Raised when a checkout asks for more copies of in-stock formats than are
+    left; nothing was written. `book_formats` are the short formats.
+    """
+    def __init__(self, book_formats):
+        self.book_formats = book_formats
+        super().__init__(', '.join(str(book_format) for book_format in book_formats))
+
+
+class DiscountUnavailable(Exception):
+    """
+    Raised when the cart's discount reached its usage limit during checkout;
+    nothing was written.
+    """
+    def __init__(self, discount):
+        self.discount = discount
+        super().__init__(discount.code)
+
+
+def reservation_seconds():
+    return getattr(settings, 'STOCK_RESERVATION_SECONDS', 600)
+
+
+def reserved_quantities(book_format_ids, exclude_cart=None):
+    """
+    `{book_format_id: copies}` held by unexpired reservations, other than
+    those of `exclude_cart`, from one aggregate over reservation_active_idx.
+    """
+    reservations = StockReservation.objects.filter(book_format_id__in=book_format_ids, expires_at__gt=timezone.now())
+    if exclude_cart is not None:
+        reservations = reservations.exclude(cart=exclude_cart)
+    return dict(
+        reservations.order_by().values('book_format_id').annotate(total=Sum('quantity'))
+        .values_list('book_format_id', 'total')
+    )
+
+
+def available_stock(book_format, exclude_cart=None):
+    """
+    Copies of `book_format` that are neither sold nor reserved for another cart.
+    """
+    return book_format.stock - reserved_quantities([book_format.pk], exclude_cart).get(book_format.pk, 0)
+
+
+def _stock_quantities(items):
+    quantities = Counter()
+    for book_format_id, quantity, status in items:
+        if status != BookFormat.Status.PRE_ORDER:
+            quantities[book_format_id] += quantity
+    return quantities
+
+
+def _lock_formats(quantities, cart):
+    """
+    Locks the formats of `{book_format_id: quantity}` in primary key order and
+    raises InsufficientStock unless each has that many copies available to
+    `cart`. Returns the locked formats by id.
+    """
+    locked = {
+        book_format.pk: book_format
+        for book_format in BookFormat.objects.select_for_update().select_related('book')
+        .filter(pk__in=quantities).order_by('pk')
+    }
+    reserved = reserved_quantities(list(quantities), exclude_cart=cart)
+    short = [
+        locked[pk] for pk, quantity in quantities.items()
+        if pk not in locked or locked[pk].stock - reserved.get(pk, 0) < quantity
+    ]
+    if short:
+        raise InsufficientStock(short)
+    return locked
+
+
+def reserve_cart(customer):
+    """
+    Holds the in-stock copies in the customer's cart for
+    settings.STOCK_RESERVATION_SECONDS, replacing the cart's earlier
+    reservations, or raises InsufficientStock without holding anything.
+    The format rows stay locked only for the check and one bulk insert, so
+    concurrent checkouts of the same format queue briefly rather than all
+    reaching payment for the last copies. Returns the expiry time.
+    """
+    with transaction.atomic():
+        cart = Cart.objects.select_for_update().get(customer=customer)
+        items = list(cart.items.values_list('book_format_id', 'quantity', 'book_format__status'))
+        if not items:
+            raise EmptyCart()
+
+        quantities = _stock_quantities(items)
+        if quantities:
+            _lock_formats(quantities, cart)
+        expires_at = timezone.now() + timedelta(seconds=reservation_seconds())
+        cart.reservations.all().delete()
+        StockReservation.objects.bulk_create(
+            StockReservation(cart=cart, book_format_id=pk, quantity=quantity, expires_at=expires_at)
+            for pk, quantity in quantities.items()
+        )
+    return expires_at
+
+
+def release_expired_reservations(batch_size=RELEASE_BATCH_SIZE):
+    """
+    Deletes expired reservations in batches of `batch_size` and returns how
+    many there were. They no longer count against the stock anyway; this
+    only keeps the table small.
+    """
+    released = 0
+    while True:
+        expired = list(
+            StockReservation.objects.filter(expires_at__lte=timezone.now())
+            .order_by('pk').values_list('pk', flat=True)[:batch_size]
+        )
+        if not expired:
+            return released
+        released += StockReservation.objects.filter(pk__in=expired).delete()[0]
+
+
+def finalize_checkout(customer):
+    """
+    Turns the customer's cart into a paid invoice in one transaction: the
+    stock of in-stock formats drops by a conditional UPDATE that cannot go
+    below zero or into copies reserved for other carts, invoice items are
+    bulk created, the discount's usage is recorded within its limits (or
+    DiscountUnavailable raised), `sold_count` goes up and the cart and its
+    reservations are cleared. Rows are locked in primary key order (cart, then formats), so
+    concurrent checkouts queue instead of deadlocking or overselling.
+    """
+    with transaction.atomic():
+        # Serializes concurrent checkouts of the same cart.
+        cart = Cart.objects.select_for_update().select_related('customer__user', 'discount').get(customer=customer)
+        items = list(cart.items.select_related('book_format__book').order_by('book_format_id'))
+        if not items:
+            raise EmptyCart()
+
+        quantities = _stock_quantities(
+            (item.book_format_id, item.quantity, item.book_format.status) for item in items
+        )
+        if quantities:
+            _take_stock(quantities, cart)
+
+        pricing = cart.get_pricing(cart.customer.user, items=items)
+        # Record discount usage if a discount was applied to the cart
+        if pricing.discount_amount and not cart.discount.record_usage(cart.customer.user):
+            # Its last use went to a concurrent checkout
+            raise DiscountUnavailable(cart.discount)
+
+        invoice = Invoice.objects.create(
+            customer=cart.customer.user,
+            total_price=pricing.total,
+            shipping_cost=0,  # Or calculate it
+            paid=True,
+        )
+        InvoiceItem.objects.bulk_create(
+            InvoiceItem(
+                invoice=invoice,
+                book_format=item.book_format,
+                quantity=item.quantity,
+                price=item.book_format.price,
+                is_preorder=(item.book_format.status == BookFormat.Status.PRE_ORDER),
+            )
+            for item in items
+        )
+
+        sold = Counter()
+        for item in items:
+            sold[item.book_format.book_id] += item.quantity
+        Book.objects.filter(pk__in=sold).update(
+            sold_count=Case(
+                *(When(pk=book_id, then=F('sold_count') + Value(quantity)) for book_id, quantity in sold.items()),
+                default=F('sold_count'),
+            ),
+            updated_at=timezone.now(),
+        )
+        invalidate_catalog('books', book_ids=sold)
+        cart.clear()
+    return invoice
+
+
+def _take_stock(quantities, cart):
+    """
+    Decrements the stock of `{book_format_id: quantity}` in one UPDATE whose
+    WHERE clause only matches formats with enough stock left; on a shortfall
+    (counting the reservations of other carts) it raises InsufficientStock,
+    rolling the whole checkout back.
+    """
+    locked = _lock_formats(quantities, cart)
+
+    # The row locks already rule out a race; the condition keeps the UPDATE safe on its own.
+    enough = reduce(or_, (Q(pk=pk, stock__gte=quantity) for pk, quantity in quantities.items()))
+    book_ids = {book_format.book_id for book_format in locked.values()}
+    updated = BookFormat.objects.filter(enough).of_books(book_ids).update(
+        stock=Case(
+            *(When(pk=pk, then=F('stock') - Value(quantity)) for pk, quantity in quantities.items()),
+            default=F('stock'),
+        ),
+    )
+    if updated != len(quantities):
+        raise InsufficientStock([locked[pk] for pk in quantities])
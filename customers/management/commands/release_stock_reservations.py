@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from customers.checkout import RELEASE_BATCH_SIZE, release_expired_reservations
+
+
+class Command(BaseCommand):
+    help = 'Deletes expired stock reservations of carts that left checkout without paying.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=RELEASE_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        released = release_expired_reservations(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Released {released} expired stock reservations.'))
@@ -0,0 +1,35 @@
+from django.db import migrations, models
+
+PLAIN_INDEX = models.Index(fields=["book_format", "expires_at"], name="reservation_active_idx")
+
+# Index-only scans of the per-format reservation sums; INCLUDE is PostgreSQL only.
+COVERING_INDEX = models.Index(
+    fields=["book_format", "expires_at"], include=["quantity"], name="reservation_active_idx"
+)
+
+
+def build_covering_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        model = apps.get_model("customers", "StockReservation")
+        schema_editor.remove_index(model, PLAIN_INDEX)
+        schema_editor.add_index(model, COVERING_INDEX)
+
+
+def drop_covering_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        model = apps.get_model("customers", "StockReservation")
+        schema_editor.remove_index(model, COVERING_INDEX)
+        schema_editor.add_index(model, PLAIN_INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("customers", "0010_stockreservation"),
+    ]
+
+    # The model declares the plain index, so the INCLUDE column does not raise
+    # models.W040 on databases without covering indexes.
+    operations = [
+        migrations.RunPython(build_covering_index, drop_covering_index),
+    ]
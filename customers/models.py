@@ -1,8 +1,7 @@
-from decimal import Decimal
 from django.db import models
-from django.db.models import F, Sum
 from accounts.models import User
 from books.models import Book, BookFormat
+from discounts.engine import price_cart
 from discounts.models import Discount
 from authors.models import Author
 from publishers.models import Publisher
@@ -80,48 +79,32 @@ class Cart(models.Model):
 
     @property
     def total_price_without_discount(self):
-        return self.items.aggregate(total=Sum(F('quantity') * F('book_format__price')))['total'] or 0
+        return self.get_pricing().subtotal
+
+    def get_pricing(self, user_for_check=None, items=None):
+        """
+        Snapshot of the cart's subtotal, weight, item count, discount and total
+        in one pass (see discounts.engine.CartPricing); `items` are CartItems
+        already loaded with their book_format, saving the query for them.
+        """
+        return price_cart(self, user_for_check, items=items)
 
     def get_discount_amount(self, user_for_check=None):
-        if not self.discount or not self.discount.is_active or self.discount.is_expired() or self.discount.is_fully_used():
-            return 0
-        if self.discount.min_purchase_amount and self.total_price_without_discount < self.discount.min_purchase_amount:
-            return 0
-        if user_for_check and self.discount.max_uses_per_customer:
-            usage = self.discount.usages.filter(user=user_for_check).first()
-            if usage and usage.use_count >= self.discount.max_uses_per_customer:
-                return 0
-        is_global = not (self.discount.applicable_books.exists() or self.discount.applicable_formats.exists() or self.discount.applicable_genres.exists() or self.discount.applicable_authors.exists())
-        eligible_price = 0
-        if is_global:
-            eligible_price = self.total_price_without_discount
-        else:
-            for item in self.items.all():
-                book = item.book_format.book
-                if (self.discount.applicable_books.filter(id=book.id).exists() or
-                    self.discount.applicable_formats.filter(id=item.book_format.id).exists() or
-                    self.discount.applicable_genres.filter(id__in=book.genres.values_list('id', flat=True)).exists() or
-                    self.discount.applicable_authors.filter(id__in=book.authors.values_list('id', flat=True)).exists()):
-                    eligible_price += item.get_total_price()
-        if eligible_price == 0: return 0
-        if self.discount.type == Discount.DiscountType.PERCENTAGE:
-            amount = (self.discount.value / Decimal('100')) * eligible_price
-        else:
-            amount = self.discount.value
-        return min(amount, eligible_price)
+        return self.get_pricing(user_for_check).discount_amount
 
     @property
     def total_price(self):
-        return self.total_price_without_discount - self.get_discount_amount(self.customer.user)
+        return self.get_pricing(self.customer.user).total
 
     def get_total_items(self):
-        return self.items.aggregate(total=Sum('quantity'))['total'] or 0
+        return self.get_pricing().item_count
 
     def get_total_weight(self):
-        return self.items.aggregate(total=Sum(F('quantity') * F('book_format__weight')))['total'] or 0
+        return self.get_pricing().weight
 
     def clear(self):
         self.items.all().delete()
+        self.reservations.all().delete()
         self.discount = None
         self.save()
 
@@ -134,6 +117,31 @@ class CartItem(models.Model):
         return self.book_format.price * self.quantity
 
 
+class StockReservation(models.Model):
+    """
+    Copies of an in-stock format held for a cart in checkout until
+    `expires_at` (see customers.checkout); the available stock of a format
+    is its stock minus its unexpired reservations.
+    """
+    cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='reservations')
+    book_format = models.ForeignKey(BookFormat, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('cart', 'book_format')
+        indexes = [
+            # Serves the per-format sum of active reservations; on PostgreSQL it also
+            # includes quantity (see migration 0011), which SQLite cannot.
+            models.Index(fields=['book_format', 'expires_at'], name='reservation_active_idx'),
+            models.Index(fields=['expires_at'], name='reservation_expires_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} x {self.book_format} until {self.expires_at}"
+
+
 class Wishlist(models.Model):
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='wishlist_items')
     book_format = models.ForeignKey(BookFormat, on_delete=models.CASCADE, related_name='wishlisted_by')
@@ -0,0 +1,11 @@
+from django.contrib.auth.signals import user_logged_in
+from django.dispatch import receiver
+from .cart_store import merge_cart_on_login
+
+
+@receiver(user_logged_in)
+def merge_anonymous_cart(sender, request, user, **kwargs):
+    """
+    Moves the cart the visitor filled before signing in into their own cart.
+    """
+    merge_cart_on_login(request, user)
@@ -1,8 +1,21 @@
-from django.test import TestCase, Client
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db.models import Sum
+from django.db import OperationalError, connection
+from django.utils import timezone
+from decimal import Decimal
+from django.test import TestCase, TransactionTestCase, Client
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 from books.models import Book, BookFormat
-from .models import Cart, CartItem, Invoice, InvoiceItem, Customer, Wishlist
+from .cart_store import CART_TOKEN_COOKIE, CacheCartStore
+from .checkout import InsufficientStock, available_stock, finalize_checkout, reserve_cart
+from .models import Cart, CartItem, Invoice, InvoiceItem, Customer, StockReservation, Wishlist
 from rest_framework import status
 
 class PreOrderTest(TestCase):
@@ -94,7 +107,7 @@ class WishlistAPITestCase(TestCase):
 
         response = self.client.get(self.wishlist_list_create_url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 2)
+        self.assertEqual(len(response.data['results']), 2)
 
     def test_remove_from_wishlist(self):
         # Add an item to the wishlist
@@ -119,8 +132,8 @@ class WishlistAPITestCase(TestCase):
         # Check that the current user only sees their own wishlist item
         response = self.client.get(self.wishlist_list_create_url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['book_format']['id'], self.book_format1.id)
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['book_format']['id'], self.book_format1.id)
 
     def test_user_can_only_delete_from_their_wishlist(self):
         # Create another user and their wishlist item
@@ -133,3 +146,333 @@ class WishlistAPITestCase(TestCase):
         response = self.client.delete(remove_url)
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
         self.assertTrue(Wishlist.objects.filter(id=other_wishlist_item.id).exists())
+
+
+class CheckoutTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = get_user_model().objects.create_user(username='buyer', password='password')
+        self.client.login(username='buyer', password='password')
+        self.customer = Customer.objects.create(user=self.user)
+        self.book = Book.objects.create(title='Savushun')
+        self.paperback = BookFormat.objects.create(book=self.book, format_name='Paperback', price=100, stock=5)
+        self.hardcover = BookFormat.objects.create(book=self.book, format_name='Hardcover', price=200, stock=1)
+        self.preorder = BookFormat.objects.create(
+            book=Book.objects.create(title='Sutra'), format_name='Hardcover', price=300, stock=0,
+            status=BookFormat.Status.PRE_ORDER,
+        )
+        self.cart = Cart.objects.create(customer=self.customer)
+        self.verify_url = reverse('customers:verify_payment')
+
+    def test_checkout_decrements_stock_and_empties_the_cart(self):
+        CartItem.objects.create(cart=self.cart, book_format=self.paperback, quantity=2)
+        CartItem.objects.create(cart=self.cart, book_format=self.hardcover, quantity=1)
+        CartItem.objects.create(cart=self.cart, book_format=self.preorder, quantity=1)
+
+        response = self.client.get(self.verify_url, {'Status': 'OK'})
+        self.assertRedirects(response, reverse('customers:order_complete'), fetch_redirect_response=False)
+
+        invoice = Invoice.objects.get()
+        self.assertEqual(invoice.total_price, 700)
+        self.assertEqual(
+            sorted(invoice.items.values_list('book_format__format_name', 'quantity', 'is_preorder')),
+            [('Hardcover', 1, False), ('Hardcover', 1, True), ('Paperback', 2, False)],
+        )
+        self.assertEqual(BookFormat.objects.get(pk=self.paperback.pk).stock, 3)
+        self.assertEqual(BookFormat.objects.get(pk=self.hardcover.pk).stock, 0)
+        self.assertEqual(BookFormat.objects.get(pk=self.preorder.pk).stock, 0)
+        self.assertEqual(Book.objects.get(pk=self.book.pk).sold_count, 3)
+        self.assertEqual(Book.objects.get(pk=self.preorder.book_id).sold_count, 1)
+        self.assertFalse(self.cart.items.exists())
+
+    def test_shortfall_rolls_the_whole_checkout_back(self):
+        CartItem.objects.create(cart=self.cart, book_format=self.paperback, quantity=2)
+        CartItem.objects.create(cart=self.cart, book_format=self.hardcover, quantity=2)
+
+        with self.assertRaises(InsufficientStock) as raised:
+            finalize_checkout(self.customer)
+        self.assertEqual([book_format.pk for book_format in raised.exception.book_formats], [self.hardcover.pk])
+
+        response = self.client.get(self.verify_url, {'Status': 'OK'})
+        self.assertRedirects(response, reverse('customers:cart_detail'), fetch_redirect_response=False)
+        self.assertFalse(Invoice.objects.exists())
+        self.assertEqual(BookFormat.objects.get(pk=self.paperback.pk).stock, 5)
+        self.assertEqual(Book.objects.get(pk=self.book.pk).sold_count, 0)
+        self.assertEqual(self.cart.items.count(), 2)
+
+    def test_checkout_queries_do_not_grow_with_the_cart(self):
+        formats = BookFormat.objects.bulk_create(
+            BookFormat(book=self.book, format_name=f'Edition {index}', price=10, stock=10) for index in range(10)
+        )
+        CartItem.objects.create(cart=self.cart, book_format=self.paperback, quantity=1)
+        with self.assertNumQueries(14):
+            finalize_checkout(self.customer)
+        CartItem.objects.bulk_create(CartItem(cart=self.cart, book_format=book_format) for book_format in formats)
+        with self.assertNumQueries(14):
+            finalize_checkout(self.customer)
+
+
+class ConcurrentCheckoutTests(TransactionTestCase):
+    BUYERS = 8
+    # SQLite has no row locks and refuses concurrent writers instead; they try again.
+    ATTEMPTS = 20
+
+    def buyers(self, book_format):
+        customers = []
+        for index in range(self.BUYERS):
+            customer = Customer.objects.create(user=get_user_model().objects.create_user(username=f'buyer{index}'))
+            CartItem.objects.create(cart=Cart.objects.create(customer=customer), book_format=book_format, quantity=1)
+            customers.append(customer)
+        return customers
+
+    def race(self, customers, checkout):
+        barrier = threading.Barrier(self.BUYERS)
+        outcomes = []
+
+        def buy(customer):
+            barrier.wait()
+            try:
+                for attempt in range(self.ATTEMPTS):
+                    try:
+                        checkout(customer)
+                        outcomes.append('sold')
+                        return
+                    except InsufficientStock:
+                        outcomes.append('short')
+                        return
+                    except OperationalError:
+                        time.sleep(0.01 * (attempt + 1))
+                outcomes.append('locked')
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=buy, args=(customer,)) for customer in customers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return outcomes
+
+    def test_parallel_buyers_never_oversell(self):
+        book = Book.objects.create(title='The Blind Owl')
+        book_format = BookFormat.objects.create(book=book, format_name='Paperback', price=100, stock=3)
+        outcomes = self.race(self.buyers(book_format), finalize_checkout)
+
+        sold = outcomes.count('sold')
+        book_format.refresh_from_db()
+        self.assertEqual(len(outcomes), self.BUYERS)
+        self.assertTrue(1 <= sold <= 3, outcomes)
+        self.assertEqual(book_format.stock, 3 - sold)
+        self.assertEqual(Invoice.objects.count(), sold)
+        self.assertEqual(Book.objects.get(pk=book.pk).sold_count, sold)
+        if connection.vendor == 'postgresql':
+            self.assertEqual(outcomes.count('short'), self.BUYERS - 3)
+
+    def test_parallel_reservations_never_overbook(self):
+        book = Book.objects.create(title='Haji Agha')
+        book_format = BookFormat.objects.create(book=book, format_name='Paperback', price=100, stock=3)
+        outcomes = self.race(self.buyers(book_format), reserve_cart)
+
+        reserved = outcomes.count('sold')
+        self.assertEqual(len(outcomes), self.BUYERS)
+        self.assertTrue(1 <= reserved <= 3, outcomes)
+        self.assertEqual(StockReservation.objects.aggregate(total=Sum('quantity'))['total'] or 0, reserved)
+        self.assertEqual(BookFormat.objects.get(pk=book_format.pk).stock, 3)
+        if connection.vendor == 'postgresql':
+            self.assertEqual(reserved, 3)
+
+
+class StockReservationTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.book = Book.objects.create(title='Tangsir')
+        self.paperback = BookFormat.objects.create(book=self.book, format_name='Paperback', price=100, stock=3)
+        self.preorder = BookFormat.objects.create(
+            book=self.book, format_name='Hardcover', price=300, stock=0, status=BookFormat.Status.PRE_ORDER,
+        )
+        self.first = self.customer('first', paperback=2, preorder=1)
+        self.second = self.customer('second', paperback=2)
+
+    def customer(self, username, paperback=0, preorder=0):
+        customer = Customer.objects.create(user=get_user_model().objects.create_user(username=username, password='password'))
+        cart = Cart.objects.create(customer=customer)
+        for book_format, quantity in ((self.paperback, paperback), (self.preorder, preorder)):
+            if quantity:
+                CartItem.objects.create(cart=cart, book_format=book_format, quantity=quantity)
+        return customer
+
+    def test_reservation_holds_stock_for_its_cart(self):
+        reserve_cart(self.first)
+        self.assertEqual(
+            list(StockReservation.objects.values_list('book_format_id', 'quantity')), [(self.paperback.pk, 2)],
+        )
+        self.assertEqual(available_stock(self.paperback), 1)
+        self.assertEqual(available_stock(self.paperback, exclude_cart=self.first.cart), 3)
+
+        with self.assertRaises(InsufficientStock):
+            reserve_cart(self.second)
+        with self.assertRaises(InsufficientStock):
+            finalize_checkout(self.second)
+        self.client.login(username='second', password='password')
+        response = self.client.post(reverse('customers:add_to_cart'), {'book_format_id': self.paperback.pk})
+        self.assertEqual(response.status_code, 400)
+
+        finalize_checkout(self.first)
+        self.assertEqual(BookFormat.objects.get(pk=self.paperback.pk).stock, 1)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_reserving_again_replaces_the_cart_reservations(self):
+        reserve_cart(self.first)
+        reserve_cart(self.first)
+        self.assertEqual(StockReservation.objects.get().quantity, 2)
+
+    def test_expired_reservations_are_not_held_and_get_released(self):
+        reserve_cart(self.first)
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(available_stock(self.paperback), 3)
+
+        self.client.login(username='second', password='password')
+        response = self.client.post(reverse('customers:reserve_cart'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('expires_at', response.data)
+
+        out = StringIO()
+        call_command('release_stock_reservations', stdout=out)
+        self.assertIn('Released 1 ', out.getvalue())
+        self.assertEqual(list(StockReservation.objects.values_list('cart__customer', flat=True)), [self.second.pk])
+
+    def test_reserve_view_reports_short_formats(self):
+        reserve_cart(self.first)
+        self.client.login(username='second', password='password')
+        response = self.client.post(reverse('customers:reserve_cart'))
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['book_format_ids'], [self.paperback.pk])
+
+
+class CartPricingSnapshotTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = get_user_model().objects.create_superuser(username='admin', password='password', email='a@example.com')
+        self.client.login(username='admin', password='password')
+        self.customer = Customer.objects.create(user=self.user)
+        self.cart = Cart.objects.create(customer=self.customer)
+        self.book = Book.objects.create(title='Kelidar')
+
+    def add_items(self, cart, count):
+        for _ in range(count):
+            book_format = BookFormat.objects.create(
+                book=self.book, format_name=f'Volume {BookFormat.objects.count() + 1}', price=100,
+                weight=Decimal('0.5'), stock=10,
+            )
+            CartItem.objects.create(cart=cart, book_format=book_format, quantity=2)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response
+
+    def test_snapshot_totals(self):
+        self.add_items(self.cart, 3)
+        pricing = self.cart.get_pricing(self.user)
+        self.assertEqual(
+            (pricing.subtotal, pricing.weight, pricing.item_count, pricing.eligible_subtotal, pricing.total),
+            (Decimal('600'), Decimal('3.0'), 6, 0, Decimal('600')),
+        )
+
+    def test_cart_detail_queries_do_not_grow_with_the_cart(self):
+        url = reverse('customers:cart_detail')
+        self.add_items(self.cart, 1)
+        expected, _ = self.count_queries(url)
+        self.add_items(self.cart, 10)
+        queries, response = self.count_queries(url)
+        self.assertEqual(queries, expected)
+        self.assertEqual(response.data['total_items'], 22)
+        self.assertEqual(response.data['total_price_with_discount'], Decimal('2200'))
+
+    def test_admin_changelist_queries_do_not_grow_with_carts(self):
+        url = reverse('admin:customers_cart_changelist')
+        self.add_items(self.cart, 2)
+        expected, _ = self.count_queries(url)
+        for index in range(5):
+            user = get_user_model().objects.create_user(username=f'shopper{index}')
+            cart = Cart.objects.create(customer=Customer.objects.create(user=user))
+            self.add_items(cart, 3)
+        queries, response = self.count_queries(url)
+        self.assertEqual(queries, expected)
+        self.assertContains(response, '600')
+
+
+class AnonymousCartTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.book = Book.objects.create(title='Shazdeh Ehtejab')
+        self.paperback = BookFormat.objects.create(book=self.book, format_name='Paperback', price=100, stock=5)
+        self.hardcover = BookFormat.objects.create(book=self.book, format_name='Hardcover', price=250, stock=2)
+        self.user = get_user_model().objects.create_user(username='visitor', password='password')
+
+    def add(self, book_format, quantity=1):
+        return self.client.post(reverse('customers:add_to_cart'), {'book_format_id': book_format.pk, 'quantity': quantity})
+
+    def test_visitor_cart_stays_out_of_the_database(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.add(self.paperback, 2)
+            self.assertEqual(response.status_code, 200)
+            token = response.data['cart_token']
+            self.assertEqual(response.cookies[CART_TOKEN_COOKIE].value, token)
+            self.add(self.hardcover)
+            response = self.client.get(reverse('customers:cart_detail'))
+        self.assertFalse([query for query in queries if not query['sql'].startswith('SELECT')])
+        self.assertFalse(Cart.objects.exists())
+        self.assertNotIn('cart_token', response.data)
+        self.assertEqual(response.data['total_items'], 3)
+        self.assertEqual(response.data['total_price_with_discount'], Decimal('450'))
+
+        # The token also works from the header, e.g. for mobile clients
+        other = Client()
+        response = other.get(reverse('customers:cart_detail'), HTTP_X_CART_TOKEN=token)
+        self.assertEqual(response.data['total_items'], 3)
+
+    def test_stock_is_checked_against_the_cached_quantity(self):
+        self.add(self.hardcover, 2)
+        response = self.add(self.hardcover)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.post(reverse('customers:remove_from_cart'), {'book_format_id': self.hardcover.pk}).status_code, 200)
+        self.assertEqual(self.client.get(reverse('customers:cart_detail')).data['total_items'], 1)
+
+    def test_login_merges_the_visitor_cart(self):
+        customer = Customer.objects.create(user=self.user)
+        cart = Cart.objects.create(customer=customer)
+        CartItem.objects.create(cart=cart, book_format=self.paperback, quantity=1)
+        token = self.add(self.paperback, 2).data['cart_token']
+        self.add(self.hardcover)
+
+        self.user.otp = '123456'
+        self.user.otp_expiration = timezone.now() + timedelta(minutes=5)
+        self.user.save()
+        response = self.client.get(reverse('otp_verify', args=['123456']))
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(
+            sorted(cart.items.values_list('book_format__format_name', 'quantity')),
+            [('Hardcover', 1), ('Paperback', 3)],
+        )
+        self.assertFalse(CacheCartStore.for_token(token).quantities)
+
+    def test_cached_cart_is_persisted_at_checkout(self):
+        customer = Customer.objects.create(user=self.user)
+        store = CacheCartStore.for_user(self.user)
+        store.set_quantity(self.paperback, 2)
+        self.client.login(username='visitor', password='password')
+
+        with self.settings(CART_CACHE_AUTHENTICATED=True):
+            self.assertEqual(self.client.get(reverse('customers:cart_detail')).data['total_items'], 2)
+            self.assertFalse(Cart.objects.exists())
+            response = self.client.get(reverse('customers:verify_payment'), {'Status': 'OK'})
+        self.assertRedirects(response, reverse('customers:order_complete'), fetch_redirect_response=False)
+
+        self.assertEqual(Invoice.objects.get(customer=self.user).total_price, 200)
+        self.assertEqual(BookFormat.objects.get(pk=self.paperback.pk).stock, 3)
+        self.assertFalse(Cart.objects.get(customer=customer).items.exists())
+        self.assertFalse(CacheCartStore.for_user(self.user).quantities)
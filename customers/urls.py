@@ -1,7 +1,7 @@
 from django.urls import path
 from .views import (
     AddToCartView, RemoveFromCartView, ClearCartView, CartDetailView,
-    ApplyDiscountView, CalculateShippingView, StartPaymentView, VerifyPaymentView,
+    ApplyDiscountView, ReserveCartView, CalculateShippingView, StartPaymentView, VerifyPaymentView,
     OrderCompleteView, InvoiceListView, WishlistView, WishlistDestroyView
 )
 
@@ -19,6 +19,7 @@ urlpatterns = [
     path('cart/shipping/', CalculateShippingView.as_view(), name='calculate_shipping'),
 
     # Payment
+    path('cart/reserve/', ReserveCartView.as_view(), name='reserve_cart'),
     path('payment/start/', StartPaymentView.as_view(), name='start_payment'),
     path('payment/verify/', VerifyPaymentView.as_view(), name='verify_payment'),
 
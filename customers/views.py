@@ -9,7 +9,10 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, generics, permissions, serializers
 from books.models import Book, BookFormat
+from discounts.engine import cached_discount
 from .serializers import CartItemSerializer, WishlistSerializer
+from .cart_store import CART_TOKEN_COOKIE, cart_timeout, get_cart_store
+from .checkout import DiscountUnavailable, EmptyCart, InsufficientStock, available_stock, finalize_checkout, reserve_cart
 from .utils import calculate_shipping_cost
 from .models import Cart, CartItem, Invoice, Discount, InvoiceItem, Address, Customer, Wishlist
 import requests
@@ -25,7 +28,28 @@ class CustomerMixin:
     def customer(self):
         return self.request.user.customer
 
-class AddToCartView(CustomerMixin, APIView):
+class CartStoreMixin:
+    """
+    The request's cart store (see customers.cart_store). A visitor whose cart
+    was just created gets its token back in the response, as `cart_token`
+    and a cookie.
+    """
+    @property
+    def cart_store(self):
+        if not hasattr(self, '_cart_store'):
+            self._cart_store = get_cart_store(self.request)
+        return self._cart_store
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        store = getattr(self, '_cart_store', None)
+        if store is not None and store.issued and store.saved:
+            if isinstance(response.data, dict):
+                response.data['cart_token'] = store.token
+            response.set_cookie(CART_TOKEN_COOKIE, store.token, max_age=cart_timeout(), httponly=True, samesite='Lax')
+        return response
+
+class AddToCartView(CartStoreMixin, APIView):
     def post(self, request, *args, **kwargs):
         book_format_id = request.data.get('book_format_id')
         if not book_format_id:
@@ -38,11 +62,13 @@ class AddToCartView(CustomerMixin, APIView):
         except (ValueError, TypeError):
             return Response({"message": "Invalid quantity."}, status=status.HTTP_400_BAD_REQUEST)
 
-        book_format = get_object_or_404(BookFormat, id=book_format_id)
+        book_format = get_object_or_404(BookFormat.objects.select_related('book'), id=book_format_id)
 
-        # Check stock for in-stock items
+        # Check stock for in-stock items; copies reserved for other carts in checkout are not available
         if book_format.status == BookFormat.Status.IN_STOCK:
-            if book_format.stock < quantity:
+            cart = self.cart_store.cart if self.cart_store.persistent else None
+            stock = available_stock(book_format, exclude_cart=cart)
+            if stock < quantity:
                 return Response({"message": f"Not enough stock for {book_format.book.title} ({book_format.format_name})."}, status=status.HTTP_400_BAD_REQUEST)
         # Prevent adding out-of-stock items
         elif book_format.status == BookFormat.Status.OUT_OF_STOCK:
@@ -51,20 +77,18 @@ class AddToCartView(CustomerMixin, APIView):
         elif book_format.status == BookFormat.Status.PRE_ORDER:
             pass  # No stock check needed for pre-orders
 
-        cart, _ = Cart.objects.get_or_create(customer=self.customer, defaults={'is_active': True})
-        cart_item, created = CartItem.objects.get_or_create(cart=cart, book_format=book_format, defaults={'quantity': 0})
+        in_cart = self.cart_store.quantity(book_format.pk)
 
         # Further stock check for in-stock items already in cart
         if book_format.status == BookFormat.Status.IN_STOCK:
-            if book_format.stock < cart_item.quantity + quantity:
+            if stock < in_cart + quantity:
                 return Response({"message": f"Total requested quantity exceeds stock for {book_format.book.title} ({book_format.format_name})."}, status=status.HTTP_400_BAD_REQUEST)
 
-        cart_item.quantity += quantity
-        cart_item.save()
+        self.cart_store.set_quantity(book_format, in_cart + quantity)
 
         return Response({"message": f"Added {book_format.book.title} ({book_format.format_name}) to your cart."}, status=status.HTTP_200_OK)
 
-class RemoveFromCartView(CustomerMixin, APIView):
+class RemoveFromCartView(CartStoreMixin, APIView):
     def post(self, request, *args, **kwargs):
         book_format_id = request.data.get('book_format_id')
         if not book_format_id:
@@ -77,79 +101,106 @@ class RemoveFromCartView(CustomerMixin, APIView):
         except (ValueError, TypeError):
             return Response({"message": "Invalid quantity."}, status=status.HTTP_400_BAD_REQUEST)
 
-        cart = get_object_or_404(Cart, customer=self.customer, is_active=True)
-        cart_item = get_object_or_404(CartItem, cart=cart, book_format_id=book_format_id)
+        book_format = get_object_or_404(BookFormat.objects.select_related('book'), id=book_format_id)
+        in_cart = self.cart_store.quantity(book_format.pk)
+        if not in_cart:
+            return Response({"message": "This item is not in your cart."}, status=status.HTTP_404_NOT_FOUND)
 
-        if cart_item.quantity < quantity_to_remove:
+        if in_cart < quantity_to_remove:
             return Response({"message": "Cannot remove more items than are in the cart."}, status=status.HTTP_400_BAD_REQUEST)
 
-        cart_item.quantity -= quantity_to_remove
-        if cart_item.quantity <= 0:
-            cart_item.delete()
-            message = f"Removed {cart_item.book_format.book.title} ({cart_item.book_format.format_name}) from your cart."
+        self.cart_store.set_quantity(book_format, in_cart - quantity_to_remove)
+        if in_cart == quantity_to_remove:
+            message = f"Removed {book_format.book.title} ({book_format.format_name}) from your cart."
         else:
-            cart_item.save()
-            message = f"Reduced quantity for {cart_item.book_format.book.title} ({cart_item.book_format.format_name})."
+            message = f"Reduced quantity for {book_format.book.title} ({book_format.format_name})."
 
         return Response({"message": message}, status=status.HTTP_200_OK)
 
-class ClearCartView(CustomerMixin, APIView):
+class ClearCartView(CartStoreMixin, APIView):
     def post(self, request, *args, **kwargs):
-        cart = get_object_or_404(Cart, customer=self.customer, is_active=True)
-        cart.clear()
+        self.cart_store.clear()
         return Response({"message": "Cart cleared successfully."}, status=status.HTTP_200_OK)
 
-class CartDetailView(CustomerMixin, APIView):
+class CartDetailView(CartStoreMixin, APIView):
     def get(self, request, *args, **kwargs):
-        cart, _ = Cart.objects.get_or_create(customer=self.customer)
+        # One query for the items, shared by the serializer and the pricing snapshot
+        items = self.cart_store.items()
         # Recalculate discount amount in case cart items changed
-        discount_amount = cart.get_discount_amount(user_for_check=request.user)
+        pricing = self.cart_store.pricing(user=request.user if request.user.is_authenticated else None, items=items)
 
         # Note: The serializer for CartItem might need to be updated
         # if it doesn't already show all necessary details.
-        cart_items_serializer = CartItemSerializer(cart.items.all(), many=True)
+        cart_items_serializer = CartItemSerializer(items, many=True)
 
         return Response({
             "cart_details": cart_items_serializer.data,
-            "total_price_without_discount": cart.total_price_without_discount,
-            "discount_amount": discount_amount,
-            "total_price_with_discount": cart.total_price,
-            "total_items": cart.get_total_items()
+            "total_price_without_discount": pricing.subtotal,
+            "discount_amount": pricing.discount_amount,
+            "total_price_with_discount": pricing.total,
+            "total_items": pricing.item_count
         }, status=status.HTTP_200_OK)
 
-class ApplyDiscountView(CustomerMixin, APIView):
+class ApplyDiscountView(CartStoreMixin, APIView):
     def post(self, request, *args, **kwargs):
         code = request.data.get('discount_code')
         if not code:
             # If code is empty, remove the discount
-            cart, _ = Cart.objects.get_or_create(customer=self.customer)
-            cart.discount = None
-            cart.save()
+            self.cart_store.set_discount(None)
             return Response({"message": "Discount removed."}, status=status.HTTP_200_OK)
 
-        try:
-            discount = Discount.objects.get(code__iexact=code)
-        except Discount.DoesNotExist:
+        discount = cached_discount(code)
+        if discount is None:
             return Response({"error": "Invalid discount code."}, status=status.HTTP_404_NOT_FOUND)
 
-        cart, _ = Cart.objects.get_or_create(customer=self.customer)
-        cart.discount = discount # Temporarily assign to check validity
-
-        calculated_amount = cart.get_discount_amount(user_for_check=request.user)
+        # Check validity against the cart before assigning it
+        user = request.user if request.user.is_authenticated else None
+        pricing = self.cart_store.pricing(user=user, discount=discount)
 
-        if calculated_amount > 0:
-            cart.save() # Persist the discount assignment
+        if pricing.discount_amount > 0:
+            self.cart_store.set_discount(discount) # Persist the discount assignment
             return Response({
                 "message": "Discount applied successfully.",
-                "discount_amount": str(calculated_amount),
-                "new_total_price": str(cart.total_price)
+                "discount_amount": str(pricing.discount_amount),
+                "new_total_price": str(pricing.total)
             }, status=status.HTTP_200_OK)
         else:
-            cart.discount = None # Remove invalid discount
-            cart.save()
+            self.cart_store.set_discount(None) # Remove invalid discount
             return Response({"error": "This discount code is not valid for your cart, has expired, or usage limit reached."}, status=status.HTTP_400_BAD_REQUEST)
 
 # ... other views ...
+class ReserveCartView(CartStoreMixin, APIView):
+    """
+    Starts checkout by holding the cart's in-stock copies for
+    settings.STOCK_RESERVATION_SECONDS, so payment cannot fail for stock
+    taken by someone else in the meantime. With `best_discount` the cart
+    gets the active discount that takes the most off it first.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        customer, _ = Customer.objects.get_or_create(user=request.user)
+        discount = None
+        if serializers.BooleanField().to_internal_value(request.data.get('best_discount', False)):
+            discount, _ = self.cart_store.best_discount(user=request.user)
+            if discount is not None:
+                self.cart_store.set_discount(discount)
+        if not self.cart_store.persistent:
+            self.cart_store.persist(customer, replace=True)
+        try:
+            expires_at = reserve_cart(customer)
+        except (Cart.DoesNotExist, EmptyCart):
+            return Response({"message": "Your cart is empty."}, status=status.HTTP_400_BAD_REQUEST)
+        except InsufficientStock as error:
+            return Response({
+                "error": f"Not enough stock for {', '.join(str(book_format) for book_format in error.book_formats)}.",
+                "book_format_ids": [book_format.pk for book_format in error.book_formats],
+            }, status=status.HTTP_409_CONFLICT)
+        data = {"message": "Cart reserved.", "expires_at": expires_at}
+        if discount is not None:
+            data["discount_code"] = discount.code
+        return Response(data, status=status.HTTP_200_OK)
+
 class CalculateShippingView(APIView):
     def get(self, request, *args, **kwargs): pass
 class StartPaymentView(View):
@@ -168,51 +219,34 @@ class VerifyPaymentView(CustomerMixin, View):
         is_payment_successful = status_param == 'OK'
 
         if is_payment_successful:
-            # Payment is successful
-            customer = self.customer
+            # Payment is successful; the invoice, stock and cart change together or not at all
+            store = get_cart_store(request)
+            if not store.persistent:
+                # A cart kept in the cache is written out only now
+                store.persist(self.customer, replace=True)
             try:
-                cart = Cart.objects.get(customer=customer)
-            except Cart.DoesNotExist:
+                finalize_checkout(self.customer)
+            except (Cart.DoesNotExist, EmptyCart):
                 # This case should ideally not happen if a user is at payment verification
                 messages.error(request, "سبد خرید شما یافت نشد.")
-                return redirect('cart_detail') # Redirect to a real cart detail URL
-
-            # Create Invoice from Cart
-            invoice = Invoice.objects.create(
-                customer=customer.user,
-                total_price=cart.total_price,
-                shipping_cost=0,  # Or calculate it
-                paid=True
-            )
-
-            for item in cart.items.all():
-                InvoiceItem.objects.create(
-                    invoice=invoice,
-                    book_format=item.book_format,
-                    quantity=item.quantity,
-                    price=item.book_format.price,
-                    is_preorder=(item.book_format.status == BookFormat.Status.PRE_ORDER)
-                )
-                #
-                # Decrease stock for non-pre-order items
-                if item.book_format.status == BookFormat.Status.IN_STOCK:
-                    item.book_format.stock -= item.quantity
-                    item.book_format.save(update_fields=['stock'])
-
-
-            # Record discount usage if a discount was applied to the cart
-            if cart.discount:
-                cart.discount.record_usage(customer.user)
-
-            # Here you would typically finalize the invoice, create shipping orders, etc.
-            # For now, we just clear the cart.
-            cart.clear()
-
+                return redirect('customers:cart_detail')
+            except InsufficientStock as error:
+                # Nothing was ordered; the payment has to be refunded
+                titles = '، '.join(str(book_format) for book_format in error.book_formats)
+                messages.error(request, f"موجودی این کالاها کافی نیست و سفارش ثبت نشد: {titles}")
+                return redirect('customers:cart_detail')
+            except DiscountUnavailable as error:
+                # Nothing was ordered; the payment has to be refunded
+                messages.error(request, f"ظرفیت استفاده از کد تخفیف {error.discount.code} تکمیل شده است و سفارش ثبت نشد.")
+                return redirect('customers:cart_detail')
+
+            if not store.persistent:
+                store.clear()
             messages.success(request, "پرداخت شما با موفقیت انجام شد و سفارش شما ثبت گردید.")
-            return redirect('order_complete') # Redirect to a real order completion URL
+            return redirect('customers:order_complete')
         else:
             messages.error(request, "پرداخت ناموفق بود یا توسط شما لغو شد.")
-            return redirect('cart_detail') # Redirect to a real cart detail URL
+            return redirect('customers:cart_detail')
 class OrderCompleteView(View):
     def get(self, request, *args, **kwargs): pass
 from .serializers import InvoiceSerializer
@@ -222,7 +256,7 @@ class InvoiceListView(generics.ListAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        return Invoice.objects.filter(customer=self.request.user)
+        return Invoice.objects.filter(customer=self.request.user).select_related('customer').prefetch_related('items__book_format')
 class UpdateInvoiceItemStatusView(APIView):
     def post(self, request, item_id, *args, **kwargs): pass
 
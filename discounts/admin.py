@@ -1,10 +1,30 @@
-from django.contrib import admin
+import csv
+
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
+from django.http import StreamingHttpResponse
+from .codes import code_rows, generate_codes, stop_campaign
 from .models import Discount, DiscountUsage
 
+
+class _Echo:
+    # csv.writer target that hands each row back for streaming
+    def write(self, value):
+        return value
+
+
+class GenerateCodesForm(ActionForm):
+    count = forms.IntegerField(required=False, min_value=1, initial=1000, label="تعداد کد")
+    prefix = forms.CharField(required=False, max_length=20, label="پیشوند")
+
+
 class DiscountAdmin(admin.ModelAdmin):
     list_display = ('code', 'type', 'value', 'start_date', 'end_date', 'is_active', 'times_used', 'max_uses')
     search_fields = ('code',)
-    list_filter = ('is_active', 'type', 'start_date', 'end_date')
+    list_filter = ('is_active', 'type', 'start_date', 'end_date', ('template', admin.EmptyFieldListFilter))
+    action_form = GenerateCodesForm
+    actions = ['generate_campaign_codes', 'stop_campaign_codes']
     ordering = ('-start_date',)
     filter_horizontal = ('applicable_books', 'applicable_formats', 'applicable_genres', 'applicable_authors')
     fieldsets = (
@@ -27,6 +47,40 @@ class DiscountAdmin(admin.ModelAdmin):
     )
     readonly_fields = ('times_used',)
 
+    @admin.action(description="ساخت کدهای یک‌بارمصرف کمپین (CSV)")
+    def generate_campaign_codes(self, request, queryset):
+        """
+        Generates single-use codes of the one selected template and returns
+        them as CSV. The codes are all created before the response starts, so
+        a dropped download never leaves a half-made campaign; see the
+        generate_discount_codes command for large campaigns.
+        """
+        if queryset.count() != 1 or queryset.filter(template__isnull=False).exists():
+            self.message_user(request, "Select exactly one campaign template.", messages.ERROR)
+            return None
+        form = self.action_form(request.POST)
+        form.fields['action'].choices = self.get_action_choices(request)
+        if not form.is_valid():
+            self.message_user(request, "Invalid number of codes.", messages.ERROR)
+            return None
+        template = queryset.get()
+        was_active = template.is_active
+        codes = list(generate_codes(template, form.cleaned_data['count'] or 1000, prefix=form.cleaned_data['prefix']))
+        if was_active:
+            self.message_user(request, f"{template.code} was deactivated; a campaign template cannot be redeemed itself.", messages.WARNING)
+        self.message_user(request, f"{sum(map(len, codes))} codes of {template.code} generated.", messages.SUCCESS)
+        writer = csv.writer(_Echo())
+        response = StreamingHttpResponse(
+            (writer.writerow(row) for row in code_rows(codes, template)), content_type='text/csv',
+        )
+        response['Content-Disposition'] = f'attachment; filename="{template.code}-codes.csv"'
+        return response
+
+    @admin.action(description="توقف کدهای کمپین")
+    def stop_campaign_codes(self, request, queryset):
+        stopped = sum(stop_campaign(template) for template in queryset.filter(template__isnull=True))
+        self.message_user(request, f"{stopped} campaign codes deactivated.", messages.SUCCESS)
+
 class DiscountUsageAdmin(admin.ModelAdmin):
     list_display = ('discount', 'user', 'use_count')
     search_fields = ('discount__code', 'user__username')
@@ -0,0 +1,100 @@
+import csv
+import secrets
+
+from book_store.cache import invalidate_catalog
+from .models import Discount, normalize_code
+
+# Upper-case letters and digits without the easily confused I, O, 0 and 1;
+# 32 symbols, so every random byte maps onto one of them evenly.
+CODE_ALPHABET = 'ABCDEFGHJKLMNPQRSTUVWXYZ23456789'
+
+DEFAULT_CODE_LENGTH = 10
+DEFAULT_BATCH_SIZE = 5000
+
+CSV_HEADER = ('code', 'type', 'value', 'start_date', 'end_date')
+
+
+def random_code(prefix='', length=DEFAULT_CODE_LENGTH):
+    return prefix + ''.join(CODE_ALPHABET[byte & 31] for byte in secrets.token_bytes(length))
+
+
+def generate_codes(template, count, prefix='', length=DEFAULT_CODE_LENGTH, max_uses=1, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Creates `count` random codes of the campaign `template`, `batch_size` rows
+    per bulk insert, and yields the codes of each batch as it is written.
+
+    The codes copy the template's type, value, dates and limits (each can be
+    used `max_uses` times) but not its applicability relations: discount
+    rules follow `template` (see discounts.engine.discount_rules). An active
+    template is deactivated first, as its own code would bypass the
+    single-use ones; stop_campaign() turns the codes off. Inserts
+    skip codes that already exist, and the batch is topped up until `count`
+    new codes were created, so collisions with other campaigns (or a
+    concurrent run) never fail the generation.
+    """
+    prefix = normalize_code(prefix)
+    remaining = count
+    try:
+        if template.is_active:
+            Discount.objects.filter(pk=template.pk).update(is_active=False)
+            template.is_active = False
+        while remaining:
+            batch = set()
+            while len(batch) < min(batch_size, remaining):
+                batch.add(random_code(prefix, length))
+            last_id = Discount.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+            Discount.objects.bulk_create(
+                (
+                    Discount(
+                        code=code, template=template, type=template.type, value=template.value,
+                        start_date=template.start_date, end_date=template.end_date, is_active=True,
+                        max_uses=max_uses, max_uses_per_customer=template.max_uses_per_customer,
+                        min_purchase_amount=template.min_purchase_amount,
+                    )
+                    for code in batch
+                ),
+                ignore_conflicts=True,
+            )
+            # Rows this insert created are newer than `last_id`; a code that already existed is not
+            created = list(
+                Discount.objects.filter(code__in=batch, template=template, pk__gt=last_id)
+                .values_list('code', flat=True)
+            )
+            remaining -= len(created)
+            yield created
+    finally:
+        # bulk_create sends no post_save; one bump covers every cached lookup
+        invalidate_catalog('discounts')
+
+
+def stop_campaign(template):
+    """
+    Deactivates the generated codes of `template`. Returns how many were active.
+    """
+    stopped = template.generated_codes.filter(is_active=True).update(is_active=False)
+    invalidate_catalog('discounts')
+    return stopped
+
+
+def code_rows(codes, template):
+    """
+    CSV rows (header first) of the batches of `codes` (see generate_codes),
+    one per code, produced as the batches are.
+    """
+    yield CSV_HEADER
+    details = (template.type, template.value, template.start_date.isoformat(), template.end_date.isoformat())
+    for batch in codes:
+        for code in batch:
+            yield (code, *details)
+
+
+def write_codes_csv(codes, template, stream):
+    """
+    Streams `codes` to `stream` as CSV. Returns the number of codes written.
+    """
+    writer = csv.writer(stream)
+    written = -1
+    for row in code_rows(codes, template):
+        writer.writerow(row)
+        written += 1
+    return written
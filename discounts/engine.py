@@ -0,0 +1,322 @@
+import time
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
+
+from book_store.cache import cached_catalog_data
+from books.models import Book
+from .models import Discount, DiscountUsage, normalize_code
+
+# Discount fields kept by the code lookup (see cached_discount).
+LOOKUP_FIELDS = (
+    'id', 'code', 'type', 'value', 'start_date', 'end_date', 'is_active',
+    'max_uses', 'times_used', 'max_uses_per_customer', 'min_purchase_amount', 'template_id',
+)
+
+# Discount relation -> the id set it restricts the discount to.
+APPLICABILITY_RELATIONS = {
+    'applicable_books': 'book_ids',
+    'applicable_formats': 'format_ids',
+    'applicable_genres': 'genre_ids',
+    'applicable_authors': 'author_ids',
+}
+
+
+class DiscountRules:
+    """
+    The applicability sets of a discount (books, formats, genres and authors);
+    a discount without any applies to the whole cart.
+    """
+    def __init__(self, book_ids=(), format_ids=(), genre_ids=(), author_ids=()):
+        self.book_ids = frozenset(book_ids)
+        self.format_ids = frozenset(format_ids)
+        self.genre_ids = frozenset(genre_ids)
+        self.author_ids = frozenset(author_ids)
+
+    @property
+    def is_global(self):
+        return not (self.book_ids or self.format_ids or self.genre_ids or self.author_ids)
+
+    def applies_to(self, line):
+        return (
+            self.is_global
+            or line.book_id in self.book_ids
+            or line.book_format_id in self.format_ids
+            or not self.genre_ids.isdisjoint(line.genre_ids)
+            or not self.author_ids.isdisjoint(line.author_ids)
+        )
+
+
+def has_generated_codes():
+    # Campaign templates only describe their generated codes and are never redeemed themselves.
+    return Exists(Discount.objects.filter(template=OuterRef('pk')))
+
+
+def _rule_ids(discount):
+    # Generated campaign codes share the applicability of their template.
+    source = Discount(pk=discount.template_id) if discount.template_id else discount
+    return {
+        name: list(getattr(source, relation).values_list('pk', flat=True))
+        for relation, name in APPLICABILITY_RELATIONS.items()
+    }
+
+
+def discount_rules(discount):
+    """
+    DiscountRules of `discount` (of its template, for generated codes),
+    cached until the applicability relations of any discount change (see
+    discounts.signals).
+    """
+    rules = getattr(discount, 'cached_rules', None)
+    if rules is not None:
+        return rules
+    source_id = discount.template_id or discount.pk
+    return DiscountRules(**cached_catalog_data('discounts', ['rules', source_id], lambda: _rule_ids(discount)))
+
+
+def _lookup_instance(fields, rules):
+    discount = Discount.from_db(DEFAULT_DB_ALIAS, LOOKUP_FIELDS, fields)
+    discount.cached_rules = DiscountRules(**rules)
+    return discount
+
+
+def cached_discount(code):
+    """
+    The discount with `code` (in any case), or None, without a query while
+    cached: its LOOKUP_FIELDS and applicability ids are kept until any
+    discount is saved or deleted, or one runs out of uses (see
+    discounts.signals and Discount.record_usage). The returned instance
+    carries its rules as `cached_rules`.
+    """
+    def compute():
+        discount = Discount.objects.filter(~has_generated_codes(), code=normalize_code(code)).first()
+        if discount is None:
+            # Unknown codes are cached too, as campaigns bring many mistyped ones
+            return {}
+        return {'fields': [getattr(discount, field) for field in LOOKUP_FIELDS], 'rules': _rule_ids(discount)}
+
+    data = cached_catalog_data('discounts', ['code', normalize_code(code)], compute)
+    if not data:
+        return None
+    return _lookup_instance(data['fields'], data['rules'])
+
+
+def _index_data():
+    """
+    The fields and applicability ids of every discount that is active, not
+    over and not used up, from one query per table. Campaign templates and
+    their generated codes (which belong to whoever received them) are left out.
+    """
+    active = Discount.objects.filter(
+        Q(max_uses__isnull=True) | Q(times_used__lt=F('max_uses')),
+        ~has_generated_codes(),
+        is_active=True, end_date__gte=timezone.now(), template__isnull=True,
+    )
+    discounts = {row[0]: list(row) for row in active.order_by('pk').values_list(*LOOKUP_FIELDS)}
+    rules = {pk: {name: [] for name in APPLICABILITY_RELATIONS.values()} for pk in discounts}
+    for relation, name in APPLICABILITY_RELATIONS.items():
+        field = Discount._meta.get_field(relation)
+        through = field.remote_field.through
+        target = field.m2m_reverse_field_name()
+        for discount_id, target_id in through.objects.filter(discount_id__in=list(discounts)).values_list(
+            'discount_id', f'{target}_id',
+        ):
+            rules[discount_id][name].append(target_id)
+    return {'discounts': discounts, 'rules': rules}
+
+
+class DiscountIndex:
+    """
+    Active discounts keyed by the books, formats, genres and authors they
+    apply to, plus the global ones, so that pricing a cart only evaluates
+    the discounts that can touch one of its lines.
+    """
+    def __init__(self, data):
+        self.discounts = {}
+        self.global_ids = []
+        self.by_rule = {name: defaultdict(list) for name in APPLICABILITY_RELATIONS.values()}
+        for pk, fields in data['discounts'].items():
+            discount = self.discounts[pk] = _lookup_instance(fields, data['rules'][pk])
+            if discount.cached_rules.is_global:
+                self.global_ids.append(pk)
+            for name, ids in data['rules'][pk].items():
+                for target_id in ids:
+                    self.by_rule[name][target_id].append(pk)
+        # Makes load_cart_lines fetch genre/author ids only when some discount needs them.
+        self.line_rules = DiscountRules(
+            genre_ids=self.by_rule['genre_ids'], author_ids=self.by_rule['author_ids'],
+        )
+
+    def candidates(self, lines):
+        ids = set(self.global_ids)
+        for line in lines:
+            ids.update(self.by_rule['book_ids'].get(line.book_id, ()))
+            ids.update(self.by_rule['format_ids'].get(line.book_format_id, ()))
+            for genre_id in line.genre_ids:
+                ids.update(self.by_rule['genre_ids'].get(genre_id, ()))
+            for author_id in line.author_ids:
+                ids.update(self.by_rule['author_ids'].get(author_id, ()))
+        return [self.discounts[pk] for pk in sorted(ids)]
+
+
+# The DiscountIndex built by this process, by the stamp it was cached under.
+_index_memo = {}
+
+
+def active_discount_index():
+    """
+    The DiscountIndex of all active discounts. Its data is cached in the
+    'discounts' namespace, so any discount change rebuilds it. Each process
+    keeps the built index until the stamp cached beside it changes, so a
+    request only reads that stamp.
+    """
+    stamp = cached_catalog_data('discounts', ['index-stamp'], time.time_ns)
+    index = _index_memo.get(stamp)
+    if index is None:
+        index = DiscountIndex(cached_catalog_data('discounts', ['index', stamp], _index_data))
+        _index_memo.clear()
+        _index_memo[stamp] = index
+    return index
+
+
+class CartLine:
+    __slots__ = ('book_format_id', 'book_id', 'quantity', 'unit_price', 'unit_weight', 'genre_ids', 'author_ids')
+
+    def __init__(self, book_format_id, book_id, quantity, unit_price, unit_weight):
+        self.book_format_id = book_format_id
+        self.book_id = book_id
+        self.quantity = quantity
+        self.unit_price = unit_price
+        self.unit_weight = unit_weight
+        self.genre_ids = ()
+        self.author_ids = ()
+
+    @property
+    def total(self):
+        return self.unit_price * self.quantity
+
+
+def load_cart_lines(cart, rules=None, items=None):
+    """
+    The cart's items as CartLines, built from `items` (CartItems with their
+    book_format already loaded) or one values() query, plus one query per
+    genre/author restriction of `rules` for the genre/author ids of their books.
+    """
+    if items is not None:
+        lines = [
+            CartLine(item.book_format_id, item.book_format.book_id, item.quantity,
+                     item.book_format.price, item.book_format.weight)
+            for item in items
+        ]
+    else:
+        lines = [
+            CartLine(*row) for row in cart.items.order_by('pk').values_list(
+                'book_format_id', 'book_format__book_id', 'quantity', 'book_format__price', 'book_format__weight',
+            )
+        ]
+    if rules is None or not lines:
+        return lines
+    book_ids = {line.book_id for line in lines}
+    for restriction, attribute, through, column in (
+        (rules.genre_ids, 'genre_ids', Book.genres.through, 'genre_id'),
+        (rules.author_ids, 'author_ids', Book.authors.through, 'author_id'),
+    ):
+        if not restriction:
+            continue
+        ids_by_book = defaultdict(set)
+        for book_id, related_id in through.objects.filter(book_id__in=book_ids).values_list('book_id', column):
+            ids_by_book[book_id].add(related_id)
+        for line in lines:
+            setattr(line, attribute, ids_by_book[line.book_id])
+    return lines
+
+
+def apply_discount(discount, lines, user=None):
+    """
+    `(eligible subtotal, amount)` of `discount` on `lines`: nothing when it is
+    inactive, expired, used up (in total or by `user`) or below its minimum
+    purchase; otherwise its percentage or fixed amount of the eligible lines,
+    capped at their total.
+    """
+    if not discount or not discount.is_active or discount.is_expired() or discount.is_fully_used():
+        return 0, 0
+    subtotal = sum((line.total for line in lines), Decimal(0))
+    if discount.min_purchase_amount and subtotal < discount.min_purchase_amount:
+        return 0, 0
+    if user is not None and discount.max_uses_per_customer:
+        uses = DiscountUsage.objects.filter(discount=discount, user=user).values_list('use_count', flat=True).first()
+        if uses is not None and uses >= discount.max_uses_per_customer:
+            return 0, 0
+
+    rules = discount_rules(discount)
+    eligible_price = sum((line.total for line in lines if rules.applies_to(line)), Decimal(0))
+    if eligible_price == 0:
+        return 0, 0
+    if discount.type == Discount.DiscountType.PERCENTAGE:
+        amount = (discount.value / Decimal('100')) * eligible_price
+    else:
+        amount = discount.value
+    return eligible_price, min(amount, eligible_price)
+
+
+class CartPricing:
+    """
+    Snapshot of a cart's totals, computed once from its lines: subtotal,
+    weight, item count, the subtotal the discount applies to, the discount and
+    the total.
+    """
+    def __init__(self, lines, eligible_subtotal=0, discount_amount=0):
+        self.lines = lines
+        self.subtotal = Decimal(0)
+        self.weight = Decimal(0)
+        self.item_count = 0
+        for line in lines:
+            self.subtotal += line.total
+            self.weight += (line.unit_weight or 0) * line.quantity
+            self.item_count += line.quantity
+        self.eligible_subtotal = eligible_subtotal
+        self.discount_amount = discount_amount
+        self.total = self.subtotal - discount_amount
+
+
+def best_discount(cart, user=None, items=None):
+    """
+    `(discount, CartPricing)` of the active discount that takes the most off
+    `cart` (None and the undiscounted pricing when none applies). Only the
+    candidates of active_discount_index() are evaluated, in memory, after the
+    cart lines and one usage lookup for `user`.
+    """
+    index = active_discount_index()
+    lines = load_cart_lines(cart, index.line_rules, items)
+    candidates = index.candidates(lines)
+
+    limited = [discount.pk for discount in candidates if discount.max_uses_per_customer]
+    uses = {}
+    if user is not None and limited:
+        uses = dict(DiscountUsage.objects.filter(user=user, discount_id__in=limited).values_list('discount_id', 'use_count'))
+
+    best, best_pricing = None, CartPricing(lines)
+    for discount in candidates:
+        if discount.max_uses_per_customer and uses.get(discount.pk, 0) >= discount.max_uses_per_customer:
+            continue
+        eligible, amount = apply_discount(discount, lines)
+        if amount > best_pricing.discount_amount:
+            best, best_pricing = discount, CartPricing(lines, eligible, amount)
+    return best, best_pricing
+
+
+def price_cart(cart, user=None, discount=None, items=None):
+    """
+    Prices `cart` with `discount` (its own by default) in memory, from the cart
+    lines (see load_cart_lines), the cached discount rules and at most one
+    usage lookup for `user`.
+    """
+    discount = cart.discount if discount is None else discount
+    rules = discount_rules(discount) if discount else None
+    lines = load_cart_lines(cart, rules, items)
+    if not discount:
+        return CartPricing(lines)
+    return CartPricing(lines, *apply_discount(discount, lines, user))
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+from discounts.codes import DEFAULT_BATCH_SIZE, DEFAULT_CODE_LENGTH, generate_codes, write_codes_csv
+from discounts.models import Discount, normalize_code
+
+
+class Command(BaseCommand):
+    help = (
+        'Generates random single-use codes for the campaign whose template is the discount TEMPLATE_CODE, '
+        'in bulk inserts, and streams them to CSV.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('template_code', help='Code of the discount whose value, dates and applicability the codes share.')
+        parser.add_argument('count', type=int, help='Number of codes to generate.')
+        parser.add_argument('path', nargs='?', default='-', help='Output CSV file; "-" (default) writes to stdout.')
+        parser.add_argument('--prefix', default='', help='Prefix of every code, e.g. "SPRING-".')
+        parser.add_argument('--length', type=int, default=DEFAULT_CODE_LENGTH, help='Random characters per code.')
+        parser.add_argument('--max-uses', type=int, default=1, help='Uses allowed per code.')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Codes created per bulk insert.')
+
+    def handle(self, *args, **options):
+        try:
+            template = Discount.objects.get(code=normalize_code(options['template_code']))
+        except Discount.DoesNotExist:
+            raise CommandError(f'No discount with the code {options["template_code"]}.')
+        if template.template_id:
+            raise CommandError('Codes can only be generated from a campaign template, not from a generated code.')
+        if options['count'] <= 0:
+            raise CommandError('count must be positive.')
+        if template.is_active:
+            self.stderr.write(self.style.WARNING(
+                f'{template.code} is deactivated: a campaign template cannot be redeemed itself.'
+            ))
+
+        codes = generate_codes(
+            template, options['count'], prefix=options['prefix'], length=options['length'],
+            max_uses=options['max_uses'], batch_size=options['batch_size'],
+        )
+        if options['path'] == '-':
+            write_codes_csv(codes, template, self.stdout)
+            self.stdout.flush()
+            return
+
+        with open(options['path'], 'w', newline='', encoding='utf-8') as handle:
+            written = write_codes_csv(codes, template, handle)
+        self.stdout.write(self.style.SUCCESS(f'Generated {written} codes of {template.code} into {options["path"]}.'))
@@ -0,0 +1,41 @@
+# Generated by Django 5.1.5 on 2026-10-18 18:05
+
+from django.db import migrations
+from django.db.models import Q
+from django.db.models.functions import Trim, Upper
+
+
+def normalize_codes(apps, schema_editor):
+    """
+    Strips and upper-cases existing codes (see discounts.models.normalize_code).
+    A code whose normalized form is already taken gets its pk as a suffix, so
+    every code is reachable by the normalized lookup afterwards.
+    """
+    Discount = apps.get_model("discounts", "Discount")
+    max_length = Discount._meta.get_field("code").max_length
+
+    taken = set(Discount.objects.values_list("code", flat=True))
+    for discount in Discount.objects.filter(~Q(code=Upper(Trim("code")))).order_by("pk"):
+        code = discount.code.strip().upper()
+        if code in taken:
+            suffix = f"-{discount.pk}"
+            code = code[:max_length - len(suffix)] + suffix
+            if code in taken:
+                raise RuntimeError(
+                    f"Cannot normalize discount code {discount.code!r} (pk={discount.pk}): "
+                    f"both its upper-case form and {code!r} are taken."
+                )
+        Discount.objects.filter(pk=discount.pk).update(code=code)
+        taken.discard(discount.code)
+        taken.add(code)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("discounts", "0002_remove_discount_percentage_and_more"),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_codes, migrations.RunPython.noop),
+    ]
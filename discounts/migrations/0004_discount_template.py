@@ -0,0 +1,26 @@
+# Generated by Django 5.1.5 on 2026-10-18 14:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("discounts", "0003_normalize_discount_codes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="discount",
+            name="template",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="generated_codes",
+                to="discounts.discount",
+                verbose_name="قالب کمپین",
+            ),
+        ),
+    ]
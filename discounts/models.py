@@ -1,9 +1,19 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Q
 from django.utils import timezone
 from django.conf import settings
+from book_store.cache import invalidate_catalog
 from books.models import Book, BookFormat, Genre
 from authors.models import Author
 
+
+def normalize_code(code):
+    """
+    Codes are stored upper-case, so lookups can use the unique index on `code`
+    instead of a case-insensitive scan.
+    """
+    return code.strip().upper()
+
 class Discount(models.Model):
     class DiscountType(models.TextChoices):
         PERCENTAGE = 'PERCENTAGE', 'درصد'
@@ -31,11 +41,21 @@ class Discount(models.Model):
     applicable_genres = models.ManyToManyField(Genre, blank=True, related_name="discounts", verbose_name="ژانرهای خاص")
     applicable_authors = models.ManyToManyField(Author, blank=True, related_name="discounts", verbose_name="نویسندگان خاص")
 
+    # Codes generated for a campaign (see discounts.codes) apply where their template does
+    template = models.ForeignKey(
+        'self', null=True, blank=True, on_delete=models.CASCADE, related_name="generated_codes",
+        verbose_name="قالب کمپین",
+    )
+
     def __str__(self):
         if self.type == self.DiscountType.PERCENTAGE:
             return f"{self.code} ({self.value}%)"
         return f"{self.code} ({self.value} تومان)"
 
+    def save(self, *args, **kwargs):
+        self.code = normalize_code(self.code)
+        super().save(*args, **kwargs)
+
     def is_expired(self):
         return timezone.now() < self.start_date or timezone.now() > self.end_date
 
@@ -45,16 +65,37 @@ class Discount(models.Model):
         return self.times_used >= self.max_uses
 
     def record_usage(self, user):
-        """Records a new use of this discount for a specific user."""
-        # Increment total uses
-        self.times_used += 1
+        """
+        Records a new use of this discount for a specific user. Both counters
+        go up in conditional UPDATEs whose WHERE clause checks `max_uses` and
+        `max_uses_per_customer`, so concurrent checkouts cannot lose updates or
+        exceed a limit; only the two rows are locked. Returns False, recording
+        nothing, once a limit is reached.
+        """
+        with transaction.atomic():
+            # Increment total uses unless they are used up
+            uses = Discount.objects.filter(Q(max_uses__isnull=True) | Q(times_used__lt=F('max_uses')), pk=self.pk)
+            if not uses.update(times_used=F('times_used') + 1):
+                # The cached lookups (see discounts.engine.cached_discount) may still count it as usable
+                invalidate_catalog('discounts')
+                return False
+
+            # Record usage for the specific user; the row is created without a race
+            DiscountUsage.objects.bulk_create([DiscountUsage(discount=self, user=user)], ignore_conflicts=True)
+            usage = DiscountUsage.objects.filter(discount=self, user=user)
+            if self.max_uses_per_customer is not None:
+                usage = usage.filter(use_count__lt=self.max_uses_per_customer)
+            if not usage.update(use_count=F('use_count') + 1):
+                # Undoes the total increment above
+                transaction.set_rollback(True)
+                return False
 
-        # Record usage for the specific user
-        usage, created = DiscountUsage.objects.get_or_create(discount=self, user=user)
-        usage.use_count += 1
-        usage.save()
+            if self.max_uses is not None and not Discount.objects.filter(pk=self.pk, times_used__lt=F('max_uses')).exists():
+                # That was the last use
+                invalidate_catalog('discounts')
 
-        self.save()
+        self.times_used += 1
+        return True
 
 class DiscountUsage(models.Model):
     """Tracks the usage of a discount by a specific user."""
@@ -1,19 +1,33 @@
 from rest_framework import serializers
-from .models import Discount
+from rest_framework.validators import UniqueValidator
+from .models import Discount, normalize_code
+
+
+class DiscountCodeField(serializers.CharField):
+    # کد پیش از بررسی یکتا بودن به حروف بزرگ تبدیل می‌شود
+    def to_internal_value(self, data):
+        return normalize_code(super().to_internal_value(data))
+
 
 class DiscountSerializer(serializers.ModelSerializer):
+    code = DiscountCodeField(max_length=50, validators=[UniqueValidator(queryset=Discount.objects.all())])
+
     class Meta:
         model = Discount
-        fields = ['id', 'code', 'percentage', 'start_date', 'end_date', 'is_active']
+        fields = [
+            'id', 'code', 'type', 'value', 'start_date', 'end_date', 'is_active',
+            'max_uses', 'times_used', 'max_uses_per_customer', 'min_purchase_amount',
+        ]
+
+    def validate(self, data):
+        def current(field):
+            return data.get(field, getattr(self.instance, field, None))
 
-    def validate_percentage(self, value):
         # بررسی درصد تخفیف برای اینکه منفی نباشد
-        if value < 0 or value > 100:
+        value = current('value')
+        if (current('type') or Discount.DiscountType.PERCENTAGE) == Discount.DiscountType.PERCENTAGE and value is not None and not 0 <= value <= 100:
             raise serializers.ValidationError("درصد تخفیف باید بین ۰ تا ۱۰۰ باشد.")
-        return value
-
-    def validate(self, data):
         # بررسی تاریخ‌ها برای اینکه تاریخ شروع بعد از تاریخ پایان نباشد
-        if data['start_date'] > data['end_date']:
+        if current('start_date') and current('end_date') and current('start_date') > current('end_date'):
             raise serializers.ValidationError("تاریخ شروع نمی‌تواند بعد از تاریخ پایان باشد.")
         return data
@@ -0,0 +1,27 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from book_store.cache import invalidate_catalog
+from .models import Discount
+
+
+@receiver(m2m_changed, sender=Discount.applicable_books.through)
+@receiver(m2m_changed, sender=Discount.applicable_formats.through)
+@receiver(m2m_changed, sender=Discount.applicable_genres.through)
+@receiver(m2m_changed, sender=Discount.applicable_authors.through)
+def invalidate_discount_rules(sender, instance, action, **kwargs):
+    """
+    Drops the cached applicability rules (see discounts.engine) when the
+    books, formats, genres or authors of a discount change.
+    """
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        invalidate_catalog('discounts')
+
+
+@receiver(post_save, sender=Discount)
+@receiver(post_delete, sender=Discount)
+def invalidate_discount_lookups(sender, instance, **kwargs):
+    """
+    Drops the cached code lookups (see discounts.engine.cached_discount) when
+    a discount is saved or deleted.
+    """
+    invalidate_catalog('discounts')
@@ -1,15 +1,34 @@
-from django.test import TestCase
+import csv
+import io
+from importlib import import_module
+import threading
+from itertools import chain
+from unittest import mock
+from django.core.cache import cache
+from django.apps import apps
+from django.contrib.messages import get_messages
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
 from django.utils import timezone
 from datetime import timedelta
 from decimal import Decimal
 
 from accounts.models import User
+from authors.models import Author
 from books.models import Book, BookFormat
+from genres.models import Genre
 from customers.models import Cart, CartItem, Customer
-from .models import Discount
+from .engine import best_discount, cached_discount, discount_rules
+from .models import Discount, DiscountUsage
 
 class DiscountLogicTest(TestCase):
     def setUp(self):
+        # Cached discount rules are keyed by id, which the test database reuses
+        cache.clear()
+
         # Users
         self.user = User.objects.create_user(username='testuser', password='password')
         self.customer = Customer.objects.create(user=self.user)
@@ -131,3 +150,393 @@ class DiscountLogicTest(TestCase):
         discount.refresh_from_db()
         self.assertEqual(discount.times_used, 2)
         self.assertEqual(discount.usages.first().use_count, 2)
+
+    def test_record_usage_stops_at_the_limits(self):
+        other = User.objects.create_user(username='other')
+        discount = self._discount(max_uses=2, max_uses_per_customer=1)
+
+        self.assertTrue(discount.record_usage(self.user))
+        # The per-customer limit leaves the total untouched
+        self.assertFalse(discount.record_usage(self.user))
+        discount.refresh_from_db()
+        self.assertEqual(discount.times_used, 1)
+
+        self.assertTrue(discount.record_usage(other))
+        self.assertFalse(discount.record_usage(User.objects.create_user(username='third')))
+        discount.refresh_from_db()
+        self.assertEqual(discount.times_used, 2)
+        self.assertEqual(sorted(discount.usages.values_list('use_count', flat=True)), [1, 1])
+
+    def _discount(self, **kwargs):
+        return Discount.objects.create(
+            code=kwargs.pop('code', 'RULES'),
+            type=Discount.DiscountType.PERCENTAGE,
+            value=kwargs.pop('value', 10),
+            start_date=timezone.now() - timedelta(days=1),
+            end_date=timezone.now() + timedelta(days=1),
+            **kwargs
+        )
+
+    def test_genre_and_author_specific_discount(self):
+        genre = Genre.objects.create(name='Novel')
+        author = Author.objects.create(first_name='Simin', last_name='Daneshvar', biography='')
+        self.book1.genres.add(genre)
+        self.book2.authors.add(author)
+        discount = self._discount()
+        self.cart.discount = discount
+        self.cart.save()
+
+        discount.applicable_genres.add(genre)
+        self.assertEqual(self.cart.get_discount_amount(self.user), Decimal('10.00'))
+        # The cached rules follow changes to the applicability relations
+        discount.applicable_authors.add(author)
+        self.assertEqual(self.cart.get_discount_amount(self.user), Decimal('20.00'))
+        discount.applicable_genres.clear()
+        self.assertEqual(self.cart.get_discount_amount(self.user), Decimal('10.00'))
+
+    def test_per_customer_limit(self):
+        discount = self._discount(max_uses_per_customer=1)
+        self.cart.discount = discount
+        self.cart.save()
+        self.assertEqual(self.cart.get_discount_amount(self.user), Decimal('20.00'))
+        discount.record_usage(self.user)
+        self.assertEqual(self.cart.get_discount_amount(self.user), 0)
+
+    def test_pricing_queries_do_not_grow_with_the_cart(self):
+        genre = Genre.objects.create(name='Novel')
+        author = Author.objects.create(first_name='Simin', last_name='Daneshvar', biography='')
+        discount = self._discount(max_uses_per_customer=3)
+        discount.applicable_genres.add(genre)
+        discount.applicable_authors.add(author)
+        self.cart.discount = discount
+        self.cart.save()
+        discount_rules(discount)
+
+        # Cart lines, the genre and author ids of their books, and the customer's usage.
+        with self.assertNumQueries(4):
+            self.cart.get_pricing(self.user)
+        for index in range(20):
+            book = Book.objects.create(title=f'Book {index + 3}')
+            book.genres.add(genre)
+            book.authors.add(author)
+            book_format = BookFormat.objects.create(book=book, format_name='Paperback', price=10, stock=5)
+            CartItem.objects.create(cart=self.cart, book_format=book_format, quantity=1)
+        with self.assertNumQueries(4):
+            pricing = self.cart.get_pricing(self.user)
+        self.assertEqual(pricing.subtotal, Decimal('400'))
+        self.assertEqual(pricing.discount_amount, Decimal('20'))
+        self.assertEqual(pricing.total, Decimal('380'))
+
+        # A global discount needs only the cart lines.
+        self.cart.discount = self._discount(code='GLOBAL')
+        discount_rules(self.cart.discount)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.cart.get_pricing().discount_amount, Decimal('40'))
+
+
+class DiscountLookupTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='shopper', password='password')
+        self.client.login(username='shopper', password='password')
+        self.cart = Cart.objects.create(customer=Customer.objects.create(user=self.user))
+        self.book = Book.objects.create(title='Jahan-e Ravan')
+        self.discount = Discount.objects.create(
+            code=' spring ', value=10, max_uses=5,
+            start_date=timezone.now() - timedelta(days=1), end_date=timezone.now() + timedelta(days=1),
+        )
+        self.url = reverse('discount-validate')
+
+    def add_items(self, count):
+        for _ in range(count):
+            book_format = BookFormat.objects.create(
+                book=self.book, format_name=f'Edition {BookFormat.objects.count() + 1}', price=100, stock=5,
+            )
+            CartItem.objects.create(cart=self.cart, book_format=book_format, quantity=1)
+
+    def test_codes_are_stored_upper_case(self):
+        self.assertEqual(Discount.objects.get(pk=self.discount.pk).code, 'SPRING')
+
+    def test_lookup_is_cached_until_a_discount_changes(self):
+        self.assertEqual(cached_discount('Spring').pk, self.discount.pk)
+        with self.assertNumQueries(0):
+            discount = cached_discount('SPRING ')
+            self.assertTrue(discount_rules(discount).is_global)
+        self.assertIsNone(cached_discount('nope'))
+        with self.assertNumQueries(0):
+            self.assertIsNone(cached_discount('NOPE'))
+
+        self.discount.is_active = False
+        self.discount.save()
+        self.assertFalse(cached_discount('spring').is_active)
+
+    def test_validate_queries_do_not_grow_with_the_cart(self):
+        self.add_items(1)
+        self.client.get(self.url, {'code': 'spring'})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, {'code': 'spring'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['discount_amount'], Decimal('10'))
+
+        self.add_items(10)
+        with self.assertNumQueries(len(queries)):
+            response = self.client.get(self.url, {'code': 'SPRING'})
+        self.assertEqual(response.data['eligible_subtotal'], Decimal('1100'))
+        self.assertEqual(response.data['total_price_with_discount'], Decimal('990'))
+
+    def test_validate_rejects_unknown_and_inapplicable_codes(self):
+        self.assertEqual(self.client.get(self.url, {'code': 'autumn'}).status_code, 404)
+        # Nothing in the cart to discount
+        self.assertEqual(self.client.get(self.url, {'code': 'spring'}).status_code, 400)
+
+        self.add_items(1)
+        Discount.objects.filter(pk=self.discount.pk).update(times_used=4)
+        self.assertTrue(self.discount.record_usage(self.user))
+        # Using up the last copy refreshes the cached lookup
+        self.assertEqual(self.client.get(self.url, {'code': 'spring'}).status_code, 400)
+
+
+class NormalizeCodesMigrationTests(TestCase):
+    def create(self, code):
+        discount = Discount.objects.create(
+            code='placeholder', start_date=timezone.now(), end_date=timezone.now() + timedelta(days=1),
+        )
+        # Bypass save() so the code is stored as it was before normalization
+        Discount.objects.filter(pk=discount.pk).update(code=code)
+        return discount
+
+    def test_codes_are_normalized_and_collisions_renamed(self):
+        upper = self.create('SPRING')
+        lower = self.create('spring')
+        padded = self.create(' Autumn ')
+        migration = import_module('discounts.migrations.0003_normalize_discount_codes')
+        migration.normalize_codes(apps, None)
+
+        codes = dict(Discount.objects.values_list('pk', 'code'))
+        self.assertEqual(codes[upper.pk], 'SPRING')
+        self.assertEqual(codes[lower.pk], f'SPRING-{lower.pk}')
+        self.assertEqual(codes[padded.pk], 'AUTUMN')
+
+
+class BestDiscountTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='bargain', password='password')
+        self.client.login(username='bargain', password='password')
+        self.cart = Cart.objects.create(customer=Customer.objects.create(user=self.user))
+        self.genre = Genre.objects.create(name='Poetry')
+        self.book = Book.objects.create(title='Divan')
+        self.book.genres.add(self.genre)
+        self.format = BookFormat.objects.create(book=self.book, format_name='Paperback', price=200, stock=5)
+        self.other = BookFormat.objects.create(book=Book.objects.create(title='Other'), format_name='Paperback', price=100, stock=5)
+        CartItem.objects.create(cart=self.cart, book_format=self.format, quantity=1)
+        CartItem.objects.create(cart=self.cart, book_format=self.other, quantity=1)
+        # Cart total is 300, 200 of it poetry
+
+    def _discount(self, code, **kwargs):
+        kwargs.setdefault('start_date', timezone.now() - timedelta(days=1))
+        kwargs.setdefault('end_date', timezone.now() + timedelta(days=1))
+        return Discount.objects.create(code=code, **kwargs)
+
+    def test_picks_the_largest_applicable_discount(self):
+        self._discount('GLOBAL5', value=5)
+        self._discount('POETRY20', value=20).applicable_genres.add(self.genre)
+        self._discount('ONCE100', type=Discount.DiscountType.FIXED_AMOUNT, value=100, max_uses_per_customer=1)
+        self._discount('EXPIRED90', value=90, end_date=timezone.now() - timedelta(hours=1))
+        self._discount('USEDUP90', value=90, max_uses=1, times_used=1)
+        self._discount('OTHERBOOK90', value=90).applicable_books.add(Book.objects.create(title='Not in cart'))
+
+        discount, pricing = best_discount(self.cart, self.user)
+        self.assertEqual((discount.code, pricing.discount_amount, pricing.total), ('ONCE100', 100, 200))
+
+        DiscountUsage.objects.create(discount=discount, user=self.user, use_count=1)
+        discount, pricing = best_discount(self.cart, self.user)
+        self.assertEqual((discount.code, pricing.eligible_subtotal, pricing.discount_amount), ('POETRY20', 200, 40))
+
+    def test_queries_do_not_grow_with_the_campaigns(self):
+        self._discount('POETRY20', value=20).applicable_genres.add(self.genre)
+        best_discount(self.cart, self.user)
+        # Cart lines and the genre ids of their books
+        with self.assertNumQueries(2):
+            best_discount(self.cart, self.user)
+
+        campaigns = Discount.objects.bulk_create(
+            Discount(code=f'CAMPAIGN{index}', value=index % 30, max_uses_per_customer=1,
+                     start_date=timezone.now() - timedelta(days=1), end_date=timezone.now() + timedelta(days=1))
+            for index in range(500)
+        )
+        Discount.applicable_books.through.objects.bulk_create(
+            Discount.applicable_books.through(discount=discount, book_id=self.book.pk if index % 50 == 0 else self.other.book_id)
+            for index, discount in enumerate(campaigns)
+        )
+        cache.clear()
+        best_discount(self.cart, self.user)
+        # ... and the customer's usage of the limited candidates
+        with self.assertNumQueries(3):
+            discount, pricing = best_discount(self.cart, self.user)
+        self.assertEqual((discount.code, pricing.discount_amount), ('POETRY20', 40))
+
+    def test_best_endpoint_and_checkout_option(self):
+        url = reverse('discount-best')
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self._discount('GLOBAL5', value=5)
+        response = self.client.get(url)
+        self.assertEqual((response.data['code'], response.data['discount_amount']), ('GLOBAL5', 15))
+
+        response = self.client.post(reverse('customers:reserve_cart'), {'best_discount': 'true'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['discount_code'], 'GLOBAL5')
+        self.assertEqual(Cart.objects.get(pk=self.cart.pk).discount.code, 'GLOBAL5')
+
+
+class DiscountCodeGenerationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.genre = Genre.objects.create(name='Drama')
+        self.template = Discount.objects.create(
+            code='SUMMER', value=25, is_active=False,
+            start_date=timezone.now() - timedelta(days=1), end_date=timezone.now() + timedelta(days=1),
+        )
+        self.template.applicable_genres.add(self.genre)
+
+    def generate(self, count, *args):
+        out = io.StringIO()
+        call_command('generate_discount_codes', 'summer', str(count), *args, stdout=out, stderr=io.StringIO())
+        return list(csv.reader(io.StringIO(out.getvalue())))
+
+    def test_codes_share_the_template_rules(self):
+        rows = self.generate(250, '--prefix', 'sum-', '--batch-size', '100')
+        self.assertEqual(rows[0], ['code', 'type', 'value', 'start_date', 'end_date'])
+        codes = [row[0] for row in rows[1:]]
+        self.assertEqual(len(set(codes)), 250)
+        self.assertTrue(all(code.startswith('SUM-') and len(code) == 14 for code in codes))
+        self.assertEqual(self.template.generated_codes.filter(code__in=codes, max_uses=1, is_active=True).count(), 250)
+        self.assertFalse(Discount.applicable_genres.through.objects.exclude(discount=self.template).exists())
+
+        # A generated code discounts what its template does
+        user = User.objects.create_user(username='reader')
+        cart = Cart.objects.create(customer=Customer.objects.create(user=user))
+        drama = Book.objects.create(title='Drama')
+        drama.genres.add(self.genre)
+        CartItem.objects.create(cart=cart, book_format=BookFormat.objects.create(book=drama, format_name='Paperback', price=100, stock=1))
+        CartItem.objects.create(cart=cart, book_format=BookFormat.objects.create(book=Book.objects.create(title='Other'), format_name='Paperback', price=100, stock=1))
+        cart.discount = cached_discount(codes[0])
+        self.assertEqual(cart.get_discount_amount(user), Decimal('25'))
+        # ... but is nobody's best discount
+        self.assertIsNone(best_discount(cart, user)[0])
+
+    def test_active_template_is_never_redeemable(self):
+        self.template.is_active = True
+        self.template.save()
+        codes = [row[0] for row in self.generate(2)[1:]]
+        self.template.refresh_from_db()
+        self.assertFalse(self.template.is_active)
+
+        # Even when switched back on, the template is neither looked up nor picked as best discount
+        self.template.is_active = True
+        self.template.save()
+        self.assertIsNone(cached_discount('summer'))
+        user = User.objects.create_user(username='reader')
+        cart = Cart.objects.create(customer=Customer.objects.create(user=user))
+        drama = Book.objects.create(title='Drama')
+        drama.genres.add(self.genre)
+        CartItem.objects.create(cart=cart, book_format=BookFormat.objects.create(book=drama, format_name='Paperback', price=100, stock=1))
+        self.assertIsNone(best_discount(cart, user)[0])
+        self.assertEqual(cached_discount(codes[0]).template_id, self.template.pk)
+
+    def test_stop_campaign_deactivates_the_codes(self):
+        codes = [row[0] for row in self.generate(3)[1:]]
+        self.assertIsNotNone(cached_discount(codes[0]))
+        admin = User.objects.create_superuser(username='marketing', password='password', email='m@example.com')
+        self.client.force_login(admin)
+        self.client.post(reverse('admin:discounts_discount_changelist'), {
+            'action': 'stop_campaign_codes', '_selected_action': [self.template.pk],
+        })
+        self.assertFalse(self.template.generated_codes.filter(is_active=True).exists())
+        self.assertFalse(cached_discount(codes[0]).is_active)
+
+    def test_collisions_are_replaced(self):
+        Discount.objects.create(code='TAKEN', value=5, start_date=timezone.now(), end_date=timezone.now())
+        codes = chain(['TAKEN', 'FRESH1', 'FRESH1'], (f'FRESH{index}' for index in range(2, 10)))
+        with mock.patch('discounts.codes.random_code', side_effect=lambda *args: next(codes)):
+            rows = self.generate(3, '--batch-size', '2')
+        self.assertEqual([row[0] for row in rows[1:]], ['FRESH1', 'FRESH2', 'FRESH3'])
+        self.assertIsNone(Discount.objects.get(code='TAKEN').template)
+
+    def test_admin_action_streams_csv(self):
+        self.template.is_active = True
+        self.template.save()
+        admin = User.objects.create_superuser(username='marketing', password='password', email='m@example.com')
+        self.client.force_login(admin)
+        response = self.client.post(reverse('admin:discounts_discount_changelist'), {
+            'action': 'generate_campaign_codes', '_selected_action': [self.template.pk], 'count': 30, 'prefix': 'x',
+        })
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        # Created before the download is read
+        self.template.refresh_from_db()
+        self.assertFalse(self.template.is_active)
+        self.assertEqual(self.template.generated_codes.count(), 30)
+        self.assertEqual(
+            [message.message for message in get_messages(response.wsgi_request)],
+            ['SUMMER was deactivated; a campaign template cannot be redeemed itself.', '30 codes of SUMMER generated.'],
+        )
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(len(rows), 31)
+        self.assertEqual(self.template.generated_codes.filter(code__startswith='X').count(), 30)
+
+
+class ConcurrentDiscountUsageTests(TransactionTestCase):
+    WORKERS = 8
+
+    def race(self, discount, users):
+        barrier = threading.Barrier(len(users))
+        outcomes = []
+
+        def use(user):
+            barrier.wait()
+            try:
+                outcomes.append('used' if discount.record_usage(user) else 'limit')
+            except OperationalError:
+                # SQLite has no row locks and refuses concurrent writers instead.
+                outcomes.append('locked')
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=use, args=(user,)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(outcomes), len(users))
+        discount.refresh_from_db()
+        return outcomes
+
+    def discount(self, **kwargs):
+        return Discount.objects.create(
+            code='RUSH', value=10, start_date=timezone.now() - timedelta(days=1),
+            end_date=timezone.now() + timedelta(days=1), **kwargs
+        )
+
+    def test_parallel_uses_never_exceed_max_uses(self):
+        discount = self.discount(max_uses=3)
+        users = [User.objects.create_user(username=f'rusher{index}') for index in range(self.WORKERS)]
+        outcomes = self.race(discount, users)
+
+        used = outcomes.count('used')
+        self.assertTrue(1 <= used <= 3, outcomes)
+        self.assertEqual(discount.times_used, used)
+        self.assertEqual(sum(discount.usages.values_list('use_count', flat=True)), used)
+        if connection.vendor == 'postgresql':
+            self.assertEqual(used, 3)
+
+    def test_parallel_uses_never_exceed_the_per_customer_limit(self):
+        discount = self.discount(max_uses_per_customer=2)
+        user = User.objects.create_user(username='rusher')
+        outcomes = self.race(discount, [user] * self.WORKERS)
+
+        used = outcomes.count('used')
+        self.assertTrue(1 <= used <= 2, outcomes)
+        self.assertEqual(discount.times_used, used)
+        self.assertEqual(discount.usages.get(user=user).use_count, used)
+        if connection.vendor == 'postgresql':
+            self.assertEqual(used, 2)
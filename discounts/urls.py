@@ -4,7 +4,8 @@ from .views import (
     DiscountUpdateView,
     DiscountDeleteView,
     DiscountListView,
-    DiscountValidateView
+    DiscountValidateView,
+    BestDiscountView
 )
 
 urlpatterns = [
@@ -13,4 +14,5 @@ urlpatterns = [
     path('delete/<int:pk>/', DiscountDeleteView.as_view(), name='discount-delete'),  # حذف تخفیف
     path('list/', DiscountListView.as_view(), name='discount-list'),  # مشاهده لیست تخفیف‌ها
     path('validate/', DiscountValidateView.as_view(), name='discount-validate'),  # بررسی اعتبار کد تخفیف
+    path('best/', BestDiscountView.as_view(), name='discount-best'),  # بهترین تخفیف برای سبد خرید
 ]
@@ -1,9 +1,10 @@
 from rest_framework import generics, status
 from rest_framework.response import Response
 from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from customers.cart_store import get_cart_store
+from .engine import best_discount, cached_discount
 from .models import Discount
 from .serializers import DiscountSerializer
-from django.utils import timezone
 
 # 1. ایجاد تخفیف (فقط ادمین)
 class DiscountCreateView(generics.CreateAPIView):
@@ -29,25 +30,60 @@ class DiscountListView(generics.ListAPIView):
     serializer_class = DiscountSerializer
     permission_classes = [IsAuthenticated]  # فقط کاربران احراز هویت‌شده می‌توانند لیست را ببینند
 
-# 5. بررسی اعتبار کد تخفیف
+# 5. بررسی اعتبار کد تخفیف روی سبد خرید کاربر
 class DiscountValidateView(generics.GenericAPIView):
+    """
+    Evaluates a code against the caller's cart in a constant number of
+    queries: the discount and its rules come from the cached lookup, the
+    cart from its store (see customers.cart_store).
+    """
     serializer_class = DiscountSerializer
     permission_classes = [IsAuthenticated]  # فقط کاربران احراز هویت‌شده مجاز به بررسی تخفیف هستند
 
     def get(self, request, *args, **kwargs):
-        code = self.request.query_params.get('code', None)
+        code = self.request.query_params.get('code', '').strip()
         if not code:
             return Response({"error": "لطفاً کد تخفیف را وارد کنید."}, status=status.HTTP_400_BAD_REQUEST)
 
-        try:
-            discount = Discount.objects.get(code=code)
-            if discount.is_valid():
-                return Response({
-                    "success": "کد تخفیف معتبر است.",
-                    "discount": discount.percentage,
-                    "valid_until": discount.end_date
-                }, status=status.HTTP_200_OK)
-            else:
-                return Response({"error": "کد تخفیف معتبر نیست یا منقضی شده است."}, status=status.HTTP_400_BAD_REQUEST)
-        except Discount.DoesNotExist:
+        discount = cached_discount(code)
+        if discount is None:
             return Response({"error": "کد تخفیف یافت نشد."}, status=status.HTTP_404_NOT_FOUND)
+        if not discount.is_active or discount.is_expired() or discount.is_fully_used():
+            return Response({"error": "کد تخفیف معتبر نیست یا منقضی شده است."}, status=status.HTTP_400_BAD_REQUEST)
+
+        pricing = get_cart_store(request).pricing(user=request.user, discount=discount)
+        if not pricing.discount_amount:
+            return Response({"error": "این کد تخفیف برای سبد خرید شما قابل استفاده نیست."}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            "success": "کد تخفیف معتبر است.",
+            "code": discount.code,
+            "type": discount.type,
+            "value": discount.value,
+            "valid_until": discount.end_date,
+            "eligible_subtotal": pricing.eligible_subtotal,
+            "discount_amount": pricing.discount_amount,
+            "total_price_with_discount": pricing.total,
+        }, status=status.HTTP_200_OK)
+
+# 6. پیدا کردن بهترین تخفیف برای سبد خرید کاربر
+class BestDiscountView(generics.GenericAPIView):
+    """
+    The active discount that takes the most off the caller's cart, found
+    through the index of active discounts (see discounts.engine.best_discount).
+    """
+    serializer_class = DiscountSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        discount, pricing = get_cart_store(request).best_discount(user=request.user)
+        if discount is None:
+            return Response({"error": "هیچ تخفیفی برای سبد خرید شما قابل استفاده نیست."}, status=status.HTTP_404_NOT_FOUND)
+        return Response({
+            "code": discount.code,
+            "type": discount.type,
+            "value": discount.value,
+            "valid_until": discount.end_date,
+            "eligible_subtotal": pricing.eligible_subtotal,
+            "discount_amount": pricing.discount_amount,
+            "total_price_with_discount": pricing.total,
+        }, status=status.HTTP_200_OK)
@@ -4,6 +4,7 @@ class Genre(models.Model):
     name = models.CharField(max_length=100, unique=True)  # نام ژانر
     description = models.TextField(blank=True, null=True)  # توضیحات
     created_at = models.DateTimeField(auto_now_add=True)  # تاریخ ایجاد
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)  # تاریخ آخرین تغییر
 
     def __str__(self):
         return self.name
@@ -1,7 +1,8 @@
 from rest_framework import serializers
+from book_store.serializers import SparseFieldsetMixin
 from .models import Genre
 
-class GenreSerializer(serializers.ModelSerializer):
+class GenreSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = Genre
         fields = ['id', 'name', 'description', 'created_at']
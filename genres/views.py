@@ -5,6 +5,8 @@ from rest_framework import status
 from .models import Genre
 from .serializers import GenreSerializer
 from rest_framework.exceptions import PermissionDenied
+from book_store.cache import cache_catalog_response
+from book_store.conditional import conditional_catalog_get, list_view_state
 
 
 # ایجاد و دریافت تمام ژانرها
@@ -21,13 +23,16 @@ class GenreListCreateView(generics.ListCreateAPIView):
         except Exception as e:
             return Response({"error": f"ایجاد ژانر با مشکل مواجه شد: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
 
+    @conditional_catalog_get(list_view_state)
+    @cache_catalog_response('genres')
     def get(self, request, *args, **kwargs):
         try:
-            genres = self.queryset.all()  # دریافت تمامی ژانرها
-            if not genres:
+            genres = self.get_queryset()  # دریافت تمامی ژانرها
+            if not genres.exists():
                 return Response({"message": "هیچ ژانری یافت نشد."}, status=status.HTTP_404_NOT_FOUND)
-            serializer = self.get_serializer(genres, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            page = self.paginate_queryset(genres)  # فقط یک صفحه از ژانرها
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
         except Exception as e:
             return Response({"error": f"خطا در دریافت ژانرها: {str(e)}"},
                             status=status.HTTP_500_INTERNAL_SERVER_ERROR)
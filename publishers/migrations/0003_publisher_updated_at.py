@@ -0,0 +1,70 @@
+# Generated by Django 5.1.5 on 2026-10-18 13:45
+
+from django.db import migrations, models
+from django.utils import timezone
+
+UPDATED_AT = models.DateTimeField(auto_now=True, db_index=True)
+
+
+def _field():
+    field = UPDATED_AT.clone()
+    field.set_attributes_from_name("updated_at")
+    return field
+
+
+def add_updated_at(apps, schema_editor):
+    model = apps.get_model("publishers", "Publisher")
+    field = _field()
+    if schema_editor.connection.vendor != "sqlite":
+        # Existing rows get the current time.
+        schema_editor.add_field(model, field)
+        return
+    # SQLite adds NOT NULL columns by rebuilding the table, which would
+    # recreate the PostgreSQL-only GIN indexes of the model state and drop the
+    # NOCASE ones; ADD COLUMN with a constant default avoids the rebuild.
+    table = schema_editor.quote_name(model._meta.db_table)
+    column = schema_editor.quote_name(field.column)
+    schema_editor.execute(
+        f"ALTER TABLE {table} ADD COLUMN {column} datetime NOT NULL DEFAULT '1970-01-01 00:00:00'"
+    )
+    schema_editor.execute(f"UPDATE {table} SET {column} = %s", [timezone.now()])
+    for sql in schema_editor._field_indexes_sql(model, field):
+        schema_editor.execute(sql)
+
+
+def remove_updated_at(apps, schema_editor):
+    model = apps.get_model("publishers", "Publisher")
+    field = _field()
+    if schema_editor.connection.vendor != "sqlite":
+        schema_editor.remove_field(model, field)
+        return
+    for index_name in schema_editor._constraint_names(
+        model, [field.column], index=True
+    ):
+        schema_editor.execute(schema_editor._delete_index_sql(model, index_name))
+    schema_editor.execute(
+        f"ALTER TABLE {schema_editor.quote_name(model._meta.db_table)} "
+        f"DROP COLUMN {schema_editor.quote_name(field.column)}"
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("publishers", "0002_publisher_autocomplete_indexes"),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddField(
+                    model_name="publisher",
+                    name="updated_at",
+                    field=models.DateTimeField(auto_now=True, db_index=True),
+                ),
+            ],
+            database_operations=[
+                migrations.RunPython(add_updated_at, remove_updated_at),
+            ],
+        ),
+    ]
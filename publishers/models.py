@@ -11,6 +11,7 @@ class Publisher(models.Model):
     description = models.TextField(null=True, blank=True)  # توضیحات مختصر درباره انتشارات
     logo = models.ImageField(upload_to='publishers/logos/', null=True, blank=True)  # لوگو انتشارات
     social_media_links = models.JSONField(null=True, blank=True)  # لینک‌های شبکه‌های اجتماعی (اختیاری)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)  # تاریخ آخرین تغییر
 
     def __str__(self):
         return self.name
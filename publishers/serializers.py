@@ -1,8 +1,12 @@
 from rest_framework import serializers
+from book_store.images import ImageDerivativesField
+from book_store.serializers import SparseFieldsetMixin
 from .models import Publisher
 
-class PublisherSerializer(serializers.ModelSerializer):
+class PublisherSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    logo_srcset = ImageDerivativesField(source='logo')  # نسخه‌های کوچک‌شده لوگو
+
     class Meta:
         model = Publisher
-        fields = ['id', 'name', 'established_date', 'address', 'website', 'email', 'phone_number', 'country', 'description', 'logo', 'social_media_links']
+        fields = ['id', 'name', 'established_date', 'address', 'website', 'email', 'phone_number', 'country', 'description', 'logo', 'logo_srcset', 'social_media_links']
         read_only_fields = ['id']  # فیلد id فقط برای خواندن باشد
@@ -4,6 +4,8 @@ from rest_framework.response import Response
 from rest_framework import status
 from .models import Publisher
 from .serializers import PublisherSerializer
+from book_store.cache import cache_catalog_response
+from book_store.conditional import conditional_catalog_get, list_view_state
 
 # نمایش لیست تمام انتشارات و ایجاد یک انتشارات جدید
 class PublisherListCreateView(generics.ListCreateAPIView):
@@ -14,12 +16,15 @@ class PublisherListCreateView(generics.ListCreateAPIView):
     def perform_create(self, serializer):
         serializer.save()  # ایجاد رکورد جدید
 
+    @conditional_catalog_get(list_view_state)
+    @cache_catalog_response('publishers')
     def get(self, request, *args, **kwargs):
         publishers = self.get_queryset()
-        if not publishers:
+        if not publishers.exists():
             return Response({"خطا": "هیچ انتشاراتی یافت نشد"}, status=status.HTTP_404_NOT_FOUND)
-        serializer = self.get_serializer(publishers, many=True)
-        return Response(serializer.data)
+        page = self.paginate_queryset(publishers)  # فقط یک صفحه از انتشارات
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
 
     def post(self, request, *args, **kwargs):
         if not request.user.is_staff:
@@ -0,0 +1,251 @@
+import logging
+
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils import timezone
+
+from books.models import Book
+from reviews.models import Review
+from .models import BookRecommendation
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RECOMMENDATIONS = 10
+# Most similar books kept per book.
+DEFAULT_NEIGHBORS = 50
+# Users scored and written per transaction.
+DEFAULT_CHUNK_SIZE = 2000
+# Cells of the dense similarity and score blocks (8 bytes each), and rating
+# pairs expanded at once; together they bound the memory of a refresh.
+DEFAULT_MAX_CELLS = 4_000_000
+DEFAULT_MAX_PAIRS = 4_000_000
+
+
+def _pointers(sorted_rows, size):
+    """
+    CSR row pointers of the entries of `sorted_rows` (row indices in order).
+    """
+    return np.concatenate(([0], np.cumsum(np.bincount(sorted_rows, minlength=size))))
+
+
+def _gather(pointers, rows):
+    """
+    Positions of every entry of `rows` in CSR arrays with `pointers`, and for
+    each position the index in `rows` it belongs to.
+    """
+    starts = pointers[rows]
+    lengths = pointers[rows + 1] - starts
+    owners = np.repeat(np.arange(len(rows)), lengths)
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return owners, np.repeat(starts, lengths) + offsets
+
+
+class RatingMatrix:
+    """
+    Review ratings as a sparse users x books matrix, in flat NumPy arrays
+    ordered by user (CSR) and by book (CSC). `users` and `books` map the row
+    and column indices back to primary keys.
+    """
+    def __init__(self, user_ids, book_ids, ratings):
+        self.users, user_rows = np.unique(user_ids, return_inverse=True)
+        self.books, book_columns = np.unique(book_ids, return_inverse=True)
+        ratings = ratings.astype(np.float64)
+        # Cosine similarity compares books by their columns scaled to unit length.
+        norms = np.sqrt(np.bincount(book_columns, weights=ratings ** 2, minlength=len(self.books)))
+        normalized = ratings / norms[book_columns]
+
+        order = np.lexsort((book_columns, user_rows))
+        self.user_pointers = _pointers(user_rows[order], len(self.users))
+        self.user_books = book_columns[order]
+        self.user_ratings = ratings[order]
+        self.user_weights = normalized[order]
+
+        order = np.argsort(book_columns, kind='stable')
+        self.book_pointers = _pointers(book_columns[order], len(self.books))
+        self.book_users = user_rows[order]
+        self.book_weights = normalized[order]
+
+    @classmethod
+    def from_reviews(cls, reviews=None):
+        """
+        Loads (user, book, rating) of `reviews` (every review by default) in one
+        streamed query, straight into NumPy arrays.
+        """
+        reviews = Review.objects.all() if reviews is None else reviews
+        rows = np.fromiter(
+            reviews.order_by().values_list('user_id', 'book_id', 'rating').iterator(chunk_size=10000),
+            dtype=[('user', np.int64), ('book', np.int64), ('rating', np.float64)],
+        )
+        return cls(rows['user'], rows['book'], rows['rating'])
+
+    @property
+    def user_degrees(self):
+        return np.diff(self.user_pointers)
+
+
+class ItemNeighbors:
+    """
+    The `neighbors` most similar books of every book of `matrix` by cosine
+    similarity of their rating columns, as (books x neighbors) arrays of
+    column indices and similarities.
+
+    Similarities are computed a block of books at a time: each block
+    expands the ratings of its readers into (book, other book) pairs summed
+    with np.bincount, within `max_cells` and `max_pairs`.
+    """
+    def __init__(self, matrix, neighbors=DEFAULT_NEIGHBORS, max_cells=DEFAULT_MAX_CELLS, max_pairs=DEFAULT_MAX_PAIRS):
+        count = len(matrix.books)
+        size = max(min(neighbors, count - 1), 0)
+        self.columns = np.zeros((count, size), dtype=np.int64)
+        self.similarities = np.zeros((count, size), dtype=np.float64)
+        if not size:
+            return
+
+        # Pairs a book expands to: the review counts of its readers
+        book_columns = np.repeat(np.arange(count), np.diff(matrix.book_pointers))
+        work = np.bincount(book_columns, weights=matrix.user_degrees[matrix.book_users], minlength=count)
+        cumulative = np.concatenate(([0], np.cumsum(work)))
+
+        start = 0
+        while start < count:
+            by_pairs = np.searchsorted(cumulative, cumulative[start] + max_pairs, side='right') - 1
+            end = min(count, start + max(max_cells // count, 1), max(by_pairs, start + 1))
+            self._fill(matrix, start, end, size)
+            start = end
+
+    def _fill(self, matrix, start, end, size):
+        count = len(matrix.books)
+        entries = np.arange(matrix.book_pointers[start], matrix.book_pointers[end])
+        rows = np.repeat(np.arange(end - start), np.diff(matrix.book_pointers[start:end + 1]))
+        owners, positions = _gather(matrix.user_pointers, matrix.book_users[entries])
+
+        keys = rows[owners] * count + matrix.user_books[positions]
+        values = matrix.book_weights[entries][owners] * matrix.user_weights[positions]
+        block = np.bincount(keys, weights=values, minlength=(end - start) * count).reshape(end - start, count)
+        # A book is not its own neighbour
+        block[np.arange(end - start), np.arange(start, end)] = 0
+
+        top = np.argpartition(-block, size - 1, axis=1)[:, :size]
+        self.columns[start:end] = top
+        self.similarities[start:end] = np.take_along_axis(block, top, axis=1)
+
+
+def score_users(matrix, neighbors, rows, count):
+    """
+    Book columns of the top `count` books for each of the user `rows`,
+    scored as the rating-weighted similarity of each book to the books the
+    user reviewed. Books the user reviewed and books scoring 0 are left out.
+    """
+    book_count = len(matrix.books)
+    owners, positions = _gather(matrix.user_pointers, rows)
+    books = matrix.user_books[positions]
+    size = neighbors.columns.shape[1]
+
+    keys = (np.repeat(owners, size) * book_count + neighbors.columns[books].ravel())
+    values = (matrix.user_ratings[positions][:, None] * neighbors.similarities[books]).ravel()
+    scores = np.bincount(keys, weights=values, minlength=len(rows) * book_count).reshape(len(rows), book_count)
+    scores[owners, books] = 0
+
+    top_count = min(count, book_count)
+    top = np.argpartition(-scores, top_count - 1, axis=1)[:, :top_count]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind='stable')
+    top = np.take_along_axis(top, order, axis=1)
+    top_scores = np.take_along_axis(top_scores, order, axis=1)
+    return [columns[values > 0] for columns, values in zip(top, top_scores)]
+
+
+def _popular_fill(chosen, reviewed, popular, count):
+    # Like get_hybrid_recommendations: best sellers fill the list, books the user reviewed last
+    seen = set(chosen)
+    for book_id in popular:
+        if len(chosen) >= count:
+            return chosen
+        if book_id not in seen and book_id not in reviewed:
+            chosen.append(book_id)
+            seen.add(book_id)
+    for book_id in popular:
+        if len(chosen) >= count:
+            break
+        if book_id not in seen:
+            chosen.append(book_id)
+            seen.add(book_id)
+    return chosen
+
+
+def _write(recommendations):
+    """
+    Replaces the BookRecommendation books of `{user_id: [book_id, ...]}` with
+    bulk inserts in one transaction.
+    """
+    through = BookRecommendation.recommendations.through
+    with transaction.atomic():
+        BookRecommendation.objects.bulk_create(
+            [BookRecommendation(user_id=user_id) for user_id in recommendations], ignore_conflicts=True,
+        )
+        ids = dict(
+            BookRecommendation.objects.filter(user_id__in=list(recommendations)).values_list('user_id', 'pk')
+        )
+        through.objects.filter(bookrecommendation_id__in=ids.values()).delete()
+        through.objects.bulk_create(
+            through(bookrecommendation_id=ids[user_id], book_id=book_id)
+            for user_id, book_ids in recommendations.items() for book_id in book_ids
+        )
+        BookRecommendation.objects.filter(pk__in=ids.values()).update(updated_at=timezone.now())
+
+
+def refresh_recommendations(
+    count=DEFAULT_RECOMMENDATIONS, neighbors=DEFAULT_NEIGHBORS, chunk_size=DEFAULT_CHUNK_SIZE,
+    max_cells=DEFAULT_MAX_CELLS, max_pairs=DEFAULT_MAX_PAIRS,
+):
+    """
+    Recomputes the BookRecommendation of every user with item-item
+    collaborative filtering: the reviews are loaded once into a RatingMatrix,
+    the neighbours of every book computed once (ItemNeighbors), and users
+    scored and written in chunks of `chunk_size`. Users with fewer than
+    `count` recommendations (e.g. without reviews) get best sellers, as in
+    get_hybrid_recommendations. Returns the number of users written.
+    """
+    matrix = RatingMatrix.from_reviews()
+    item_neighbors = ItemNeighbors(matrix, neighbors, max_cells=max_cells, max_pairs=max_pairs)
+    max_degree = int(matrix.user_degrees.max()) if len(matrix.users) else 0
+    popular = list(Book.objects.order_by('-sold_count', 'pk').values_list('pk', flat=True)[:count + max_degree])
+    logger.info('Scoring %d books reviewed by %d users', len(matrix.books), len(matrix.users))
+
+    # Score blocks hold one row of every book per user
+    chunk_size = max(1, min(chunk_size, max_cells // max(len(matrix.books), 1)))
+    user_ids = get_user_model().objects.order_by('pk').values_list('pk', flat=True)
+    written = 0
+    chunk = []
+    for user_id in user_ids.iterator(chunk_size=chunk_size):
+        chunk.append(user_id)
+        if len(chunk) == chunk_size:
+            written += _refresh_chunk(matrix, item_neighbors, np.array(chunk), popular, count)
+            chunk = []
+    if chunk:
+        written += _refresh_chunk(matrix, item_neighbors, np.array(chunk), popular, count)
+    return written
+
+
+def _refresh_chunk(matrix, item_neighbors, user_ids, popular, count):
+    scored = {}
+    if len(matrix.users):
+        rows = np.minimum(np.searchsorted(matrix.users, user_ids), len(matrix.users) - 1)
+        reviewers = matrix.users[rows] == user_ids
+        rows = rows[reviewers]
+        for user_id, row, columns in zip(
+            user_ids[reviewers].tolist(), rows, score_users(matrix, item_neighbors, rows, count),
+        ):
+            reviewed = matrix.user_books[matrix.user_pointers[row]:matrix.user_pointers[row + 1]]
+            scored[user_id] = (matrix.books[columns].tolist(), set(matrix.books[reviewed].tolist()))
+
+    recommendations = {}
+    for user_id in user_ids.tolist():
+        chosen, books_reviewed = scored.get(user_id, ([], set()))
+        chosen = _popular_fill(chosen, books_reviewed, popular, count)
+        if chosen:
+            recommendations[user_id] = chosen
+    if recommendations:
+        _write(recommendations)
+    return len(recommendations)
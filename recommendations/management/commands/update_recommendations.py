@@ -2,21 +2,45 @@ from django.core.management.base import BaseCommand
 from django.contrib.auth import get_user_model
 from recommendations.models import BookRecommendation
 from recommendations.logic import get_hybrid_recommendations
+from recommendations import engine
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
 class Command(BaseCommand):
-    help = 'Updates book recommendations for all users.'
+    help = (
+        'Updates book recommendations for all users with the batch item-item collaborative filtering '
+        'engine (recommendations.engine), or one user at a time with --per-user.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--per-user', action='store_true', help='Use get_hybrid_recommendations for each user (slow).')
+        parser.add_argument('--count', type=int, default=engine.DEFAULT_RECOMMENDATIONS, help='Books recommended per user.')
+        parser.add_argument('--neighbors', type=int, default=engine.DEFAULT_NEIGHBORS, help='Similar books kept per book.')
+        parser.add_argument('--chunk-size', type=int, default=engine.DEFAULT_CHUNK_SIZE, help='Users scored and written per transaction.')
+        parser.add_argument('--max-cells', type=int, default=engine.DEFAULT_MAX_CELLS, help='Cells of the dense blocks (8 bytes each).')
+        parser.add_argument('--max-pairs', type=int, default=engine.DEFAULT_MAX_PAIRS, help='Rating pairs expanded at once when comparing books.')
 
     def handle(self, *args, **options):
+        if not options['per_user']:
+            started = time.monotonic()
+            written = engine.refresh_recommendations(
+                count=options['count'], neighbors=options['neighbors'],
+                chunk_size=options['chunk_size'], max_cells=options['max_cells'], max_pairs=options['max_pairs'],
+            )
+            self.stdout.write(self.style.SUCCESS(
+                f'Updated recommendations for {written} users in {time.monotonic() - started:.1f}s.'
+            ))
+            return
+
         User = get_user_model()
         users = User.objects.all()
         self.stdout.write(f'Starting recommendation update for {users.count()} users...')
 
         for user in users:
             try:
-                recommendations = get_hybrid_recommendations(user)
+                recommendations = get_hybrid_recommendations(user, options['count'])
                 if recommendations:
                     recommendation_obj, created = BookRecommendation.objects.get_or_create(user=user)
                     recommendation_obj.recommendations.set(recommendations)
@@ -1,3 +1,4 @@
+from io import StringIO
 from django.test import TestCase
 from django.contrib.auth import get_user_model
 from django.core.management import call_command
@@ -6,6 +7,7 @@ from books.models import Book, Genre, Author
 from reviews.models import Review
 from .models import BookRecommendation
 from .logic import get_content_based_recommendations, get_collaborative_filtering_recommendations, get_hybrid_recommendations
+from .engine import ItemNeighbors, RatingMatrix, refresh_recommendations
 
 User = get_user_model()
 
@@ -65,11 +67,68 @@ class UpdateRecommendationsCommandTests(TestCase):
         Review.objects.create(user=self.user, book=self.book, rating=5)
 
     def test_update_recommendations_command(self):
-        call_command('update_recommendations')
+        call_command('update_recommendations', '--chunk-size', '1', '--max-pairs', '1', stdout=StringIO())
         self.assertTrue(BookRecommendation.objects.filter(user=self.user).exists())
         recommendation = BookRecommendation.objects.get(user=self.user)
         self.assertGreater(recommendation.recommendations.count(), 0)
 
+class RecommendationEngineTests(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create_user(username=f'reader{i}', password='password') for i in range(4)]
+        self.books = [Book.objects.create(title=f'Book {i}', sold_count=i) for i in range(5)]
+        ratings = [
+            (0, 0, 5), (0, 1, 4),
+            (1, 0, 5), (1, 1, 5), (1, 2, 4),
+            (2, 2, 5), (2, 3, 5),
+        ]
+        for user, book, rating in ratings:
+            Review.objects.create(user=self.users[user], book=self.books[book], rating=rating)
+
+    def recommended(self, user):
+        return list(BookRecommendation.objects.get(user=user).recommendations.values_list('pk', flat=True))
+
+    def test_item_neighbors(self):
+        matrix = RatingMatrix.from_reviews()
+        neighbors = ItemNeighbors(matrix, neighbors=1, max_cells=4)
+        columns = {book.pk: index for index, book in enumerate(self.books[:4])}
+        # Book 0 and book 1 have the same readers; blocks of one row give the same result
+        self.assertEqual(neighbors.columns[columns[self.books[0].pk], 0], columns[self.books[1].pk])
+        self.assertEqual(neighbors.columns[columns[self.books[3].pk], 0], columns[self.books[2].pk])
+        self.assertAlmostEqual(neighbors.similarities[columns[self.books[3].pk], 0], 5 / 41 ** 0.5)
+
+    def test_refresh_recommendations(self):
+        self.assertEqual(refresh_recommendations(count=1), 4)
+        # Readers of books 0 and 1 also read book 2
+        self.assertEqual(self.recommended(self.users[0]), [self.books[2].pk])
+
+        refresh_recommendations(count=3)
+        # Then best sellers fill the list, without the books already reviewed
+        self.assertCountEqual(self.recommended(self.users[0]), [self.books[2].pk, self.books[4].pk, self.books[3].pk])
+        # Without reviews only best sellers
+        self.assertCountEqual(self.recommended(self.users[3]), [self.books[4].pk, self.books[3].pk, self.books[2].pk])
+
+    def test_refresh_replaces_recommendations(self):
+        recommendation = BookRecommendation.objects.create(user=self.users[0])
+        recommendation.recommendations.set([self.books[0]])
+        refresh_recommendations(count=2)
+        self.assertNotIn(self.books[0].pk, self.recommended(self.users[0]))
+        self.assertEqual(BookRecommendation.objects.filter(user=self.users[0]).count(), 1)
+
+    def test_refresh_queries_are_fixed_per_chunk(self):
+        # reviews, books and users once, then per chunk: insert, ids, delete, insert, update (+ savepoints)
+        with self.assertNumQueries(3 + 7 * 2):
+            self.assertEqual(refresh_recommendations(count=2, chunk_size=3), 4)
+        for i in range(4, 10):
+            user = User.objects.create_user(username=f'reader{i}', password='password')
+            Review.objects.create(user=user, book=self.books[i % 5], rating=3)
+        with self.assertNumQueries(3 + 7 * 4):
+            self.assertEqual(refresh_recommendations(count=2, chunk_size=3), 10)
+        # Chunks give the same recommendations as one pass
+        by_chunks = {user.pk: set(self.recommended(user)) for user in User.objects.all()}
+        refresh_recommendations(count=2)
+        self.assertEqual(by_chunks, {user.pk: set(self.recommended(user)) for user in User.objects.all()})
+
+
 class BookRecommendationAPITests(TestCase):
     def setUp(self):
         self.user = User.objects.create_user(username='testuser', password='password')
@@ -83,8 +142,8 @@ class BookRecommendationAPITests(TestCase):
     def test_get_recommendations_authenticated(self):
         response = self.client.get('/recommendations/')
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['recommendations'][0]['title'], 'Recommended Book')
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['recommendations'][0]['title'], 'Recommended Book')
 
     def test_get_recommendations_unauthenticated(self):
         self.client.logout()
@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
 from django.core.validators import MinValueValidator, MaxValueValidator
 from books.models import Book
@@ -27,3 +27,23 @@ class Review(models.Model):
 
     def __str__(self):
         return f'نظر {self.user.username} برای کتاب {self.book.title}'
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the persisted values so reviews.signals can apply a delta
+        # to the book's rating aggregates instead of recomputing them.
+        instance._loaded_book_id = instance.__dict__.get('book_id')
+        instance._loaded_rating = instance.__dict__.get('rating')
+        return instance
+
+    def save(self, *args, **kwargs):
+        # The rating aggregates on Book are updated from signals; keep both writes in one transaction.
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+        self._loaded_book_id = self.book_id
+        self._loaded_rating = self.rating
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            return super().delete(*args, **kwargs)
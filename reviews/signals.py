@@ -0,0 +1,48 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from book_store.cache import invalidate_catalog
+from books.models import Book
+from .models import Review
+
+
+@receiver(post_save, sender=Review)
+def update_book_rating_on_save(sender, instance, created, **kwargs):
+    """
+    Applies the created/updated review to the stored rating aggregates of its book.
+    """
+    if created:
+        Book.apply_rating_change(instance.book_id, added=instance.rating)
+        return
+
+    loaded_book_id = getattr(instance, '_loaded_book_id', None)
+    loaded_rating = getattr(instance, '_loaded_rating', None)
+    if loaded_book_id is None or loaded_rating is None:
+        # The previous values are unknown (e.g. a deferred load), so rebuild from scratch.
+        Book.objects.get(pk=instance.book_id).refresh_rating_stats()
+        return
+
+    if loaded_book_id != instance.book_id:
+        Book.apply_rating_change(loaded_book_id, removed=loaded_rating)
+        Book.apply_rating_change(instance.book_id, added=instance.rating)
+    else:
+        Book.apply_rating_change(instance.book_id, added=instance.rating, removed=loaded_rating)
+
+
+@receiver(post_delete, sender=Review)
+def update_book_rating_on_delete(sender, instance, **kwargs):
+    """
+    Removes the deleted review from the stored rating aggregates of its book.
+    """
+    book_id = getattr(instance, '_loaded_book_id', None) or instance.book_id
+    rating = getattr(instance, '_loaded_rating', None) or instance.rating
+    Book.apply_rating_change(book_id, removed=rating)
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def invalidate_book_cache(sender, instance, **kwargs):
+    """
+    Reviews change the rating aggregates shown on the book list and detail pages.
+    """
+    book_ids = {getattr(instance, '_loaded_book_id', None), instance.book_id}
+    invalidate_catalog('books', book_ids=book_ids)
@@ -1,3 +1,6 @@
+from decimal import Decimal
+from io import StringIO
+from django.core.management import call_command
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
@@ -29,8 +32,8 @@ class ReviewAPITests(APITestCase):
         """Ensure any user can list reviews for a book."""
         response = self.client.get(self.list_create_url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['rating'], 4)
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['rating'], 4)
 
     def test_create_review_unauthenticated(self):
         """Ensure unauthenticated users cannot create a review."""
@@ -91,3 +94,61 @@ class ReviewAPITests(APITestCase):
         response = self.client.delete(self.detail_url)
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
         self.assertTrue(Review.objects.filter(pk=self.review.pk).exists())
+
+
+class BookRatingStatsTests(APITestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username='rater1', password='password123')
+        self.user2 = User.objects.create_user(username='rater2', password='password123')
+        self.book = Book.objects.create(title='Rated Book')
+
+    def test_stats_follow_review_create_update_delete(self):
+        review1 = Review.objects.create(book=self.book, user=self.user1, rating=5)
+        Review.objects.create(book=self.book, user=self.user2, rating=2)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.reviews_count, 2)
+        self.assertEqual(self.book.average_rating, Decimal('3.50'))
+        self.assertEqual(self.book.rating_histogram, {1: 0, 2: 1, 3: 0, 4: 0, 5: 1})
+
+        review1 = Review.objects.get(pk=review1.pk)
+        review1.rating = 3
+        review1.save()
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.reviews_count, 2)
+        self.assertEqual(self.book.average_rating, Decimal('2.50'))
+        self.assertEqual(self.book.rating_histogram, {1: 0, 2: 1, 3: 1, 4: 0, 5: 0})
+
+        Review.objects.filter(user=self.user2).delete()
+        review1.delete()
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.reviews_count, 0)
+        self.assertIsNone(self.book.average_rating)
+
+    def test_rebuild_rating_stats_command(self):
+        Review.objects.create(book=self.book, user=self.user1, rating=4)
+        Book.objects.filter(pk=self.book.pk).update(reviews_count=0, average_rating=None, rating_4_count=0)
+
+        call_command('rebuild_rating_stats', stdout=StringIO())
+
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.reviews_count, 1)
+        self.assertEqual(self.book.average_rating, Decimal('4.00'))
+        self.assertEqual(self.book.rating_4_count, 1)
+
+    def test_book_list_query_count_is_constant(self):
+        for i in range(5):
+            book = Book.objects.create(title=f'Book {i}')
+            Review.objects.create(book=book, user=self.user1, rating=4)
+
+        # Books + prefetched authors, translators, genres and formats; nothing per book.
+        with self.assertNumQueries(5):
+            response = self.client.get('/books/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_rating_filter_uses_stored_average(self):
+        Review.objects.create(book=self.book, user=self.user1, rating=5)
+        other = Book.objects.create(title='Poorly Rated')
+        Review.objects.create(book=other, user=self.user1, rating=1)
+
+        response = self.client.get('/books/', {'rating_min': 4})
+        self.assertEqual([b['title'] for b in response.data['results']], ['Rated Book'])
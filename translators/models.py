@@ -9,6 +9,7 @@ class Translator(models.Model):
     biography = models.TextField(null=True, blank=True)  # بیوگرافی (اختیاری)
     profile_picture = models.ImageField(upload_to='translator_pictures/', null=True, blank=True)  # عکس پروفایل
     rating = models.DecimalField(max_digits=3, decimal_places=2, null=True, blank=True)  # نمره (بین 0.00 تا 10.00)
+    updated_at = models.DateTimeField(auto_now=True)  # تاریخ آخرین تغییر
 
     def __str__(self):
         return f"{self.first_name} {self.last_name}"
@@ -1,15 +1,18 @@
 from rest_framework import serializers
+from book_store.images import ImageDerivativesField
+from book_store.serializers import SparseFieldsetMixin
 from .models import Translator
 from Language.serializers import LanguageSerializer
 import datetime
-class TranslatorSerializer(serializers.ModelSerializer):
+class TranslatorSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     languages = LanguageSerializer(many=True)  # برای زبان‌هایی که مترجم به آن‌ها مسلط است
     profile_picture = serializers.ImageField(required=False)  # برای عکس پروفایل، اختیاری است
+    profile_picture_srcset = ImageDerivativesField(source='profile_picture')  # نسخه‌های کوچک‌شده عکس پروفایل
     rating = serializers.DecimalField(max_digits=3, decimal_places=2, required=False)  # نمره مترجم
 
     class Meta:
         model = Translator
-        fields = ['id', 'first_name', 'last_name', 'birth_date', 'nationality', 'languages', 'biography', 'profile_picture', 'rating']
+        fields = ['id', 'first_name', 'last_name', 'birth_date', 'nationality', 'languages', 'biography', 'profile_picture', 'profile_picture_srcset', 'rating']
 
     def validate_rating(self, value):
         if value and (value < 0 or value > 10):
@@ -66,10 +66,11 @@ class TranslatorListView(generics.ListAPIView):
 
     def list(self, request, *args, **kwargs):
         queryset = self.get_queryset()
-        if not queryset:
+        if not queryset.exists():
             return Response({"error": "هیچ مترجمی یافت نشد", "detail": "در حال حاضر هیچ مترجمی در سیستم وجود ندارد."}, status=status.HTTP_404_NOT_FOUND)
-        serializer = self.get_serializer(queryset, many=True)
-        return Response({"success": "لیست مترجمان با موفقیت دریافت شد", "detail": "تمامی اطلاعات مترجمان دریافت شد.", "data": serializer.data})
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return Response({"success": "لیست مترجمان با موفقیت دریافت شد", "detail": "تمامی اطلاعات مترجمان دریافت شد.", "data": serializer.data, **self.paginator.get_links()})
 
 # 6. دریافت اطلاعات یک مترجم خاص (دسترسی عمومی)
 class TranslatorRetrieveView(generics.RetrieveAPIView):